@@ -1,19 +1,42 @@
-def get_page(session, page, model, url, query=None):
-    if not query:
-        query = {}
+import gevent.pool
+
+# max amount of pages fetched at the same time, once the amount of pages is known
+PAGE_CONCURRENCY = 8
+
+
+def get_page_raw(session, page, url, query=None):
+    query = dict(query or {})
     query["page"] = page
     resp = session.get(url, params=query)
+    pages = int(resp.headers.get("Pages", 0))
+    return resp.json(), pages
+
+
+def get_page(session, page, model, url, query=None):
+    data, pages = get_page_raw(session, page, url, query)
     output = []
-    for data in resp.json():
-        obj = model.new(datadict=data)
+    for item in data:
+        obj = model.new(datadict=item)
         output.append(obj)
-    pages = int(resp.headers.get("Pages", 0))
     return output, pages
 
 
-def get_all(session, model, url, query=None):
-    iter, pages = get_page(session, 1, model, url, query)
-    yield from iter
-    for i in range(2, pages + 1):
-        obj, _ = get_page(session, i, model, url, query)
-        yield from obj
+def get_all_raw(session, url, query=None, concurrency=PAGE_CONCURRENCY):
+    """
+    yield the items of all pages as dicts, in order
+
+    the first page tells how many pages there are,
+    the other pages are then fetched concurrently (at most concurrency at a time)
+    """
+    data, pages = get_page_raw(session, 1, url, query)
+    yield from data
+    if pages < 2:
+        return
+    pool = gevent.pool.Pool(concurrency)
+    for data, _ in pool.imap(lambda page: get_page_raw(session, page, url, query), range(2, pages + 1)):
+        yield from data
+
+
+def get_all(session, model, url, query=None, concurrency=PAGE_CONCURRENCY):
+    for item in get_all_raw(session, url, query, concurrency):
+        yield model.new(datadict=item)
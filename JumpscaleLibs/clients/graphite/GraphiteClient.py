@@ -1,7 +1,13 @@
 from Jumpscale import j
 
 import socket
+import struct
+import pickle
 import time
+from collections import deque
+
+import gevent
+import gevent.lock
 
 try:
     import urllib.request
@@ -12,6 +18,13 @@ except BaseException:
 
 JSConfigClient = j.baseclasses.object_config
 
+# max size of a single UDP packet, to stay below the usual MTU
+UDP_PACKET_SIZE = 1400
+# max datapoints in a single pickle message
+PICKLE_BATCH_SIZE = 500
+# seconds to connect to carbon, and for a send to carbon to make progress
+SOCKET_TIMEOUT = 5
+
 
 class GraphiteClient(JSConfigClient):
     _SCHEMATEXT = """
@@ -20,30 +33,182 @@ class GraphiteClient(JSConfigClient):
         server = "127.0.0.1" (ipaddr)
         carbon_port = 2003 (ipport)
         graphite_port = 8081 (ipport)
+        # pickle needs the carbon pickle receiver port (2004 by default) as carbon_port, and tcp
+        protocol = "plaintext,pickle" (E)
+        transport = "tcp,udp" (E)
+        # datapoints added are sent once there are flush_size of them, or every flush_interval seconds
+        flush_size = 500 (I)
+        flush_interval = 1 (I)
+        # max datapoints waiting to be sent, the oldest ones are dropped beyond it
+        buffer_size = 100000 (I)
         """
 
     def _init(self, **kwargs):
+        self._protocol_check()
         self._SERVER = self.server
         self._CARBON_PORT = self.carbon_port
         self._GRAPHITE_PORT = self.graphite_port
         self._url = "http://%s:%s/render" % (self._SERVER, self._GRAPHITE_PORT)
+        self._sock = None
+        self._buffer = deque(maxlen=self.buffer_size)
+        self._flusher = None
+        # sends share the connection, one at a time
+        self._lock = gevent.lock.Semaphore()
+        # while carbon can't be reached, only the background flush tries again
+        self._retry_at = 0
+        self.dropped = 0
+
+    def _update_trigger(self, key, value):
+        # reconnect with the new config on the next send
+        if key in ["server", "carbon_port", "protocol", "transport"]:
+            self._protocol_check()
+            self._SERVER = self.server
+            self._CARBON_PORT = self.carbon_port
+            self._disconnect()
+
+    def _protocol_check(self):
+        if str(self.protocol) == "pickle" and str(self.transport) == "udp":
+            raise j.exceptions.Value("carbon only receives the pickle protocol over tcp")
 
     def send(self, msg):
         """
+        send right away, over the connection kept open between sends
+
         e.g. foo.bar.baz 20
-        :param msg: message to be sent
+        :param msg: message to be sent, one "path value" datapoint per line
         :type msg: str
         """
-        out = ""
+        now = int(time.time())
+        datapoints = []
         for line in msg.split("\n"):
-            out += "%s %d\n" % (line, int(time.time()))
-        sock = socket.socket()
-        sock.connect((self._SERVER, self._CARBON_PORT))
-        sock.sendall(out)
-        sock.close()
+            if not line.strip():
+                continue
+            path, value = line.split(None, 1)
+            datapoints.append((path, value, now))
+        self._send(datapoints)
+
+    def add(self, path, value, timestamp=None):
+        """
+        buffer a datapoint, it is sent with the others once flush_size datapoints are buffered,
+        or by a background flush every flush_interval seconds
+
+        when the buffer is full (buffer_size) the oldest datapoint is dropped, see `dropped`
+
+        :param path: metric path, e.g. foo.bar.baz
+        :param value: number
+        :param timestamp: epoch of the datapoint, now by default
+        """
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append((path, value, int(timestamp or time.time())))
+        if self._flusher is None or self._flusher.dead:
+            self._flusher = gevent.spawn(self._flush_loop)
+        if len(self._buffer) >= self.flush_size and time.time() >= self._retry_at:
+            self.flush()
+
+    def flush(self):
+        """
+        send all buffered datapoints, they stay buffered if carbon can't be reached
+        """
+        if not self._buffer:
+            return
+        datapoints = list(self._buffer)
+        self._buffer.clear()
+        try:
+            self._send(datapoints)
+        except BaseException as e:
+            # put them back in front of the ones added meanwhile, the oldest get dropped when full
+            room = self._buffer.maxlen - len(self._buffer)
+            self.dropped += max(0, len(datapoints) - room)
+            self._buffer.extendleft(reversed(datapoints[-room:] if room else []))
+            if not isinstance(e, OSError):
+                raise
+            self._log_warning("could not send %s datapoints to carbon: %s" % (len(datapoints), e))
+            self._retry_at = time.time() + self.flush_interval
+
+    def _flush_loop(self):
+        while True:
+            gevent.sleep(self.flush_interval)
+            try:
+                self.flush()
+            except Exception as e:
+                self._log_error("could not flush datapoints to carbon: %s" % e)
+
+    def _connect(self):
+        if self._sock is None:
+            if str(self.transport) == "udp":
+                self._sock = socket.socket(socket.AF_INET, socket.SOCK_DGRAM)
+            else:
+                self._sock = socket.create_connection((self._SERVER, self._CARBON_PORT), timeout=SOCKET_TIMEOUT)
+        return self._sock
+
+    def _disconnect(self):
+        if self._sock is not None:
+            self._sock.close()
+            self._sock = None
+
+    def _encode(self, datapoints):
+        """
+        :return: list of messages (bytes) to send
+        """
+        if str(self.protocol) == "pickle":
+            messages = []
+            for i in range(0, len(datapoints), PICKLE_BATCH_SIZE):
+                batch = [(path, (timestamp, value)) for path, value, timestamp in datapoints[i : i + PICKLE_BATCH_SIZE]]
+                payload = pickle.dumps(batch, protocol=2)
+                messages.append(struct.pack("!L", len(payload)) + payload)
+            return messages
+        lines = [("%s %s %d\n" % (path, value, timestamp)).encode() for path, value, timestamp in datapoints]
+        if str(self.transport) != "udp":
+            return [b"".join(lines)]
+        # every packet holds whole lines
+        packets = []
+        packet = []
+        size = 0
+        for line in lines:
+            if packet and size + len(line) > UDP_PACKET_SIZE:
+                packets.append(b"".join(packet))
+                packet = []
+                size = 0
+            packet.append(line)
+            size += len(line)
+        if packet:
+            packets.append(b"".join(packet))
+        return packets
+
+    def _send(self, datapoints):
+        if not datapoints:
+            return
+        messages = self._encode(datapoints)
+        with self._lock:
+            # a connection carbon closed is only noticed when sending, so try once more on a new one
+            for attempt in range(2):
+                try:
+                    sock = self._connect()
+                    for message in messages:
+                        if str(self.transport) == "udp":
+                            sock.sendto(message, (self._SERVER, self._CARBON_PORT))
+                        else:
+                            sock.sendall(message)
+                    return
+                except OSError:
+                    self._disconnect()
+                    if attempt == 1:
+                        raise
+                except BaseException:
+                    # a message sent partly would garble the next ones on the connection
+                    self._disconnect()
+                    raise
 
     def close(self):
-        pass
+        """
+        send the buffered datapoints and close the connection
+        """
+        if self._flusher is not None:
+            self._flusher.kill()
+            self._flusher = None
+        self.flush()
+        self._disconnect()
 
     def query(self, query_=None, **kwargs):
         import requests
@@ -0,0 +1,229 @@
+"""
+Tfchain Client
+"""
+
+from Jumpscale import j
+
+import sqlite3
+
+JSBASE = j.baseclasses.object
+
+# blocks a block (and its transactions) has to be below the chain tip before it is considered final
+_CONFIRMATIONS = 10
+
+
+class TFChainCache(j.baseclasses.object):
+    """
+    On-disk cache of the final part of a tfchain, as reported by the explorers.
+
+    Blocks, transactions and spent outputs do not change anymore once they are
+    deep enough in the chain, those are stored in a sqlite db as the explorer returned them.
+    Every cached transaction is indexed on the unlockhashes it touches,
+    so once the chain is synced the history of an address can be answered locally.
+    """
+
+    def __init__(self, path, confirmations=_CONFIRMATIONS):
+        """
+        @param path: path of the sqlite db
+        @param confirmations: blocks a block has to be below the chain tip before it gets cached
+        """
+        JSBASE.__init__(self)
+        j.sal.fs.createDir(j.sal.fs.getDirName(path))
+        self.path = path
+        self.confirmations = confirmations
+        self._db = sqlite3.connect(path, isolation_level=None)
+        self._db.executescript(
+            """
+            CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER);
+            CREATE TABLE IF NOT EXISTS blocks (id TEXT PRIMARY KEY, height INTEGER UNIQUE, data TEXT);
+            CREATE TABLE IF NOT EXISTS transactions (id TEXT PRIMARY KEY, height INTEGER, data TEXT);
+            CREATE TABLE IF NOT EXISTS outputs (id TEXT PRIMARY KEY, data TEXT);
+            CREATE TABLE IF NOT EXISTS addresses (
+                unlockhash TEXT, txid TEXT, height INTEGER, PRIMARY KEY (unlockhash, txid)
+            ) WITHOUT ROWID;
+            CREATE TABLE IF NOT EXISTS multisig (
+                owner TEXT, address TEXT, PRIMARY KEY (owner, address)
+            ) WITHOUT ROWID;
+            """
+        )
+
+    def _meta_get(self, key):
+        row = self._db.execute("SELECT value FROM meta WHERE key = ?;", (key,)).fetchone()
+        return row[0] if row else -1
+
+    def _meta_set(self, key, value):
+        self._db.execute("INSERT OR REPLACE INTO meta (key, value) VALUES (?, ?);", (key, value))
+
+    @property
+    def tip_height(self):
+        """
+        height of the last block of the chain the last time we looked, -1 if unknown
+        """
+        return self._meta_get("tip_height")
+
+    @tip_height.setter
+    def tip_height(self, height):
+        if height > self.tip_height:
+            self._meta_set("tip_height", height)
+
+    @property
+    def synced_height(self):
+        """
+        all blocks up to this height are cached, -1 if none are
+        """
+        return self._meta_get("synced_height")
+
+    @synced_height.setter
+    def synced_height(self, height):
+        self._meta_set("synced_height", height)
+
+    def final(self, height):
+        """
+        True if the block at this height is deep enough in the chain to be cached
+        """
+        tip = self.tip_height
+        return height is not None and height >= 0 and tip >= 0 and tip - height >= self.confirmations
+
+    def block_get(self, value):
+        """
+        @param value: height or id of the block
+        @return: the block as the explorer reported it, None if not cached
+        """
+        if isinstance(value, int):
+            row = self._db.execute("SELECT data FROM blocks WHERE height = ?;", (value,)).fetchone()
+        else:
+            row = self._db.execute("SELECT data FROM blocks WHERE id = ?;", (str(value),)).fetchone()
+        return j.data.serializers.json.loads(row[0]) if row else None
+
+    def block_add(self, block):
+        """
+        cache a block, and all its transactions, if it is final
+        @param block: the block as the explorer reported it
+        @return: True if cached
+        """
+        height = int(block["height"])
+        if not self.final(height):
+            return False
+        self._db.execute("BEGIN;")
+        try:
+            self._db.execute(
+                "INSERT OR REPLACE INTO blocks (id, height, data) VALUES (?, ?, ?);",
+                (block["blockid"], height, j.data.serializers.json.dumps(block)),
+            )
+            for etxn in block.get("transactions", None) or []:
+                self._transaction_add(etxn, height)
+            self._db.execute("COMMIT;")
+        except BaseException:
+            self._db.execute("ROLLBACK;")
+            raise
+        return True
+
+    def transaction_get(self, txid):
+        """
+        @return: the transaction as the explorer reported it, None if not cached
+        """
+        row = self._db.execute("SELECT data FROM transactions WHERE id = ?;", (str(txid),)).fetchone()
+        return j.data.serializers.json.loads(row[0]) if row else None
+
+    def transaction_add(self, etxn):
+        """
+        cache a transaction if it is final
+        @param etxn: the transaction as the explorer reported it
+        @return: True if cached
+        """
+        if etxn.get("unconfirmed", False):
+            return False
+        height = int(etxn["height"])
+        if not self.final(height):
+            return False
+        self._db.execute("BEGIN;")
+        try:
+            self._transaction_add(etxn, height)
+            self._db.execute("COMMIT;")
+        except BaseException:
+            self._db.execute("ROLLBACK;")
+            raise
+        return True
+
+    def _transaction_add(self, etxn, height):
+        txid = etxn["id"]
+        self._db.execute(
+            "INSERT OR REPLACE INTO transactions (id, height, data) VALUES (?, ?, ?);",
+            (txid, height, j.data.serializers.json.dumps(etxn)),
+        )
+        # index the transaction on all unlockhashes it spends from or sends to
+        unlockhashes = set()
+        for key in ("coininputoutputs", "blockstakeinputoutputs"):
+            for output in etxn.get(key, None) or []:
+                unlockhashes.add(output["unlockhash"])
+        for key in ("coinoutputunlockhashes", "blockstakeunlockhashes"):
+            unlockhashes.update(etxn.get(key, None) or [])
+        unlockhashes.discard("")
+        self._db.executemany(
+            "INSERT OR IGNORE INTO addresses (unlockhash, txid, height) VALUES (?, ?, ?);",
+            [(unlockhash, txid, height) for unlockhash in unlockhashes],
+        )
+        # remember which addresses own the multisig addresses sent to
+        data = etxn["rawtransaction"].get("data", None) or {}
+        outputunlockhashes = etxn.get("coinoutputunlockhashes", None) or []
+        for idx, output in enumerate(data.get("coinoutputs", None) or []):
+            condition = output.get("condition", None) or {}
+            if condition.get("type") != 4 or idx >= len(outputunlockhashes):
+                continue
+            owners = (condition.get("data", None) or {}).get("unlockhashes", None) or []
+            self._db.executemany(
+                "INSERT OR IGNORE INTO multisig (owner, address) VALUES (?, ?);",
+                [(owner, outputunlockhashes[idx]) for owner in owners],
+            )
+
+    def output_get(self, id):
+        """
+        @return: the explorer response for a spent output, None if not cached
+        """
+        row = self._db.execute("SELECT data FROM outputs WHERE id = ?;", (str(id),)).fetchone()
+        return j.data.serializers.json.loads(row[0]) if row else None
+
+    def output_add(self, id, resp):
+        """
+        cache the explorer response for an output, if the output is spent and both
+        its creation and spend transaction are final, it cannot change anymore then
+        @return: True if cached
+        """
+        transactions = resp.get("transactions", None) or []
+        if len(transactions) != 2:
+            return False
+        for etxn in transactions:
+            if etxn.get("unconfirmed", False) or not self.final(int(etxn["height"])):
+                return False
+        self._db.execute(
+            "INSERT OR REPLACE INTO outputs (id, data) VALUES (?, ?);", (str(id), j.data.serializers.json.dumps(resp))
+        )
+        return True
+
+    def unlockhash_transactions(self, unlockhash):
+        """
+        @return: the cached transactions touching the unlockhash, as the explorer reported them
+        """
+        rows = self._db.execute(
+            "SELECT t.data FROM addresses a JOIN transactions t ON t.id = a.txid WHERE a.unlockhash = ?;",
+            (str(unlockhash),),
+        )
+        return [j.data.serializers.json.loads(row[0]) for row in rows]
+
+    def unlockhash_multisig_addresses(self, unlockhash):
+        """
+        @return: the multisig addresses co-owned by the unlockhash, as far as seen in the cached transactions
+        """
+        rows = self._db.execute("SELECT address FROM multisig WHERE owner = ? ORDER BY address;", (str(unlockhash),))
+        return [row[0] for row in rows]
+
+    @property
+    def stats(self):
+        """
+        nr of cached blocks, transactions, outputs and indexed addresses, tip and synced height
+        """
+        result = {"tip_height": self.tip_height, "synced_height": self.synced_height}
+        for table in ("blocks", "transactions", "outputs"):
+            result[table] = self._db.execute("SELECT count(*) FROM {};".format(table)).fetchone()[0]
+        result["addresses"] = self._db.execute("SELECT count(DISTINCT unlockhash) FROM addresses;").fetchone()[0]
+        return result
@@ -6,6 +6,9 @@ from Jumpscale import j
 
 import sys
 
+import gevent
+import gevent.pool
+
 from .types.ConditionTypes import UnlockHash, UnlockHashType, ConditionMultiSignature
 from .types.PrimitiveTypes import Hash, Currency
 from .types.IO import CoinOutput, BlockstakeOutput
@@ -16,6 +19,7 @@ from .types.transactions.Base import TransactionBaseClass
 from .types.transactions.Minting import TransactionV128
 from .TFChainWalletFactory import TFChainWalletFactory
 from .TFChainWallet import WalletBalance, MultiSigWalletBalance
+from .TFChainCache import TFChainCache
 
 _EXPLORER_NODES = {
     "STD": [
@@ -28,6 +32,9 @@ _EXPLORER_NODES = {
 
 _CHAIN_NETWORK_TYPES = sorted(["STD", "TEST", "DEV"])
 
+# nr of blocks fetched at the same time when syncing the local cache
+_SYNC_CONCURRENCY = 8
+
 
 class TFChainClient(j.baseclasses.factory_data_testtools):
     """
@@ -39,6 +46,8 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
         name** = "" (S)
         network_type = "STD,TEST,DEV" (E)
         explorer_nodes = (LS)
+        # keep the final part of the chain in a local cache, see `sync`
+        local_cache = False (B)
         """
 
     _CHILDCLASSES = [TFChainWalletFactory]
@@ -48,6 +57,8 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
         self._minter = TFChainMinterClient(self)
         self._erc20 = TFChainERC20Client(self)
         self._authcoin = TfChainAuthcoinClient(self)
+        self._cache = None
+        self._syncer = None
 
     @property
     def threebot(self):
@@ -77,6 +88,20 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
         """
         return self._authcoin
 
+    @property
+    def cache(self):
+        """
+        Local cache of the final blocks, transactions and spent outputs, None if local_cache is disabled.
+        """
+        if not self.local_cache:
+            return None
+        if self._cache is None:
+            path = j.sal.fs.joinPaths(
+                j.dirs.VARDIR, "tfchain", "cache", "{}_{}.sqlite".format(self.name, str(self.network).lower())
+            )
+            self._cache = TFChainCache(path)
+        return self._cache
+
     @property
     def explorer_addresses(self):
         """
@@ -109,6 +134,8 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
         """
         resp = self.explorer_get(endpoint="/explorer")
         resp = j.data.serializers.json.loads(resp)
+        if self.cache is not None:
+            self.cache.tip_height = int(resp["height"])
         blockid = Hash.from_json(obj=resp["blockid"])
         last_block = self.block_get(blockid)
         return ExplorerBlockchainInfo(last_block=last_block)
@@ -121,6 +148,12 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
         """
         endpoint = "/explorer/?"
         resp = {}
+        if not isinstance(value, int):
+            value = self._normalize_id(value)
+        if self.cache is not None:
+            resp = self.cache.block_get(value)
+            if resp is not None:
+                return self._block_from_explorer_block(resp, endpoint="cache")
         try:
             # get the explorer block
             if isinstance(value, int):
@@ -129,7 +162,7 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
                 resp = j.data.serializers.json.loads(resp)
                 resp = resp["block"]
             else:
-                blockid = self._normalize_id(value)
+                blockid = value
                 endpoint = "/explorer/hashes/" + blockid
                 resp = self.explorer_get(endpoint=endpoint)
                 resp = j.data.serializers.json.loads(resp)
@@ -142,6 +175,16 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
                     raise j.clients.tfchain.errors.ExplorerInvalidResponse(
                         "expected block ID '{}' not '{}'".format(blockid, resp["blockid"]), endpoint, resp
                     )
+        except KeyError as exc:
+            # return a KeyError as an invalid Explorer Response
+            raise j.clients.tfchain.errors.ExplorerInvalidResponse(str(exc), endpoint, resp) from exc
+        block = self._block_from_explorer_block(resp, endpoint=endpoint)
+        if self.cache is not None:
+            self.cache.block_add(resp)
+        return block
+
+    def _block_from_explorer_block(self, resp, endpoint="/?"):
+        try:
             # parse the transactions
             transactions = []
             for etxn in resp["transactions"]:
@@ -194,6 +237,10 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
         @param txid: the identifier (bytes, bytearray, hash or string) that points to the desired transaction
         """
         txid = self._normalize_id(txid)
+        if self.cache is not None:
+            etxn = self.cache.transaction_get(txid)
+            if etxn is not None:
+                return self._transaction_from_explorer_transaction(etxn, endpoint="cache", resp=etxn)
         endpoint = "/explorer/hashes/" + txid
         resp = self.explorer_get(endpoint=endpoint)
         resp = j.data.serializers.json.loads(resp)
@@ -207,7 +254,10 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
                 raise j.clients.tfchain.errors.ExplorerInvalidResponse(
                     "expected transaction ID '{}' not '{}'".format(txid, resp["id"]), endpoint, resp
                 )
-            return self._transaction_from_explorer_transaction(resp, endpoint=endpoint, resp=resp)
+            transaction = self._transaction_from_explorer_transaction(resp, endpoint=endpoint, resp=resp)
+            if self.cache is not None:
+                self.cache.transaction_add(resp)
+            return transaction
         except KeyError as exc:
             # return a KeyError as an invalid Explorer Response
             raise j.clients.tfchain.errors.ExplorerInvalidResponse(str(exc), endpoint, resp) from exc
@@ -229,7 +279,7 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
             # return a KeyError as an invalid Explorer Response
             raise j.clients.tfchain.errors.ExplorerInvalidResponse(str(exc), endpoint, resp) from exc
 
-    def unlockhash_get(self, target):
+    def unlockhash_get(self, target, local=False):
         """
         Get all transactions linked to the given unlockhash (target),
         as well as other information such as the multisig addresses linked to the given unlockhash (target).
@@ -240,12 +290,33 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
             - list: target is assumed to be the addresses of a MultiSig wallet where all owners (specified as a list of addresses) have to sign
             - tuple (addresses, sigcount): target is a sigcount-of-addresscount MultiSig wallet
 
+        When local is True the transactions are looked up in the local cache instead,
+        which only knows about the confirmed transactions up to the height the cache is synced to,
+        and does not know the ERC20 info of the unlockhash.
+
         @param target: the target wallet to look up transactions for in the explorer, see above for more info
+        @param local: look up the transactions in the local cache, see `sync`
         """
         unlockhash = str(j.clients.tfchain.types.conditions.from_recipient(target).unlockhash)
         endpoint = "/explorer/hashes/" + unlockhash
-        resp = self.explorer_get(endpoint=endpoint)
-        resp = j.data.serializers.json.loads(resp)
+        if local:
+            if self.cache is None:
+                raise j.exceptions.Value(
+                    "local lookups require the local_cache of client {} to be enabled".format(self.name)
+                )
+            endpoint = "cache"
+            resp = {
+                "hashtype": "unlockhash",
+                "transactions": self.cache.unlockhash_transactions(unlockhash),
+                "multisigaddresses": self.cache.unlockhash_multisig_addresses(unlockhash),
+            }
+            if not resp["transactions"]:
+                raise j.clients.tfchain.errors.ExplorerNoContent(
+                    "no content available for unlockhash {} in the local cache".format(unlockhash), endpoint
+                )
+        else:
+            resp = self.explorer_get(endpoint=endpoint)
+            resp = j.data.serializers.json.loads(resp)
         try:
             if resp["hashtype"] != "unlockhash":
                 raise j.clients.tfchain.errors.ExplorerInvalidResponse(
@@ -328,8 +399,14 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
             )
         id = self._normalize_id(id)
         endpoint = "/explorer/hashes/" + id
-        resp = self.explorer_get(endpoint=endpoint)
-        resp = j.data.serializers.json.loads(resp)
+        resp = None
+        if self.cache is not None:
+            resp = self.cache.output_get(id)
+        if resp is None:
+            resp = self.explorer_get(endpoint=endpoint)
+            resp = j.data.serializers.json.loads(resp)
+            if self.cache is not None and resp.get("hashtype") == expected_hash_type:
+                self.cache.output_add(id, resp)
         try:
             hash_type = resp["hashtype"]
             if hash_type != expected_hash_type:
@@ -437,6 +514,69 @@ class TFChainClient(j.baseclasses.factory_data_testtools):
         # return the transaction
         return transaction
 
+    def sync(self, height=None):
+        """
+        Fetch the blocks, which are final but not yet in the local cache, from the explorers
+        and store them in the local cache, such that the transactions of any unlockhash
+        can be looked up locally, using `unlockhash_get(target, local=True)`.
+
+        A block is final once it is `cache.confirmations` blocks below the chain tip.
+        The blocks are fetched concurrently (at most _SYNC_CONCURRENCY at a time),
+        but stored in order, such that a sync which is interrupted can be resumed.
+
+        @param height: sync up to this height, by default all final blocks
+        @return: the height the cache is synced to
+        """
+        cache = self.cache
+        if cache is None:
+            raise j.exceptions.Value("sync requires the local_cache of client {} to be enabled".format(self.name))
+        resp = j.data.serializers.json.loads(self.explorer_get(endpoint="/explorer"))
+        cache.tip_height = int(resp["height"])
+        last = cache.tip_height - cache.confirmations
+        if height is not None:
+            last = min(last, int(height))
+
+        def block_get(height):
+            endpoint = "/explorer/blocks/{}".format(height)
+            resp = j.data.serializers.json.loads(self.explorer_get(endpoint=endpoint))
+            try:
+                return resp["block"]
+            except KeyError as exc:
+                raise j.clients.tfchain.errors.ExplorerInvalidResponse(str(exc), endpoint, resp) from exc
+
+        pool = gevent.pool.Pool(_SYNC_CONCURRENCY)
+        for block in pool.imap(block_get, range(cache.synced_height + 1, last + 1)):
+            cache.block_add(block)
+            cache.synced_height = int(block["height"])
+        return cache.synced_height
+
+    def sync_start(self, interval=60):
+        """
+        Keep the local cache synced in the background.
+
+        @param interval: seconds between two syncs
+        """
+        if self._syncer is not None:
+            return
+
+        def syncer():
+            while True:
+                try:
+                    self.sync()
+                except Exception as e:
+                    self._log_warning("sync of tfchain client {} failed: {}".format(self.name, e))
+                gevent.sleep(interval)
+
+        self._syncer = gevent.spawn(syncer)
+
+    def sync_stop(self):
+        """
+        Stop syncing the local cache in the background.
+        """
+        if self._syncer is not None:
+            self._syncer.kill()
+            self._syncer = None
+
     @property
     def explorer_get(self):
         """
@@ -3,24 +3,108 @@ Tfchain Client
 """
 
 from Jumpscale import j
-from Jumpscale.clients.http.HttpClient import HTTPError
 
+import time
 import random
 
+import gevent
+import requests
+from gevent.queue import Queue, Empty
+
+JSBASE = j.baseclasses.object
+
+# seconds before a request to an explorer is given up
+_REQUEST_TIMEOUT = 30
+# weight of the last request in the average latency of an explorer
+_LATENCY_WEIGHT = 0.3
+# consecutive failures after which an explorer is not used for a while
+_CIRCUIT_FAILURES = 3
+# seconds an explorer is not used after it failed too often
+_CIRCUIT_OPEN_TIME = 30
+
+
+class _ExplorerUnavailable(Exception):
+    """
+    the explorer could not be reached or failed to answer, another one can be tried
+    """
+
+
+class ExplorerNode:
+    """
+    Connection pool and health of a single explorer
+    """
+
+    def __init__(self, address):
+        self.address = address
+        # keeps the connections to the explorer open between requests
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": "Rivine-Agent"})
+        # moving average of the seconds a request takes, None as long as we have not seen one
+        self.latency = None
+        self.nrrequests = 0
+        self.nrerrors = 0
+        # consecutive failures, and till when the explorer is not used because of them
+        self.failures = 0
+        self.open_until = 0
+
+    @property
+    def available(self):
+        """
+        False while the explorer failed too often lately
+        """
+        return self.open_until <= time.time()
+
+    def success(self, latency):
+        self.nrrequests += 1
+        self.failures = 0
+        self.open_until = 0
+        if self.latency is None:
+            self.latency = latency
+        else:
+            self.latency = _LATENCY_WEIGHT * latency + (1 - _LATENCY_WEIGHT) * self.latency
+
+    def failure(self):
+        self.nrrequests += 1
+        self.nrerrors += 1
+        self.failures += 1
+        if self.failures >= _CIRCUIT_FAILURES:
+            self.open_until = time.time() + _CIRCUIT_OPEN_TIME
+
+    @property
+    def stats(self):
+        return {
+            "latency": self.latency,
+            "requests": self.nrrequests,
+            "errors": self.nrerrors,
+            "available": self.available,
+        }
+
 
 class TFChainExplorerClient(j.baseclasses.object):
     """
     Client to get data from a tfchain explorer.
+
+    Every explorer gets its own pool of kept-alive connections.
+    The latency and failures of the explorers are tracked, such that requests go
+    to the fastest explorer first, and an explorer which keeps failing is left alone for a while.
     """
 
-    def get(self, addresses, endpoint):
+    def __init__(self, hedge_delay=None):
         """
-        get data from an explorer at the endpoint from any explorer that is available
-        on one of the given urls. The list of urls is traversed in random order until
-        an explorer returns with a 200 OK status.
+        @param hedge_delay: if set, a GET not answered within this many seconds is sent
+                            to the next explorer as well, the first answer is used
+        """
+        JSBASE.__init__(self)
+        self.hedge_delay = hedge_delay
+        self._nodes = {}
 
-        @param urls: the list of urls of all available explorers
-        @param endpoint: the endpoint to get the data from
+    def _nodes_get(self, addresses):
+        """
+        the explorers to try for the given addresses, best first
+
+        Explorers which failed on their last requests come after the others,
+        explorers which failed too often lately come last.
+        Explorers we know nothing about yet come first so they get measured.
         """
         if not isinstance(addresses, list) or len(addresses) == 0:
             raise j.exceptions.Value(
@@ -28,91 +112,167 @@ class TFChainExplorerClient(j.baseclasses.object):
                     type(addresses)
                 )
             )
-        indices = list(range(len(addresses)))
-        random.shuffle(indices)
-        for idx in indices:
+        nodes = []
+        for address in addresses:
+            if not isinstance(address, str):
+                raise j.exceptions.Value("explorer address expected to be a string, not {}".format(type(address)))
+            node = self._nodes.get(address)
+            if node is None:
+                node = ExplorerNode(address)
+                self._nodes[address] = node
+            nodes.append(node)
+        # the random part spreads the load over explorers which are equally good
+        return sorted(nodes, key=lambda node: (not node.available, node.failures, node.latency or 0, random.random()))
+
+    def _request(self, node, method, endpoint, **kwargs):
+        """
+        do a request on an explorer and keep track of its health
+        raises _ExplorerUnavailable if another explorer should be tried
+        """
+        start = time.time()
+        try:
+            resp = node.session.request(method, node.address + endpoint, timeout=_REQUEST_TIMEOUT, **kwargs)
+        except requests.RequestException as e:
+            node.failure()
+            self._log_debug(
+                "tfchain explorer {} exception at endpoint {} on {}: {}".format(method, endpoint, node.address, e)
+            )
+            raise _ExplorerUnavailable(str(e))
+        if resp.status_code >= 500:
+            node.failure()
+            self._log_debug(
+                "tfchain explorer {} error at endpoint {} on {}: {}".format(
+                    method, endpoint, node.address, resp.status_code
+                )
+            )
+            raise _ExplorerUnavailable("error (code: {}): {}".format(resp.status_code, resp.text))
+        node.success(time.time() - start)
+        return resp
+
+    def _get(self, node, endpoint):
+        resp = self._request(node, "GET", endpoint)
+        if resp.status_code == 200:
+            return resp.content
+        if resp.status_code == 204:
+            raise j.clients.tfchain.errors.ExplorerNoContent("GET: no content available (code: 204)", endpoint)
+        if resp.status_code == 400:
+            msg = resp.text
+            if ("unrecognized hash" in msg) or ("not found" in msg):
+                raise j.clients.tfchain.errors.ExplorerNoContent(
+                    "GET: no content available for specified hash (code: 400)", endpoint
+                )
+        raise j.clients.tfchain.errors.ExplorerServerError(
+            "GET: error (code: {}): {}".format(resp.status_code, resp.text), endpoint
+        )
+
+    def get(self, addresses, endpoint):
+        """
+        get data from an explorer at the endpoint from any explorer that is available
+        on one of the given urls. The explorers are tried from fastest to slowest until
+        one of them returns with a 200 OK status.
+
+        @param urls: the list of urls of all available explorers
+        @param endpoint: the endpoint to get the data from
+        """
+        nodes = self._nodes_get(addresses)
+        if self.hedge_delay is not None and len(nodes) > 1:
+            return self._get_hedged(nodes, endpoint, addresses)
+        error = None
+        for node in nodes:
             try:
-                address = addresses[idx]
-                if not isinstance(address, str):
-                    raise j.exceptions.Value("explorer address expected to be a string, not {}".format(type(address)))
-                # this is required in order to be able to talk directly a daemon
-                headers = {"User-Agent": "Rivine-Agent"}
-                # do the request and check the response
-                resp = j.clients.http.get_response(url=address + endpoint, headers=headers)
-                if resp.getcode() == 200:
-                    return resp.readline()
-                if resp.getcode() == 204:
-                    raise j.clients.tfchain.errors.ExplorerNoContent("GET: no content available (code: 204)", endpoint)
-                raise j.clients.tfchain.errors.ExplorerServerError("error (code: {})".format(resp.getcode()), endpoint)
-            except HTTPError as e:
-                if e.status_code == 400:
-                    msg = e.msg
-                    if isinstance(msg, (bytes, bytearray)):
-                        msg = msg.decode("utf-8")
-                    if isinstance(msg, str) and (("unrecognized hash" in msg) or ("not found" in msg)):
-                        raise j.clients.tfchain.errors.ExplorerNoContent(
-                            "GET: no content available for specified hash (code: 400)", endpoint
-                        )
-                if e.status_code:
-                    raise j.clients.tfchain.errors.ExplorerServerError(
-                        "GET: error (code: {}): {}".format(e.status_code, e.msg), endpoint
-                    )
-                self._log_debug("tfchain explorer get exception at endpoint {} on {}: {}".format(endpoint, address, e))
-                pass
+                return self._get(node, endpoint)
+            except _ExplorerUnavailable as e:
+                error = e
         raise j.clients.tfchain.errors.ExplorerNotAvailable(
-            "no explorer was available", endpoint=endpoint, addresses=addresses
+            "no explorer was available: {}".format(error), endpoint=endpoint, addresses=addresses
+        )
+
+    def _get_hedged(self, nodes, endpoint, addresses):
+        """
+        send the GET to the best explorer, and to the next one each time
+        an explorer did not answer within the hedge delay or failed
+        """
+        answers = Queue()
+
+        def get(node):
+            try:
+                answers.put((True, self._get(node, endpoint)))
+            except _ExplorerUnavailable as e:
+                answers.put((None, e))
+            except Exception as e:
+                answers.put((False, e))
+
+        greenlets = []
+        todo = list(nodes)
+        inflight = 0
+        hedge = False
+        error = None
+        try:
+            while todo or inflight:
+                if todo and (inflight == 0 or hedge):
+                    greenlets.append(gevent.spawn(get, todo.pop(0)))
+                    inflight += 1
+                hedge = False
+                try:
+                    ok, value = answers.get(timeout=self.hedge_delay if todo else None)
+                except Empty:
+                    # too slow, ask the next explorer as well
+                    hedge = True
+                    continue
+                inflight -= 1
+                if ok:
+                    return value
+                if ok is False:
+                    raise value
+                error = value
+        finally:
+            gevent.killall(greenlets, block=False)
+        raise j.clients.tfchain.errors.ExplorerNotAvailable(
+            "no explorer was available: {}".format(error), endpoint=endpoint, addresses=addresses
         )
 
     def post(self, addresses, endpoint, data):
         """
         put data to an explorer at the endpoint from any explorer that is available
-        on one of the given urls. The list of urls is traversed in random order until
-        an explorer returns with a 200 OK status.
+        on one of the given urls. The explorers are tried from fastest to slowest until
+        one of them returns with a 200 OK status.
 
         @param urls: the list of urls of all available explorers
         @param endpoint: the endpoint to geyot the data from
         """
-        if not isinstance(addresses, list) or len(addresses) == 0:
-            raise j.exceptions.Value(
-                "addresses expected to be a non-empty list of string-formatted explorer addresses, not {}".format(
-                    type(addresses)
-                )
-            )
-        indices = list(range(len(addresses)))
-        random.shuffle(indices)
-        for idx in indices:
+        nodes = self._nodes_get(addresses)
+        # ensure the data is already JSON encoded and bytes
+        if isinstance(data, dict):
+            data = j.data.serializers.json.dumps(data)
+        if isinstance(data, str):
+            data = data.encode("utf-8")
+        if not isinstance(data, bytes):
+            raise j.exceptions.Value("expected post data to be bytes, not {}".format(type(data)))
+        # this is required in order to specify the data format correctly
+        headers = {"content-type": "application/json"}
+        error = None
+        for node in nodes:
             try:
-                address = addresses[idx]
-                if not isinstance(address, str):
-                    raise j.exceptions.Value("explorer address expected to be a string, not {}".format(type(address)))
-                # this is required in order to be able to talk directly a daemon,
-                # and to specify the data format correctly
-                headers = {"User-Agent": "Rivine-Agent", "content-type": "application/json"}
-                # ensure the data is already JSON encoded and bytes
-                if isinstance(data, dict):
-                    data = j.data.serializers.json.dumps(data)
-                if isinstance(data, str):
-                    data = data.encode("utf-8")
-                if not isinstance(data, bytes):
-                    raise j.exceptions.Value("expected post data to be bytes, not {}".format(type(data)))
-                # do the request and check the response
-                resp = j.clients.http.post(url=address + endpoint, data=data, headers=headers)
-                if resp.getcode() == 200:
-                    return resp.readline()
-                raise j.clients.tfchain.errors.ExplorerServerPostError(
-                    "POST: unexpected error (code: {})".format(resp.getcode()), endpoint, data=data
-                )
-            except HTTPError as e:
-                if e.status_code:
-                    raise j.clients.tfchain.errors.ExplorerServerPostError(
-                        "POST: error (code: {}): {}".format(e.status_code, e.msg), endpoint, data=data
-                    )
-                self._log_debug("tfchain explorer get exception at endpoint {} on {}: {}".format(endpoint, address, e))
-                pass
+                resp = self._request(node, "POST", endpoint, data=data, headers=headers)
+            except _ExplorerUnavailable as e:
+                error = e
+                continue
+            if resp.status_code == 200:
+                return resp.content
+            raise j.clients.tfchain.errors.ExplorerServerPostError(
+                "POST: error (code: {}): {}".format(resp.status_code, resp.text), endpoint, data=data
+            )
         raise j.clients.tfchain.errors.ExplorerNotAvailable(
-            "no explorer was available", endpoint=endpoint, addresses=addresses
+            "no explorer was available: {}".format(error), endpoint=endpoint, addresses=addresses
         )
 
+    @property
+    def stats(self):
+        """
+        latency (seconds), nr of requests and errors, and availability of every explorer used so far
+        """
+        return {address: node.stats for address, node in self._nodes.items()}
+
     def test(self):
         """
         kosmos 'j.clients.tfchain.explorer.test()'
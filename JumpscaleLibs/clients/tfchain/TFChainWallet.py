@@ -4,6 +4,8 @@ from functools import reduce
 
 import sys
 import hashlib
+import multiprocessing
+import gevent.pool
 from ed25519 import SigningKey
 
 from .types.PrimitiveTypes import Currency, Hash, BinaryData
@@ -22,6 +24,39 @@ _DEFAULT_KEY_SCAN_COUNT = 3
 
 _MAX_RIVINE_TRANSACTION_INPUTS = 99
 
+# max amount of unlockhash lookups a wallet has running at the same time
+_UNLOCKHASH_GET_CONCURRENCY = 8
+
+
+def _key_seed_derive(entropy, index):
+    """
+    The seed of the private key at the given index of a wallet, cheap to compute.
+    """
+    e = j.data.rivine.encoder_sia_get()
+    e.add_array(entropy)
+    e.add(index)
+    return bytes.fromhex(j.data.hash.blake2_string(e.data))
+
+
+def _key_pair_derive(entropy, index):
+    """
+    The private key seed and public key (as bytes) at the given index of a wallet,
+    the public key is the expensive part, as it requires the full ed25519 key to be computed.
+
+    Module-level, such that it can be used by a process pool.
+    """
+    seed = _key_seed_derive(entropy, index)
+    return seed, SigningKey(seed).get_verifying_key().to_bytes()
+
+
+def _public_keys_digest(entropy, public_keys):
+    """
+    Digest of the stored public keys together with the entropy they were derived from,
+    such that public keys of another seed, or edited ones, are never used.
+    """
+    return j.data.hash.blake2_string(bytes(entropy) + "".join(public_keys).encode())
+
+
 # TODO:
 #
 # * add optional height property to base transaction class,
@@ -43,6 +78,10 @@ class TFChainWallet(j.baseclasses.object_config):
         key_count = 1 (I)
         key_scan_count = -1 (I)
         reservations_transactions = (LS)
+        # hex-encoded public keys derived so far, by key index, such that they are not derived again on load
+        public_keys = (LS)
+        # digest of the seed and the public keys, public_keys are only used if it matches
+        public_keys_digest = "" (S)
         mother_id** = 0 (I)
         """
 
@@ -61,20 +100,27 @@ class TFChainWallet(j.baseclasses.object_config):
         # can use them first
         self._unused_key_pairs = []
 
+        # explorer results of the addresses of this wallet,
+        # stored together with the chain height they were fetched at,
+        # such that they only have to be fetched again when the chain moved on
+        self._unlockhash_cache = {}
+
         # provide sane defaults for the schema-based wallet config
         if self.seed == "":
             self.seed = j.data.encryption.mnemonic.generate(strength=256)
         if self.key_count < 1:
             self.key_count = 1
 
-        # generate keys
+        # the stored public keys are only valid for the seed they were derived from, and if none was edited
+        public_keys = self.public_keys
+        if len(public_keys) > 0 and _public_keys_digest(self.seed_entropy, public_keys) != self.public_keys_digest:
+            self.public_keys = []
+            self.public_keys_digest = ""
+
+        # generate keys, the first key is the primary address
         keys_to_generate = self.key_count
         self.key_count = 0
-        # generate the primary address
-        self._primary_address = str(self._key_pair_new().unlockhash)
-        # generate the other addresses
-        for _ in range(keys_to_generate - 1):
-            self._key_pair_new()
+        self._primary_address = str(self._key_pairs_new(keys_to_generate)[0].unlockhash)
 
         # add sub-apis
         self._minter = TFChainMinter(wallet=self)
@@ -204,31 +250,31 @@ class TFChainWallet(j.baseclasses.object_config):
         balance = WalletsBalance()
         # collect info for all personal addresses
         multisig_addresses = []
+        results = self._unlockhashes_get(addresses, height=info.height)
         for address in addresses:
-            try:
-                # collect the inputs/outputs linked to this address for all found transactions
-                result = self._unlockhash_get(address)
-                uh_balance = result.balance(info=info)
-                balance = balance.balance_add(uh_balance)
-                # collect all multisig addresses
-                for address in result.multisig_addresses:
-                    multisig_addresses.append(str(address))
-            except j.clients.tfchain.errors.ExplorerNoContent:
-                # ignore this exception as it simply means
+            result = results[address]
+            if result is None:
                 # the address has no activity yet on the chain
-                pass
+                continue
+            # collect the inputs/outputs linked to this address for all found transactions
+            uh_balance = result.balance(info=info)
+            balance = balance.balance_add(uh_balance)
+            # collect all multisig addresses, a multisig address can be co-owned by more than one of our addresses
+            for address in result.multisig_addresses:
+                address = str(address)
+                if address not in multisig_addresses:
+                    multisig_addresses.append(address)
 
         # collect info for all multisig addresses
+        results = self._unlockhashes_get(multisig_addresses, height=info.height)
         for address in multisig_addresses:
-            try:
-                # collect the inputs/outputs linked to this address for all found transactions
-                result = self._unlockhash_get(address)
-                uh_balance = result.balance(info=info)
-                balance = balance.balance_add(uh_balance)
-            except j.clients.tfchain.errors.ExplorerNoContent:
-                # ignore this exception as it simply means
+            result = results[address]
+            if result is None:
                 # the address has no activity yet on the chain
-                pass
+                continue
+            # collect the inputs/outputs linked to this address for all found transactions
+            uh_balance = result.balance(info=info)
+            balance = balance.balance_add(uh_balance)
         # ensure info is defined for wallet, even if no content
         balance.chain_blockid = info.blockid
         balance.chain_time = info.timestamp
@@ -245,10 +291,11 @@ class TFChainWallet(j.baseclasses.object_config):
         self._key_scan()
 
         # for each address get all transactions
+        info = self.client.blockchain_info_get()
         transactions = set()
-        for address in self.addresses:
-            result = self._unlockhash_get(address)
-            transactions.update(result.transactions)
+        for result in self._unlockhashes_get(self.addresses, height=info.height).values():
+            if result is not None:
+                transactions.update(result.transactions)
 
         # sort all transactions
         transactions = sorted(
@@ -274,21 +321,12 @@ class TFChainWallet(j.baseclasses.object_config):
         # generate the key pairs, without integrating them already
         # loop, and do this until now more are found:
         while True:
-            pairs = []
             used_pairs = []
-            for offset in range(count):
-                pairs.append(self._key_pair_new(integrate=False, offset=offset))
+            pairs = self._key_pairs_new(count, integrate=False)
+            # an address without activity on the chain has no result
+            results = self._unlockhashes_get([str(pair.unlockhash) for pair in pairs])
             for pair in pairs:
-                address = str(pair.unlockhash)
-                try:
-                    self._unlockhash_get(address)
-                    # register this pair as a known index
-                    used_pairs.append(True)
-                except j.clients.tfchain.errors.ExplorerNoContent:
-                    # ignore this exception as it simply means
-                    # the address has no activity yet on the chain
-                    used_pairs.append(False)
-                    pass
+                used_pairs.append(results[str(pair.unlockhash)] is not None)
             # check if any address was found
             if not reduce(lambda a, b: a or b, used_pairs):
                 break
@@ -542,6 +580,16 @@ class TFChainWallet(j.baseclasses.object_config):
         """
         return str(self._key_pair_new().unlockhash)
 
+    def addresses_new(self, count, processes=None):
+        """
+        Generate multiple new wallet addresses at once,
+        see `address_new` for more info.
+
+        @param count: amount of addresses to generate
+        @param processes: if more than one, the key pairs are derived in a pool of that many processes
+        """
+        return [str(pair.unlockhash) for pair in self._key_pairs_new(count, processes=processes)]
+
     def public_key_new(self):
         """
         Generate a new wallet public key,
@@ -568,7 +616,45 @@ class TFChainWallet(j.baseclasses.object_config):
     def _unlockhash_get(self, address):
         return self.client.unlockhash_get(address)
 
+    def _unlockhashes_get(self, addresses, height=None):
+        """
+        Get the explorer results of multiple addresses,
+        the lookups are done concurrently (at most _UNLOCKHASH_GET_CONCURRENCY at a time).
+
+        If a height is given, results are cached with that height,
+        and a result cached at the same height is used instead of asking an explorer again.
+
+        Returns a dict address -> result, the result is None for an address
+        that has no activity yet on the chain.
+        """
+        results = {}
+        todo = []
+        for address in addresses:
+            address = str(address)
+            cached = self._unlockhash_cache.get(address)
+            if height is not None and cached is not None and cached[0] == height:
+                results[address] = cached[1]
+            elif address not in todo:
+                todo.append(address)
+
+        def fetch(address):
+            try:
+                return address, self._unlockhash_get(address)
+            except j.clients.tfchain.errors.ExplorerNoContent:
+                return address, None
+
+        if todo:
+            pool = gevent.pool.Pool(_UNLOCKHASH_GET_CONCURRENCY)
+            for address, result in pool.imap_unordered(fetch, todo):
+                results[address] = result
+                if height is not None:
+                    self._unlockhash_cache[address] = (height, result)
+        return results
+
     def _transaction_put(self, transaction):
+        # the transaction changes what the explorer reports for our addresses,
+        # while the chain height might not have changed yet
+        self._unlockhash_cache.clear()
         return self.client.transaction_put(transaction)
 
     def _key_pair_new(self, integrate=True, offset=0):
@@ -576,32 +662,65 @@ class TFChainWallet(j.baseclasses.object_config):
         Create a new key pair,
         and integrate it by default as well into the wallet's key pair dictionary.
         """
+        return self._key_pairs_new(1, integrate=integrate, offset=offset)[0]
+
+    def _key_pairs_new(self, count, integrate=True, offset=0, processes=None):
+        """
+        Create count new key pairs, for the key indices following the current key count (+ offset),
+        and integrate them by default as well into the wallet's key pair dictionary.
+
+        Public keys stored in the wallet config are used instead of deriving them again,
+        the public keys which do have to be derived are added to the config.
+        The private keys are only computed once needed to sign.
+
+        @param processes: if more than one, the public keys are derived in a pool of that many processes
+        """
+        key_pairs = []
         # if we have unused key pairs in-memory, use them first,
         # only used when integrating is True,
         # as we do not wish to use this feature when scanning
-        if integrate and len(self._unused_key_pairs) > 0:
+        while integrate and count > 0 and len(self._unused_key_pairs) > 0:
             key_pair = self._unused_key_pairs.pop(0)
             self._key_pair_add(key_pair, add_count=False)
-            return key_pair
-
-        # otherwise create a new one
-        e = j.data.rivine.encoder_sia_get()
-        e.add_array(self.seed_entropy)
-        e.add(self.key_count + offset)
-        seed_hash = bytes.fromhex(j.data.hash.blake2_string(e.data))
-        private_key = SigningKey(seed_hash)
-        public_key = private_key.get_verifying_key()
-
-        key_pair = SpendableKey(
-            public_key=j.clients.tfchain.types.public_key_new(hash=public_key.to_bytes()), private_key=private_key
-        )
-
-        # if we wish to integrate (mostly when we're not scanning),
-        # we also add it to our wallets known key pairs
-        if integrate:
-            self._key_pair_add(key_pair, add_count=True, offset=offset)
+            key_pairs.append(key_pair)
+            count -= 1
+        if count <= 0:
+            return key_pairs
+
+        # otherwise create new ones
+        entropy = self.seed_entropy
+        start = self.key_count + offset
+        public_keys = self.public_keys
+        stored = max(0, min(count, len(public_keys) - start))
+        derived = []
+        for index in range(start, start + stored):
+            derived.append((_key_seed_derive(entropy, index), bytes.fromhex(public_keys[index])))
+        indices = range(start + stored, start + count)
+        if processes is not None and processes > 1 and len(indices) > 1:
+            with multiprocessing.Pool(processes) as pool:
+                derived.extend(pool.starmap(_key_pair_derive, [(entropy, index) for index in indices]))
+        else:
+            derived.extend(_key_pair_derive(entropy, index) for index in indices)
+
+        # store the new public keys, as long as they follow the stored ones
+        if len(indices) > 0 and indices[0] <= len(public_keys):
+            for seed, public_key in derived[len(public_keys) - start :]:
+                public_keys.append(public_key.hex())
+            self.public_keys_digest = _public_keys_digest(entropy, public_keys)
+            self.save()
+
+        for seed, public_key in derived:
+            key_pair = SpendableKey(
+                public_key=j.clients.tfchain.types.public_key_new(hash=public_key), private_key=seed
+            )
+            # if we wish to integrate (mostly when we're not scanning),
+            # we also add it to our wallets known key pairs
+            if integrate:
+                self._key_pair_add(key_pair, add_count=True, offset=offset)
+                offset = 0
+            key_pairs.append(key_pair)
 
-        return key_pair
+        return key_pairs
 
     def _key_pair_add(self, key_pair, add_count=True, offset=0):
         """
@@ -805,7 +924,7 @@ class TFChainMinter:
 
         Returns the transaction ID.
         """
-        return self._wallet.client.transaction_put(transaction=transaction)
+        return self._wallet._transaction_put(transaction=transaction)
 
 
 class TfChainAuthcoin:
@@ -971,7 +1090,7 @@ class TfChainAuthcoin:
 
         Returns the transaction ID.
         """
-        return self._wallet.client.transaction_put(transaction=transaction)
+        return self._wallet._transaction_put(transaction=transaction)
 
 
 from .types.ConditionTypes import ConditionAtomicSwap, OutputLock, AtomicSwapSecret, AtomicSwapSecretHash
@@ -1499,7 +1618,7 @@ class TFChainAtomicSwap:
 
         Returns the transaction ID.
         """
-        return self._wallet.client.transaction_put(transaction=transaction)
+        return self._wallet._transaction_put(transaction=transaction)
 
 
 class TFChainThreeBot:
@@ -1756,7 +1875,7 @@ class TFChainThreeBot:
 
         Returns the transaction ID.
         """
-        return self._wallet.client.transaction_put(transaction=transaction)
+        return self._wallet._transaction_put(transaction=transaction)
 
     @property
     def _chain_time(self):
@@ -2010,7 +2129,7 @@ class TFChainERC20:
 
         Returns the transaction ID.
         """
-        return self._wallet.client.transaction_put(transaction=transaction)
+        return self._wallet._transaction_put(transaction=transaction)
 
 
 from typing import NamedTuple
@@ -2067,10 +2186,18 @@ class SpendableKey:
     """
 
     def __init__(self, public_key, private_key):
+        """
+        @param public_key: PublicKey of the pair
+        @param private_key: SigningKey, or the 32 byte seed of it, in which case it is only computed once needed
+        """
         if not isinstance(public_key, PublicKey):
             raise j.exceptions.Value("public key cannot be of type {} (expected: PublicKey)".format(type(public_key)))
         self._public_key = public_key
-        if not isinstance(private_key, SigningKey):
+        self._private_key_seed = None
+        if isinstance(private_key, (bytes, bytearray)) and len(private_key) == 32:
+            self._private_key_seed = bytes(private_key)
+            private_key = None
+        elif not isinstance(private_key, SigningKey):
             raise j.exceptions.Value(
                 "private key cannot be of type {} (expected: SigningKey)".format(type(private_key))
             )
@@ -2082,6 +2209,8 @@ class SpendableKey:
 
     @property
     def private_key(self):
+        if self._private_key is None:
+            self._private_key = SigningKey(self._private_key_seed)
         return self._private_key
 
     @property
@@ -2097,7 +2226,7 @@ class SpendableKey:
         if not isinstance(hash, Hash):
             hash = Hash(value=hash)
         hash = bytes(hash.value)
-        return self._private_key.sign(hash)
+        return self.private_key.sign(hash)
 
 
 class WalletBalance(object):
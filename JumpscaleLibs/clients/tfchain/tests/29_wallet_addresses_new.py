@@ -0,0 +1,71 @@
+from Jumpscale import j
+
+from JumpscaleLibs.clients.tfchain.stub.ExplorerClientStub import TFChainExplorerGetClientStub
+from JumpscaleLibs.clients.tfchain.test_utils import cleanup
+
+
+def test():
+    """
+    to run:
+
+    kosmos 'j.clients.tfchain.test(name="wallet_addresses_new")'
+    """
+
+    cleanup("dev_unittest_client")
+
+    # create a tfchain client for devnet
+    c = j.clients.tfchain.new("dev_unittest_client", network_type="DEV")
+
+    # (we replace internal client logic with custom logic as to ensure we can test without requiring an active network)
+    explorer_client = TFChainExplorerGetClientStub()
+    c._explorer_get = explorer_client.explorer_get
+
+    DEVNET_GENESIS_SEED = "carbon boss inject cover mountain fetch fiber fit tornado cloth wing dinosaur proof joy intact fabric thumb rebel borrow poet chair network expire else"
+
+    # create a new devnet wallet, using an existing seed
+    w = c.wallets.new("mywallet", seed=DEVNET_GENESIS_SEED)
+    assert w.key_count == 1
+    assert w.address == "015df22a2e82a3323bc6ffbd1730450ed844feca711c8fe0c15e218c171962fd17b206263220ee"
+
+    # multiple addresses can be generated at once,
+    # they are the same as the ones generated one by one
+    assert w.addresses_new(2) == [
+        "01095d1811ae152aad0a5dd40588d8414e3bc3132ce8bd2405df13df164635646e3afe5e3af280",
+        "0183ccf250c5a13b0b0bbe452eb65afdb551bd8c572bf45714a2f8cf37239afa3aaa114cdc8b57",
+    ]
+    assert w.key_count == 3
+
+    # the public keys of the derived key pairs are stored in the wallet config,
+    # such that a wallet with the same config does not have to derive them again
+    assert len(w.public_keys) >= 3
+    w2 = c.wallets.new(
+        "mywallet2",
+        seed=DEVNET_GENESIS_SEED,
+        key_count=3,
+        public_keys=w.public_keys,
+        public_keys_digest=w.public_keys_digest,
+    )
+    assert w2.addresses == w.addresses
+    # and the private keys, computed once needed, still match the public keys
+    for address in w2.addresses:
+        key_pair = w2.key_pair_get(address)
+        assert key_pair.private_key.get_verifying_key().to_bytes() == bytes(key_pair.public_key.hash.value)
+
+    # stored public keys of another seed are not used
+    w3 = c.wallets.new("mywallet3", key_count=2, public_keys=w.public_keys, public_keys_digest=w.public_keys_digest)
+    assert w3.address not in w.addresses
+
+    # nor are edited ones
+    public_keys = list(w.public_keys)
+    public_keys[1] = public_keys[2]
+    w4 = c.wallets.new(
+        "mywallet4",
+        seed=DEVNET_GENESIS_SEED,
+        key_count=3,
+        public_keys=public_keys,
+        public_keys_digest=w.public_keys_digest,
+    )
+    assert w4.addresses == w.addresses[:3]
+
+    c.wallets.delete()
+    c.delete()
@@ -0,0 +1,129 @@
+from Jumpscale import j
+
+from JumpscaleLibs.clients.tfchain.stub.ExplorerClientStub import TFChainExplorerGetClientStub
+from JumpscaleLibs.clients.tfchain.test_utils import cleanup
+
+
+def test():
+    """
+    to run:
+
+    kosmos 'j.clients.tfchain.test(name="local_cache")'
+    """
+
+    cleanup("test_unittest_client")
+
+    # create a tfchain client for devnet, which caches the final part of the chain locally
+    c = j.clients.tfchain.new("test_unittest_client", network_type="TEST", local_cache=True)
+
+    # start from an empty cache
+    j.sal.fs.remove(c.cache.path)
+    c._cache = None
+    cache = c.cache
+    assert cache.tip_height == -1
+    assert cache.synced_height == -1
+
+    # (we replace internal client logic with custom logic as to ensure we can test without requiring an active network)
+    explorer_client = TFChainExplorerGetClientStub()
+    c._explorer_get = explorer_client.explorer_get
+
+    # a v0 coin transaction at height 1873, and one at height 1878 spending its first output
+    tx_1873 = j.data.serializers.json.loads(
+        '{"id":"0add5d695e01525be854a3c404503e60fd1245b4602cad9608c5d5fdfb3e028e","height":1873,"parent":"ba6dcf696aff09f5b558e63dde2554edf948e66c1295b11324951647e9ad467a","rawtransaction":{"version":0,"data":{"coininputs":[{"parentid":"6c97c4e0bf832133ad370b9a5daff1309b00b570484a922329ef91e9f7ffa7fe","unlocker":{"type":1,"condition":{"publickey":"ed25519:b86e9efbf7442e353ad7f98f159eb23fe66a1722e11f547876f55b5521d6e350"},"fulfillment":{"signature":"89e6f578416c0db8c399bc8010cd3f11c936931007b1299bb6e436e933f1b7e26702ecb58a04c2d81802d13737e73745fb7657cc4b5c8e0c1d0fddfb6c71ef05"}}}],"coinoutputs":[{"value":"10000000000000000","unlockhash":"015df22a2e82a3323bc6ffbd1730450ed844feca711c8fe0c15e218c171962fd17b206263220ee"},{"value":"89839999300000000","unlockhash":"01d1c4dd242e3badf45004be9a3b86c613923c6d872bab5ec92e4f076114d4c3a15b7b43e1c00f"}],"minerfees":["100000000"]}},"coininputoutputs":[{"value":"99839999400000000","condition":{"type":1,"data":{"unlockhash":"01c389c2b8e097bc4970754b440a962326340eba85dff7a8dd96f7b14bbe0be8e79318c4b6c564"}},"unlockhash":"01c389c2b8e097bc4970754b440a962326340eba85dff7a8dd96f7b14bbe0be8e79318c4b6c564"}],"coinoutputids":["113e7113a436aaa3d43f29afa382706e820e2747ca74bec62646bc35049e68d6","c1df239aba64ca0c6a241ddf18f3dd18b75e2c650874dd4c8c7dbbb56bd73683"],"coinoutputunlockhashes":["015df22a2e82a3323bc6ffbd1730450ed844feca711c8fe0c15e218c171962fd17b206263220ee","01d1c4dd242e3badf45004be9a3b86c613923c6d872bab5ec92e4f076114d4c3a15b7b43e1c00f"],"blockstakeinputoutputs":null,"blockstakeoutputids":null,"blockstakeunlockhashes":null,"unconfirmed":false}'
+    )
+    tx_1878 = j.data.serializers.json.loads(
+        '{"id":"513f3542c91f1be112ea4b36d3204afea9bb43d5c32295896d94cae96078714c","height":1878,"parent":"cd00da19a01822ad5c73279775a06c902832835c865ae7c5aa6bbbc01c8882f7","rawtransaction":{"version":0,"data":{"coininputs":[{"parentid":"113e7113a436aaa3d43f29afa382706e820e2747ca74bec62646bc35049e68d6","unlocker":{"type":1,"condition":{"publickey":"ed25519:ef8c1f52aa64f837b50b9bfb85106906d05f43a5768dbf8320b87bce14dc00cc"},"fulfillment":{"signature":"8bcb889b30735b546cbbe6328d38f130f77e7c93b07d6cfdd09124bbda589c61a444d0e8126d614031237d85b8995476cb02c756f860ef3c57f1d48722426408"}}}],"coinoutputs":[{"value":"9999989999990000","unlockhash":"01d1c4dd242e3badf45004be9a3b86c613923c6d872bab5ec92e4f076114d4c3a15b7b43e1c00f"},{"value":"9900010000","unlockhash":"015df22a2e82a3323bc6ffbd1730450ed844feca711c8fe0c15e218c171962fd17b206263220ee"}],"minerfees":["100000000"]}},"coininputoutputs":[{"value":"10000000000000000","condition":{"type":1,"data":{"unlockhash":"015df22a2e82a3323bc6ffbd1730450ed844feca711c8fe0c15e218c171962fd17b206263220ee"}},"unlockhash":"015df22a2e82a3323bc6ffbd1730450ed844feca711c8fe0c15e218c171962fd17b206263220ee"}],"coinoutputids":["9101b35ad291ba03ec16699abaf2422ef3f11d82b7e20e4921af05274f8495a4","440f6d91460143162d55a732e48ab3ab179a2375af8317b37b28f8d4a66de2e4"],"coinoutputunlockhashes":["01d1c4dd242e3badf45004be9a3b86c613923c6d872bab5ec92e4f076114d4c3a15b7b43e1c00f","015df22a2e82a3323bc6ffbd1730450ed844feca711c8fe0c15e218c171962fd17b206263220ee"],"blockstakeinputoutputs":null,"blockstakeoutputids":null,"blockstakeunlockhashes":null,"unconfirmed":false}'
+    )
+    # a transaction at height 8872 sending coins to a 2-of-2 multisig address
+    tx_8872 = j.data.serializers.json.loads(
+        '{"id":"422ff9ec3d34e263a9eb910c41b4c031e5ff0b8ba9dc5377518e7ed2cfda72ec","height":8872,"parent":"2b465d727d65da5c2986ed8b9b1a3211cd27f7b99f4bc887c801f7bbfb05f884","rawtransaction":{"version":1,"data":{"coininputs":[{"parentid":"b4c0b5d51891608fc2bf0c93c001325ee5048ffdaf6239bca99b9cf46cbe6932","fulfillment":{"type":3,"data":{"pairs":[{"publickey":"ed25519:89ba466d80af1b453a435175dbba6da7718e9cb19c64c0ed41fca3e6982e3636","signature":"7303e9e048ee66def55305fb069d9a75cc15e96168bd85ca102dfdea2c26a4e3776adcae341610e85217508cf24a3a82f711f12286d1de37fc248b375556fd08"},{"publickey":"ed25519:9e310aa31e236f4f1da9c5384138674dc68323da2d8d6cf6e8ee5055b88b61e3","signature":"acd50c4825e639e6423b07022b5b69125ee04014adc6b870e358222dc4a7b2733200ad68aa4f978fba2e306acb06912ae625cfd697f42d9d20bdac3e7faf5f0f"}]}}}],"coinoutputs":[{"value":"42000000000","condition":{}},{"value":"390999999534","condition":{"type":4,"data":{"unlockhashes":["0107e83d2bd8a7aad7ab0af0c0a0f1f116fb42335f64eeeb5ed1b76bd63e62ce59a3872a7279ab","01822fd5fefd2748972ea828a5c56044dec9a2b2275229ce5b212f926cd52fba015846451e4e46"],"minimumsignaturecount":2}}}],"minerfees":["1000000000"]}},"coininputoutputs":[{"value":"433999999534","condition":{"type":4,"data":{"unlockhashes":["0107e83d2bd8a7aad7ab0af0c0a0f1f116fb42335f64eeeb5ed1b76bd63e62ce59a3872a7279ab","01822fd5fefd2748972ea828a5c56044dec9a2b2275229ce5b212f926cd52fba015846451e4e46"],"minimumsignaturecount":2}},"unlockhash":"03e9dbb15388d815ecb1d898bf94cc60e37053d12c7fe97bba2578c8b6a7dbdfb0b3caff77c6c6"}],"coinoutputids":["170815e3fd93f34e5b40644dd116efcfa27fd3e4f6992a68759978336a16fe5e","8ffb6836d68e12a9eb99b8b312399832cdfcbe461d75c3ceca6256b5afabe29e"],"coinoutputunlockhashes":["","03e9dbb15388d815ecb1d898bf94cc60e37053d12c7fe97bba2578c8b6a7dbdfb0b3caff77c6c6"],"blockstakeinputoutputs":null,"blockstakeoutputids":null,"blockstakeunlockhashes":null,"unconfirmed":false}'
+    )
+
+    def block_new(height, transactions=None):
+        return {"blockid": "{:064x}".format(height), "height": height, "transactions": transactions}
+
+    # sync the blocks 1873 up to 1878, as if the ones before were synced already
+    cache.synced_height = 1872
+    for height in range(1873, 1879):
+        transactions = {1873: [tx_1873], 1878: [tx_1878]}.get(height, None)
+        explorer_client.block_add(height, j.data.serializers.json.dumps({"block": block_new(height, transactions)}))
+    # a block is final once it is 10 blocks below the chain tip, so up to 1878 gets synced
+    explorer_client.chain_info = '{"blockid":"' + "{:064x}".format(1888) + '","height":1888}'
+    assert c.sync() == 1878
+    assert cache.tip_height == 1888
+    assert cache.synced_height == 1878
+    assert cache.block_get(1878)["blockid"] == "{:064x}".format(1878)
+    assert cache.block_get("{:064x}".format(1873))["height"] == 1873
+    assert cache.block_get(1879) is None
+    assert cache.transaction_get(tx_1873["id"])["height"] == 1873
+    # syncing again fetches nothing, the stub does not know the blocks after 1878
+    assert c.sync() == 1878
+
+    # both transactions are indexed on the addresses they spend from and send to
+    addr_from = "01c389c2b8e097bc4970754b440a962326340eba85dff7a8dd96f7b14bbe0be8e79318c4b6c564"
+    addr_to = "01d1c4dd242e3badf45004be9a3b86c613923c6d872bab5ec92e4f076114d4c3a15b7b43e1c00f"
+    addr_both = "015df22a2e82a3323bc6ffbd1730450ed844feca711c8fe0c15e218c171962fd17b206263220ee"
+    assert [etxn["id"] for etxn in cache.unlockhash_transactions(addr_from)] == [tx_1873["id"]]
+    assert sorted(etxn["id"] for etxn in cache.unlockhash_transactions(addr_to)) == sorted(
+        [tx_1873["id"], tx_1878["id"]]
+    )
+    assert sorted(etxn["id"] for etxn in cache.unlockhash_transactions(addr_both)) == sorted(
+        [tx_1873["id"], tx_1878["id"]]
+    )
+
+    # which the client can look up locally, without the explorer knowing the unlockhash
+    result = c.unlockhash_get(addr_both, local=True)
+    assert sorted(str(txn.id) for txn in result.transactions) == sorted([tx_1873["id"], tx_1878["id"]])
+    txn = [txn for txn in result.transactions if str(txn.id) == tx_1878["id"]][0]
+    assert txn.height == 1878
+    assert len(txn.coin_inputs) == 1
+    assert str(txn.coin_inputs[0].parentid) == "113e7113a436aaa3d43f29afa382706e820e2747ca74bec62646bc35049e68d6"
+    assert str(txn.coin_inputs[0].parent_output.condition.unlockhash) == addr_both
+    assert str(txn.coin_outputs[0].condition.unlockhash) == addr_to
+    assert str(txn.coin_outputs[1].id) == "440f6d91460143162d55a732e48ab3ab179a2375af8317b37b28f8d4a66de2e4"
+    assert txn.unconfirmed == False
+    assert result.multisig_addresses == []
+    # an unlockhash without cached transactions is unknown locally
+    try:
+        c.unlockhash_get("0199f4f21fc13ceb22da91d4b1701e67556a7c23f118bc5b1b15b132433d07b2496e093c4f4cd6", local=True)
+        raise Exception("should have raised an ExplorerNoContent error")
+    except j.clients.tfchain.errors.ExplorerNoContent:
+        pass
+
+    # a block which is not final is not cached
+    cache.tip_height = 8880
+    assert not cache.final(8872)
+    assert not cache.block_add(block_new(8872, [tx_8872]))
+    assert cache.block_get(8872) is None
+    assert cache.transaction_get(tx_8872["id"]) is None
+    # the tip never goes back
+    cache.tip_height = 8000
+    assert cache.tip_height == 8880
+    # once it is 10 blocks below the tip it is
+    cache.tip_height = 8882
+    assert cache.final(8872)
+    assert cache.block_add(block_new(8872, [tx_8872]))
+    assert cache.transaction_get(tx_8872["id"])["height"] == 8872
+    # unconfirmed transactions are never cached
+    assert not cache.transaction_add(dict(tx_8872, unconfirmed=True))
+
+    # the owners of the multisig address are indexed, as is the multisig address itself
+    addr_multisig = "03e9dbb15388d815ecb1d898bf94cc60e37053d12c7fe97bba2578c8b6a7dbdfb0b3caff77c6c6"
+    for owner in (
+        "0107e83d2bd8a7aad7ab0af0c0a0f1f116fb42335f64eeeb5ed1b76bd63e62ce59a3872a7279ab",
+        "01822fd5fefd2748972ea828a5c56044dec9a2b2275229ce5b212f926cd52fba015846451e4e46",
+    ):
+        assert cache.unlockhash_multisig_addresses(owner) == [addr_multisig]
+    assert cache.unlockhash_multisig_addresses(addr_to) == []
+    result = c.unlockhash_get(addr_multisig, local=True)
+    assert [str(txn.id) for txn in result.transactions] == [tx_8872["id"]]
+    # the free-for-all output is not indexed
+    assert cache.unlockhash_transactions("") == []
+
+    stats = cache.stats
+    assert stats["blocks"] == 7
+    assert stats["transactions"] == 3
+    assert stats["synced_height"] == 1878
+
+    j.sal.fs.remove(cache.path)
+    c.delete()
@@ -3,6 +3,7 @@ from urllib.parse import urlparse
 
 from Jumpscale import j
 from .ZeroOSClient import ZeroOSClient
+from .ZeroOSFleet import ZeroOSFleet, FLEET_CONCURRENCY
 
 skip = j.baseclasses.testtools._skip
 
@@ -25,6 +26,21 @@ class ZeroOSFactory(j.baseclasses.object_config_collection_testtools):
             node.save()
         return self.get(node_id)
 
+    def fleet(self, names=None, concurrency=FLEET_CONCURRENCY, timeout=None):
+        """
+        get a fleet, to run calls on many nodes concurrently
+
+        :param names: names of the configured clients to use, by default all of them
+        :param concurrency: max amount of nodes called at the same time
+        :param timeout: max seconds a single node gets to answer
+        :return: ZeroOSFleet
+        """
+        if names is None:
+            clients = {client.name: client for client in self.find()}
+        else:
+            clients = {name: self.get(name) for name in names}
+        return ZeroOSFleet(clients, concurrency=concurrency, timeout=timeout)
+
     def zero_node_ovh_install(self, OVHHostName, OVHClient, zerotierNetworkID, zerotierClient):
         """
 
@@ -0,0 +1,126 @@
+import gevent
+import gevent.pool
+
+from Jumpscale import j
+
+from .protocol.Client import Client as ProtocolClient
+
+JSBASE = j.baseclasses.object
+
+# max amount of nodes a fleet talks to at the same time
+FLEET_CONCURRENCY = 50
+
+
+class ZeroOSFleet(j.baseclasses.object):
+    """
+    Many zero-os nodes, used together
+
+    Every node has its own protocol client, and so its own pool of redis connections.
+    Calls are done on the nodes concurrently (at most concurrency at a time),
+    each node gets at most timeout seconds to answer, a node which fails or times out
+    does not affect the results of the others.
+
+    example:
+        fleet = j.clients.zos.fleet()
+        results, errors = fleet.json("info.cpu", {})
+    """
+
+    def __init__(self, clients, concurrency=FLEET_CONCURRENCY, timeout=None):
+        """
+        :param clients: dict of node name to ZeroOSClient or protocol Client
+        :param concurrency: max amount of nodes called at the same time
+        :param timeout: max seconds a single node gets to answer, None to only rely on the client timeout
+        """
+        JSBASE.__init__(self)
+        self._clients = {}
+        for name, client in clients.items():
+            if not isinstance(client, ProtocolClient):
+                client = client.client
+            self._clients[name] = client
+        self.concurrency = concurrency
+        self.timeout = timeout
+
+    @property
+    def nodes(self):
+        """
+        names of the nodes of the fleet
+        """
+        return list(self._clients.keys())
+
+    def client_get(self, name):
+        """
+        :return: the protocol client of a node
+        """
+        if name not in self._clients:
+            raise j.exceptions.NotFound("node %s is not part of the fleet" % name)
+        return self._clients[name]
+
+    def imap(self, func, nodes=None, timeout=None):
+        """
+        call func(client) for every node, concurrently
+
+        :param func: called with the protocol client of a node
+        :param nodes: names of the nodes to call, by default all nodes
+        :param timeout: max seconds a single node gets, by default the fleet timeout
+        :return: generator of (name, result, error) tuples in the order the nodes finish,
+                 error is None if the call succeeded
+        """
+        if timeout is None:
+            timeout = self.timeout
+        if nodes is None:
+            nodes = self.nodes
+
+        def call(name):
+            client = self.client_get(name)
+            try:
+                with gevent.Timeout(timeout, TimeoutError("node %s did not answer in %ss" % (name, timeout))):
+                    return name, func(client), None
+            except TimeoutError as e:
+                # the connection might still get an answer meant for the call we gave up on
+                client._redis = None
+                return name, None, e
+            except Exception as e:
+                return name, None, e
+
+        pool = gevent.pool.Pool(self.concurrency)
+        yield from pool.imap_unordered(call, nodes)
+
+    def map(self, func, nodes=None, timeout=None):
+        """
+        call func(client) for every node, concurrently, see imap
+
+        :return: tuple of dicts (results, errors), both by node name
+        """
+        results = {}
+        errors = {}
+        for name, result, error in self.imap(func, nodes=nodes, timeout=timeout):
+            if error is None:
+                results[name] = result
+            else:
+                self._log_warning("call on zero-os node %s failed: %s" % (name, error))
+                errors[name] = error
+        return results, errors
+
+    def sync(self, command, arguments, nodes=None, timeout=None):
+        """
+        run a command on every node and wait for it to finish, see client.sync
+
+        :return: tuple of dicts (results, errors), both by node name
+        """
+        return self.map(lambda client: client.sync(command, arguments), nodes=nodes, timeout=timeout)
+
+    def json(self, command, arguments, nodes=None, timeout=None):
+        """
+        run a command returning json on every node, see client.json
+
+        :return: tuple of dicts (results, errors), both by node name
+        """
+        return self.map(lambda client: client.json(command, arguments), nodes=nodes, timeout=timeout)
+
+    def ping(self, nodes=None, timeout=None):
+        """
+        ping every node
+
+        :return: tuple of dicts (results, errors), both by node name
+        """
+        return self.map(lambda client: client.ping(), nodes=nodes, timeout=timeout)
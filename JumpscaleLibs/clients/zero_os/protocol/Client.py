@@ -18,7 +18,7 @@ from .DiskManager import DiskManager
 from .KvmManager import KvmManager
 from .LogManager import LogManager
 from .Nft import Nft
-from .Response import Response
+from .Response import Response, Return, JobNotFoundError
 from .RTInfoManager import RTInfoManager
 from .WebManager import WebManager
 from .ZerotierManager import ZerotierManager
@@ -26,6 +26,9 @@ from .ZFSManager import ZFSManager
 from .SocatManager import SocatManager
 from .PowerManager import PowerManager
 
+# max seconds results() waits on a single job before looking at the others again
+RESULTS_POLL_INTERVAL = 1
+
 
 class Client(BaseClient):
     _raw_chk = typchk.Checker(
@@ -252,6 +255,18 @@ class Client(BaseClient):
         :return: Response object
         """
 
+        payload = self._raw_payload(command, arguments, queue, max_time, stream, tags, id, recurring_period)
+        id = payload["id"]
+        flag = "result:{}:flag".format(id)
+        self.redis.rpush("core:default", json.dumps(payload))
+        if self.redis.brpoplpush(flag, flag, DEFAULT_TIMEOUT) is None:
+            TimeoutError("failed to queue job {}".format(id))
+
+        return Response(self, id)
+
+    def _raw_payload(
+        self, command, arguments, queue=None, max_time=None, stream=False, tags=None, id=None, recurring_period=None
+    ):
         if not id:
             id = str(uuid.uuid4())
 
@@ -267,12 +282,79 @@ class Client(BaseClient):
         }
 
         self._raw_chk.check(payload)
-        flag = "result:{}:flag".format(id)
-        self.redis.rpush("core:default", json.dumps(payload))
-        if self.redis.brpoplpush(flag, flag, DEFAULT_TIMEOUT) is None:
-            TimeoutError("failed to queue job {}".format(id))
+        return payload
 
-        return Response(self, id)
+    def raw_batch(self, commands):
+        """
+        Same as self.raw for multiple commands at once, all commands are pushed in a single request,
+        and the node is waited for to have queued all of them in a single pipeline.
+
+        example:
+            responses = client.raw_batch([{"command": "info.cpu", "arguments": {}}] * 10)
+            for response, result in client.results(responses):
+                print(response.id, result.state)
+
+        :param commands: list of dicts with the arguments of self.raw (command and arguments required)
+        :return: list of Response objects, in the order of the commands
+        """
+        payloads = [self._raw_payload(**command) for command in commands]
+        if not payloads:
+            return []
+        r = self.redis
+        r.rpush("core:default", *[json.dumps(payload) for payload in payloads])
+        pipe = r.pipeline(transaction=False)
+        for payload in payloads:
+            flag = "result:{}:flag".format(payload["id"])
+            pipe.brpoplpush(flag, flag, DEFAULT_TIMEOUT)
+        failed = [payload["id"] for payload, v in zip(payloads, pipe.execute()) if v is None]
+        if failed:
+            raise TimeoutError("failed to queue jobs {}".format(", ".join(failed)))
+
+        return [Response(self, payload["id"]) for payload in payloads]
+
+    def results(self, responses, timeout=None):
+        """
+        Waits for multiple jobs to finish (max of given timeout seconds for all of them) on a single connection,
+        and yields the results as the jobs finish.
+        The results are read without taking them from their queue, so they keep the expiry zero-os gave them
+        and response.get() keeps working, also while this runs.
+
+        :param responses: Response objects of jobs of this client
+        :param timeout: max time to wait for all jobs to finish in seconds
+        :return: generator of (Response, Return) tuples
+        """
+        if timeout is None:
+            timeout = self.timeout
+        pending = {"result:{}".format(response.id): response for response in responses}
+        r = self.redis
+        deadline = time.time() + timeout
+        check = True
+        while pending:
+            if check:
+                # a job zero-os does not know about will never return
+                pipe = r.pipeline(transaction=False)
+                for queue in pending:
+                    pipe.exists("{}:flag".format(queue))
+                for queue, exists in zip(list(pending), pipe.execute()):
+                    if not exists:
+                        raise JobNotFoundError(pending[queue].id)
+            # the results of all finished jobs in one round trip, the element brpoplpush (get) would return
+            pipe = r.pipeline(transaction=False)
+            for queue in pending:
+                pipe.lindex(queue, -1)
+            for queue, body in zip(list(pending), pipe.execute()):
+                if body is not None:
+                    yield pending.pop(queue), Return(json.loads(body.decode()))
+            if not pending:
+                return
+            maxwait = deadline - time.time()
+            if maxwait <= 0:
+                raise TimeoutError()
+            # wait for one of the jobs, rotating its single result in place leaves it where it is,
+            # the others are looked at again once it finished or after RESULTS_POLL_INTERVAL
+            queue = next(iter(pending))
+            v = r.brpoplpush(queue, queue, max(1, int(min(maxwait, RESULTS_POLL_INTERVAL))))
+            check = v is None
 
     def response_for(self, id):
         return Response(self, id)
@@ -1,3 +1,4 @@
+import io
 import textwrap
 import json
 import time
@@ -8,6 +9,9 @@ from Jumpscale import j
 
 logger = logging.getLogger("zoosprotocol")
 
+# max amount of stream messages read from the node at once
+STREAM_BATCH_SIZE = 500
+
 
 class JobNotFoundError(Exception):
     pass
@@ -204,27 +208,91 @@ class Response:
         if not callable(callback):
             raise Exception("callback must be callable")
 
+        count = 0
+        for level, line, flags in self.messages():
+            callback(level, line, flags)
+            count += 1
+
+        return count
+
+    def batches(self, batch_size=STREAM_BATCH_SIZE):
+        """
+        Runtime copy of job messages, as lists of at most batch_size (level, message, flags) tuples,
+        see stream for the meaning of the tuple values.
+
+        The node is only read from when the next batch is asked for,
+        so a slow consumer holds at most one batch in memory, the rest waits on the node.
+        All messages the node has queued (up to batch_size) are read in a single round trip.
+
+        :param batch_size: max amount of messages per batch
+        :return: generator of lists of (level, message, flags) tuples
+        """
         queue = "stream:%s" % self.id
         r = self._client.redis
 
-        count = 0
         while True:
             data = r.blpop(queue, 10)
             if data is None:
                 if not self.running:
                     break
                 continue
-            _, body = data
-            payload = json.loads(body.decode())
-            message = payload["message"]
-            line = message["message"]
-            meta = message["meta"]
-            callback(meta >> 16, line, meta & 0xFF)
-            count += 1
+            bodies = [data[1]]
+            if batch_size > 1:
+                # take whatever else is already there, atomically
+                pipe = r.pipeline()
+                pipe.lrange(queue, 0, batch_size - 2)
+                pipe.ltrim(queue, batch_size - 1, -1)
+                bodies.extend(pipe.execute()[0])
+
+            batch = []
+            eof = False
+            for body in bodies:
+                message = json.loads(body.decode())["message"]
+                meta = message["meta"]
+                batch.append((meta >> 16, message["message"], meta & 0xFF))
+                if meta & 0x6 != 0:
+                    eof = True
+                    break
+            yield batch
 
-            if meta & 0x6 != 0:
+            if eof:
                 break
 
+    def messages(self, batch_size=STREAM_BATCH_SIZE):
+        """
+        Runtime copy of job messages, as (level, message, flags) tuples, see stream for their meaning.
+        The messages are read from the node in batches, see batches.
+
+        :param batch_size: max amount of messages read from the node at once
+        :return: generator of (level, message, flags) tuples
+        """
+        for batch in self.batches(batch_size):
+            yield from batch
+
+    def stream_to(self, out, levels=None, batch_size=STREAM_BATCH_SIZE):
+        """
+        Runtime copy of job messages, written to a file or socket with one write per batch of messages,
+        see batches.
+
+        :param out: a text or binary file object, or a socket
+        :param levels: only write the messages of these levels (by default all)
+        :param batch_size: max amount of messages read from the node at once
+        :return: the number of messages received during the streaming
+        """
+        if hasattr(out, "sendall"):
+            write = lambda text: out.sendall(text.encode())
+        elif isinstance(out, io.TextIOBase):
+            write = out.write
+        else:
+            write = lambda text: out.write(text.encode())
+
+        count = 0
+        for batch in self.batches(batch_size):
+            count += len(batch)
+            text = "".join(line for level, line, _ in batch if levels is None or level in levels)
+            if text:
+                write(text)
+
         return count
 
     @staticmethod
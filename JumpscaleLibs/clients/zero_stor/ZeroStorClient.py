@@ -80,6 +80,25 @@ class ZeroStorClient(JSConfigBase):
         """
         return self._zstor_data.read_stream(chunks=chunks, output=output, chunk_size=chunk_size)
 
+    def upload(self, key, file_path, **kwargs):
+        """
+        Upload a (large) local file to 0-stor, split in parts which are streamed concurrently
+        :param key: file key (bytes)
+        :param file_path: path to local file to upload
+        :param kwargs: part_size, concurrency, retries, resume and progress, see File.upload
+        :return: nr of parts
+        """
+        return self._file.upload(key, file_path, **kwargs)
+
+    def download(self, key, file_path, **kwargs):
+        """
+        Download a file uploaded with upload, its parts are streamed concurrently
+        :param key: file key (bytes)
+        :param file_path: local file path to download to
+        :param kwargs: concurrency, retries, resume and progress, see File.download
+        """
+        return self._file.download(key, file_path, **kwargs)
+
     def delete(self, chunks):
         """
         Delete a data with chunks
@@ -12,9 +12,106 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 
+import os
+import json
+import time
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+import grpc
+
 from .generated import daemon_pb2_grpc as stubs
 from .generated import daemon_pb2 as model
 
+# files are split in parts of at least / at most this size, each part is sent over its own stream
+MIN_PART_SIZE = 8 * 1024 * 1024
+MAX_PART_SIZE = 256 * 1024 * 1024
+# size of the messages a part is streamed in, kept below the default 4 MiB grpc message limit
+MAX_BLOCK_SIZE = 2 * 1024 * 1024
+# nr of parts transferred at the same time
+TRANSFER_CONCURRENCY = 4
+# nr of times a failing part is tried again
+TRANSFER_RETRIES = 3
+
+
+class TransferError(Exception):
+    """
+    a part was not transferred completely, it is tried again like a failing rpc
+    """
+
+
+def _part_size_get(size, concurrency):
+    """
+    a part size giving every stream a few parts, so a slow or retried part does not hold up the others
+    """
+    part_size = size // (concurrency * 4) + 1
+    return max(MIN_PART_SIZE, min(MAX_PART_SIZE, part_size))
+
+
+def _parts_get(size, part_size):
+    """
+    :return: list of (index, offset, size) of the parts of a file
+    """
+    return [(index, offset, min(part_size, size - offset)) for index, offset in enumerate(range(0, size, part_size))]
+
+
+def _block_size_get(part_size):
+    return max(4096, min(MAX_BLOCK_SIZE, part_size // 8))
+
+
+class _Progress:
+    """
+    keeps track of the bytes transferred by all parts, and reports them to a callback
+    """
+
+    def __init__(self, total, done, callback):
+        self.total = total
+        self.done = done
+        self._callback = callback
+        self._start = time.time()
+        self._start_done = done
+        self._lock = threading.Lock()
+
+    def add(self, size):
+        with self._lock:
+            self.done += size
+            if self._callback is not None:
+                elapsed = max(time.time() - self._start, 1e-6)
+                self._callback(self.done, self.total, (self.done - self._start_done) / elapsed)
+
+
+class _TransferState:
+    """
+    parts of a transfer which are done, kept next to the local file so an interrupted transfer can be resumed
+    """
+
+    def __init__(self, file_path, info):
+        self.path = file_path + ".zstor"
+        self.info = info
+        self.done = set()
+        self._lock = threading.Lock()
+
+    def load(self):
+        try:
+            with open(self.path) as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            return
+        if data.get("info") == self.info:
+            self.done = set(data["done"])
+
+    def part_done(self, index):
+        with self._lock:
+            self.done.add(index)
+            tmp = self.path + ".tmp"
+            with open(tmp, "w") as f:
+                json.dump({"info": self.info, "done": sorted(self.done)}, f)
+            os.replace(tmp, self.path)
+
+    def remove(self):
+        if os.path.exists(self.path):
+            os.remove(self.path)
+
 
 class File:
     class FileMode:
@@ -103,6 +200,174 @@ class File:
         for data in response:
             output.write(data.dataChunk)
 
+    @staticmethod
+    def _part_key(key, index):
+        return key + b".part.%d" % index
+
+    @staticmethod
+    def _manifest_key(key):
+        return key + b".parts"
+
+    def _transfer(self, parts, concurrency, retries, func):
+        """
+        run func(index, offset, size) for all parts, concurrently, trying a failing part again with backoff
+        """
+
+        def transfer(part):
+            for attempt in range(retries + 1):
+                try:
+                    return func(*part)
+                except (grpc.RpcError, TransferError):
+                    if attempt == retries:
+                        raise
+                    time.sleep(2 ** attempt)
+
+        with ThreadPoolExecutor(max_workers=concurrency) as pool:
+            # consume the results, such that the first error of a part is raised
+            for _ in pool.map(transfer, parts):
+                pass
+
+    def upload(
+        self,
+        key,
+        file_path,
+        part_size=None,
+        concurrency=TRANSFER_CONCURRENCY,
+        retries=TRANSFER_RETRIES,
+        resume=True,
+        progress=None,
+    ):
+        """
+        Upload a (large) local file to 0-stor, split in parts which are streamed concurrently
+
+        every part is stored under its own key (key.part.N), and a manifest under key.parts,
+        use download to read it back and delete_parts to delete it
+
+        :param key: file key (bytes)
+        :param file_path: path to local file to upload
+        :param part_size: size of the parts in bytes, by default chosen based on the file size
+        :param concurrency: nr of parts uploaded at the same time
+        :param retries: nr of times a failing part is tried again
+        :param resume: skip the parts a previous interrupted upload of the same file already did
+        :param progress: callback called with (bytes done, bytes total, bytes per second) while uploading
+        :return: nr of parts
+        """
+        stat = os.stat(file_path)
+        size = stat.st_size
+        if part_size is None:
+            part_size = _part_size_get(size, concurrency)
+        block_size = _block_size_get(part_size)
+        parts = _parts_get(size, part_size)
+
+        state = _TransferState(
+            file_path, {"op": "upload", "key": key.hex(), "size": size, "mtime": stat.st_mtime, "part_size": part_size}
+        )
+        if resume:
+            state.load()
+        todo = [part for part in parts if part[0] not in state.done]
+        tracker = _Progress(size, sum(part[2] for part in parts if part[0] in state.done), progress)
+
+        def upload_part(index, offset, part_size):
+            sent = 0
+
+            def stream(f):
+                nonlocal sent
+                metadata = model.WriteStreamRequest.Metadata(key=self._part_key(key, index))
+                yield model.WriteStreamRequest(metadata=metadata)
+                while sent < part_size:
+                    chunk = f.read(min(block_size, part_size - sent))
+                    if len(chunk) == 0:
+                        break
+                    yield model.WriteStreamRequest(data=model.WriteStreamRequest.Data(dataChunk=chunk))
+                    sent += len(chunk)
+                    tracker.add(len(chunk))
+
+            try:
+                with open(file_path, "rb") as f:
+                    f.seek(offset)
+                    self._stub.WriteStream(stream(f))
+            except grpc.RpcError:
+                # the part is sent again from its start
+                tracker.add(-sent)
+                raise
+            state.part_done(index)
+
+        self._transfer(todo, concurrency, retries, upload_part)
+
+        manifest = {"size": size, "part_size": part_size, "parts": len(parts)}
+        self.write(self._manifest_key(key), json.dumps(manifest).encode())
+        state.remove()
+        return len(parts)
+
+    def download(
+        self, key, file_path, concurrency=TRANSFER_CONCURRENCY, retries=TRANSFER_RETRIES, resume=True, progress=None
+    ):
+        """
+        Download a file uploaded with upload to a local file, its parts are streamed concurrently
+
+        :param key: file key (bytes)
+        :param file_path: local file path to download to
+        :param concurrency: nr of parts downloaded at the same time
+        :param retries: nr of times a failing part is tried again
+        :param resume: skip the parts a previous interrupted download to the same file already did
+        :param progress: callback called with (bytes done, bytes total, bytes per second) while downloading
+        """
+        manifest = json.loads(self.read(self._manifest_key(key)).decode())
+        size = manifest["size"]
+        part_size = manifest["part_size"]
+        block_size = _block_size_get(part_size)
+        parts = _parts_get(size, part_size)
+
+        state = _TransferState(file_path, {"op": "download", "key": key.hex(), "size": size, "part_size": part_size})
+        if resume and os.path.exists(file_path):
+            state.load()
+        if not state.done:
+            with open(file_path, "wb") as f:
+                f.truncate(size)
+        todo = [part for part in parts if part[0] not in state.done]
+        tracker = _Progress(size, sum(part[2] for part in parts if part[0] in state.done), progress)
+
+        def download_part(index, offset, part_size):
+            received = 0
+            request = model.ReadStreamRequest(key=self._part_key(key, index), chunkSize=block_size)
+            response = self._stub.ReadStream(request)
+            try:
+                with open(file_path, "r+b") as f:
+                    f.seek(offset)
+                    for data in response:
+                        if received + len(data.dataChunk) > part_size:
+                            # would overwrite the next part
+                            raise TransferError("part %s is bigger than %s bytes" % (index, part_size))
+                        f.write(data.dataChunk)
+                        received += len(data.dataChunk)
+                        tracker.add(len(data.dataChunk))
+                if received != part_size:
+                    raise TransferError("received %s bytes of part %s instead of %s" % (received, index, part_size))
+            except (grpc.RpcError, TransferError):
+                # the part is received again from its start
+                tracker.add(-received)
+                raise
+            state.part_done(index)
+
+        self._transfer(todo, concurrency, retries, download_part)
+        received = os.path.getsize(file_path)
+        if received != size:
+            # the parts are not to be trusted, start over the next time
+            state.remove()
+            raise TransferError("downloaded file is %s bytes instead of %s" % (received, size))
+        state.remove()
+
+    def delete_parts(self, key):
+        """
+        Delete a file uploaded with upload
+
+        :param key: file key (bytes)
+        """
+        manifest = json.loads(self.read(self._manifest_key(key)).decode())
+        for index in range(manifest["parts"]):
+            self.delete(self._part_key(key, index))
+        self.delete(self._manifest_key(key))
+
     def delete(self, key):
         """
         Delete a file with key
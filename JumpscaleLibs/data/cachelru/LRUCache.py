@@ -32,13 +32,14 @@ discarded. [1]_
 """
 
 
+import sys
 import time
-from heapq import heappush, heappop, heapify
+from collections import OrderedDict
 from Jumpscale import j
 
 JSBASE = j.baseclasses.object
 
-__version__ = "0.2"
+__version__ = "0.3"
 __all__ = ["CacheKeyError", "LRUCache", "DEFAULT_SIZE"]
 __docformat__ = "reStructuredText en"
 
@@ -53,100 +54,225 @@ class CacheKeyError(KeyError, JSBASE):
     this error is raised. To avoid it, you may want to check for the existence
     of a cache record before reading or deleting it."""
 
-    def __init__(self):
+    def __init__(self, *args):
+        KeyError.__init__(self, *args)
         JSBASE.__init__(self)
 
 
 class LRUCache(j.baseclasses.object):
+    """
+    LRU cache with O(1) get/set/delete.
+
+    Records are kept in an OrderedDict ordered from least to most recently used,
+    a hit moves the record to the end, eviction pops from the front.
+
+    Besides the maximum number of records (size) the cache can be bounded by
+    the total size in bytes of the cached objects (maxbytes), the size of one
+    object is calculated by the sizer method (default sys.getsizeof).
+    Records can expire, the default time to live (in seconds) is given by ttl
+    and can be overruled per record through set(key, obj, ttl=...).
+    """
+
     class __Node:
         """Record of a cached value. Not for public consumption."""
 
-        def __init__(self, key, obj, timestamp):
-            object.__init__(self)
+        __slots__ = ["key", "obj", "atime", "mtime", "expire", "nbytes"]
+
+        def __init__(self, key, obj, timestamp, expire=None, nbytes=0):
             self.key = key
             self.obj = obj
             self.atime = timestamp
             self.mtime = self.atime
-
-        def __cmp__(self, other):
-            return cmp(self.atime, other.atime)
+            self.expire = expire
+            self.nbytes = nbytes
 
         def __repr__(self):
             return "<%s %s => %s (%s)>" % (self.__class__, self.key, self.obj, time.asctime(time.localtime(self.atime)))
 
-    def __init__(self, size=DEFAULT_SIZE):
+    def __init__(self, size=DEFAULT_SIZE, ttl=None, maxbytes=None, sizer=None):
+        """
+        :param size: max nr of records in the cache
+        :param ttl: default time to live in seconds of a record, None means never expire
+        :param maxbytes: max total size of the cached objects, None means unbounded
+        :param sizer: method which returns the size in bytes of an object, default sys.getsizeof
+        """
         # Check arguments
         if size <= 0:
             raise j.exceptions.Value(size)
         elif not isinstance(size, type(0)):
             raise j.exceptions.Value(size)
+        if ttl is not None and ttl <= 0:
+            raise j.exceptions.Value(ttl)
+        if maxbytes is not None and (not isinstance(maxbytes, int) or maxbytes <= 0):
+            raise j.exceptions.Value(maxbytes)
         object.__init__(self)
         JSBASE.__init__(self)
-        self.__heap = []
-        self.__dict = {}
+        self.__dict = OrderedDict()
+        self.ttl = ttl
+        self.sizer = sizer or sys.getsizeof
+        self.nbytes = 0
+        """Total size in bytes of the cached objects, only tracked when maxbytes is set."""
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
+        self.maxbytes = maxbytes
+        """Maximum total size in bytes of the cached objects."""
         self.size = size
         """Maximum size of the cache.
         If more than 'size' elements are added to the cache,
         the least-recently-used ones will be discarded."""
 
     def __len__(self):
-        return len(self.__heap)
+        return len(self.__dict)
 
     def __contains__(self, key):
-        return key in self.__dict
+        node = self.__dict.get(key)
+        if node is None:
+            return False
+        if node.expire is not None and node.expire <= time.time():
+            self.__remove(key, expired=True)
+            return False
+        return True
 
     def __setitem__(self, key, obj):
-        if key in self.__dict:
-            node = self.__dict[key]
-            node.obj = obj
-            node.atime = time.time()
-            node.mtime = node.atime
-            heapify(self.__heap)
-        else:
-            # size may have been reset, so we loop
-            while len(self.__heap) >= self.size:
-                lru = heappop(self.__heap)
-                del self.__dict[lru.key]
-            node = self.__Node(key, obj, time.time())
-            self.__dict[key] = node
-            heappush(self.__heap, node)
+        self.set(key, obj)
 
     def __getitem__(self, key):
-        if key not in self.__dict:
+        node = self.__dict.get(key)
+        if node is None:
+            self.misses += 1
             raise CacheKeyError(key)
-        else:
-            node = self.__dict[key]
-            node.atime = time.time()
-            heapify(self.__heap)
-            return node.obj
+        now = time.time()
+        if node.expire is not None and node.expire <= now:
+            self.__remove(key, expired=True)
+            self.misses += 1
+            raise CacheKeyError(key)
+        node.atime = now
+        self.__dict.move_to_end(key)
+        self.hits += 1
+        return node.obj
 
     def __delitem__(self, key):
         if key not in self.__dict:
             raise CacheKeyError(key)
-        else:
-            node = self.__dict[key]
-            del self.__dict[key]
-            self.__heap.remove(node)
-            heapify(self.__heap)
-            return node.obj
+        return self.__remove(key).obj
 
     def __iter__(self):
-        copy = self.__heap[:]
-        while len(copy) > 0:
-            node = heappop(copy)
-            yield node.key
-        raise StopIteration
+        # iterate over a copy so the cache can be modified while iterating
+        for key in list(self.__dict.keys()):
+            yield key
 
     def __setattr__(self, name, value):
+        tracked = self.__dict__.get("maxbytes") is not None
         object.__setattr__(self, name, value)
-        # automagically shrink heap on resize
-        if name == "size":
-            while len(self.__heap) > value:
-                lru = heappop(self.__heap)
-                del self.__dict[lru.key]
+        if name == "maxbytes" and "size" in self.__dict__ and tracked != (value is not None):
+            self.__measure()
+        # automagically shrink on resize
+        if name in ("size", "maxbytes") and "size" in self.__dict__:
+            self.__shrink()
 
     def __repr__(self):
-        return "<%s (%d elements)>" % (str(self.__class__), len(self.__heap))
+        return "<%s (%d elements)>" % (str(self.__class__), len(self.__dict))
+
+    def __remove(self, key, expired=False):
+        node = self.__dict.pop(key)
+        self.nbytes -= node.nbytes
+        if expired:
+            self.expirations += 1
+        return node
+
+    def __measure(self):
+        # the sizes of the objects are only tracked while maxbytes is set
+        self.nbytes = 0
+        for node in self.__dict.values():
+            node.nbytes = self.sizer(node.obj) if self.maxbytes is not None else 0
+            self.nbytes += node.nbytes
+
+    def __shrink(self):
+        while len(self.__dict) > self.size or (self.maxbytes is not None and self.nbytes > self.maxbytes):
+            _, lru = self.__dict.popitem(last=False)
+            self.nbytes -= lru.nbytes
+            self.evictions += 1
+
+    def set(self, key, obj, ttl=None):
+        """
+        store obj in the cache, an obj bigger than maxbytes is not cached (an older record for key is removed)
+        :param ttl: time to live in seconds for this record, if None the default ttl of the cache is used
+        """
+        now = time.time()
+        ttl = ttl or self.ttl
+        expire = now + ttl if ttl else None
+        nbytes = self.sizer(obj) if self.maxbytes is not None else 0
+        if self.maxbytes is not None and nbytes > self.maxbytes:
+            self.delete(key)
+            return
+        node = self.__dict.get(key)
+        if node is not None:
+            self.nbytes += nbytes - node.nbytes
+            node.obj = obj
+            node.atime = now
+            node.mtime = now
+            node.expire = expire
+            node.nbytes = nbytes
+            self.__dict.move_to_end(key)
+        else:
+            self.__dict[key] = self.__Node(key, obj, now, expire=expire, nbytes=nbytes)
+            self.nbytes += nbytes
+        self.__shrink()
+
+    def get(self, key, default=None):
+        """
+        return the cached obj for key or default if not in cache (or expired)
+        """
+        try:
+            return self[key]
+        except CacheKeyError:
+            return default
+
+    def delete(self, key):
+        """
+        remove key from the cache, does not complain when the key does not exist
+        """
+        if key in self.__dict:
+            self.__remove(key)
+
+    def expired_delete(self):
+        """
+        walk over all records and remove the expired ones
+        :return: nr of removed records
+        """
+        now = time.time()
+        todelete = [key for key, node in self.__dict.items() if node.expire is not None and node.expire <= now]
+        for key in todelete:
+            self.__remove(key, expired=True)
+        return len(todelete)
+
+    def clear(self):
+        self.__dict.clear()
+        self.nbytes = 0
+
+    @property
+    def stats(self):
+        """
+        :return: dict with hits, misses, evictions, expirations, hitrate, nr of items and bytes in cache
+        """
+        lookups = self.hits + self.misses
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "expirations": self.expirations,
+            "hitrate": float(self.hits) / lookups if lookups else 0.0,
+            "items": len(self.__dict),
+            "bytes": self.nbytes,
+        }
+
+    def stats_reset(self):
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self.expirations = 0
 
     def mtime(self, key):
         """Return the last modification time for the cache record with key.
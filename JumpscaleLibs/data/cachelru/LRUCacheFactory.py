@@ -8,10 +8,41 @@ JSBASE = j.baseclasses.object
 class LRUCacheFactory(j.baseclasses.object):
     __jslocation__ = "j.data.cachelru"
 
-    def getRWCache(self, nrItemsReadCache, nrItemsWriteCache=50, maxTimeWriteCache=2000, writermethod=None):
-        return RWCache(nrItemsReadCache, nrItemsWriteCache, maxTimeWriteCache, writermethod=writermethod)
+    def getRWCache(
+        self,
+        nrItemsReadCache,
+        nrItemsWriteCache=50,
+        maxTimeWriteCache=2000,
+        writermethod=None,
+        batch=False,
+        background=False,
+        interval=None,
+    ):
+        """
+        read cache in front of a write behind cache
+
+        writermethod gets a record (with .key and .obj) per call, or when batch is True the list of records per flush,
+        when background is True a greenlet flushes every interval seconds (default maxTimeWriteCache)
+        and writes block while the write cache is full instead of failing
 
-    def getRCache(self, nritems):
+        e.g. to turn many small saves into bulk writes:
+
+        cache = j.data.cachelru.getRWCache(10000, 5000, 1, writermethod=bulk_save, batch=True, background=True)
+        cache.set(obj.id, obj)
+        ...
+        cache.stop() # stops the flusher and writes what is left
+        """
+        return RWCache(
+            nrItemsReadCache,
+            nrItemsWriteCache,
+            maxTimeWriteCache,
+            writermethod=writermethod,
+            batch=batch,
+            background=background,
+            interval=interval,
+        )
+
+    def getRCache(self, nritems, ttl=None, maxbytes=None, sizer=None):
         """
         Least-Recently-Used (LRU) cache.
         Written by http://evan.prodromou.name/Software/Python/LRUCache
@@ -51,5 +82,17 @@ class LRUCacheFactory(j.baseclasses.object):
 
         for j in cache:   # iterate (in LRU order)
             print j, cache[j] # iterator produces keys, not values
+
+        get/set/delete are O(1), the cache can also be bounded in bytes and records can expire::
+
+        cache = j.data.cachelru.getRCache(10000, ttl=300, maxbytes=64 * 1024 * 1024, sizer=len)
+        cache.set('foo', b'...', ttl=10) # overrule the default ttl for this record
+        cache.get('bar') # None when not in cache or expired
+        print cache.stats # hits, misses, evictions, expirations, hitrate, items, bytes
+
+        :param nritems: max nr of records
+        :param ttl: default time to live in seconds of a record, None means never expire
+        :param maxbytes: max total size in bytes of the cached objects, None means unbounded
+        :param sizer: method returning the size in bytes of an object, default sys.getsizeof
         """
-        return LRUCache(nritems)
+        return LRUCache(nritems, ttl=ttl, maxbytes=maxbytes, sizer=sizer)
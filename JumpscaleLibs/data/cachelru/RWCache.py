@@ -1,106 +1,219 @@
 import time
-from heapq import heappush, heappop, heapify
+from collections import OrderedDict
 
-from Jumpscale import j
-from .LRUCache import LRUCache
+import gevent
+from gevent.event import Event
 
-from operator import itemgetter, attrgetter
+from Jumpscale import j
+from .LRUCache import LRUCache, CacheKeyError
 
 JSBASE = j.baseclasses.object
 
 
 class RWCache(j.baseclasses.object):
-    def __init__(self, nrItemsReadCache, maxNrItemsWriteCache=50, maxTimeWriteCache=2000, writermethod=None):
-        self.cacheR = j.tools.cachelru.getRCache(nrItemsReadCache)
-        self.cacheW = WCache(maxNrItemsWriteCache, writermethod, maxTimeWriteCache)
+    def __init__(
+        self,
+        nrItemsReadCache,
+        maxNrItemsWriteCache=50,
+        maxTimeWriteCache=2000,
+        writermethod=None,
+        batch=False,
+        background=False,
+        interval=None,
+    ):
+        self.cacheR = LRUCache(nrItemsReadCache)
+        self.cacheW = WCache(
+            maxNrItemsWriteCache,
+            writermethod,
+            maxTimeWriteCache,
+            batch=batch,
+            background=background,
+            interval=interval,
+        )
         JSBASE.__init__(self)
 
     def set(self, key, obj):
         self.cacheW[key] = obj
         self.cacheR[key] = obj
 
-    def flush(self):
-        self.cacheW.flush()
+    def get(self, key, default=None):
+        if key in self.cacheW:
+            return self.cacheW[key]
+        return self.cacheR.get(key, default)
+
+    def flush(self, all=False):
+        self.cacheW.flush(all=all)
 
+    def stop(self):
+        self.cacheW.stop()
 
-# based on LRUCache but modified for different purpose (write through cache)
-class WCache:
+
+# based on LRUCache but modified for different purpose (write behind cache)
+class WCache(j.baseclasses.object):
     class __Node:
         """Record of a cached value. Not for public consumption."""
 
+        __slots__ = ["key", "obj", "wtime", "mtime"]
+
         def __init__(self, key, obj, timestamp):
-            object.__init__(self)
             self.key = key
             self.obj = obj
+            # wtime is the time the record became dirty, mtime the time of the last write
             self.wtime = timestamp
-
-        def __cmp__(self, other):
-            return cmp(self.atime, other.atime)
+            self.mtime = timestamp
 
         def __repr__(self):
             return "<%s %s => %s (%s)>" % (self.__class__, self.key, self.obj, time.asctime(time.localtime(self.wtime)))
 
-    def __init__(self, size=5000, writermethod=None, maxtime=1):
+    def __init__(self, size=5000, writermethod=None, maxtime=1, batch=False, background=False, interval=None):
         """
         @param writermethod if given then this method will be called with max size reached or when flush called for objects older than specified maxtime
+                            it gets a record, which has the key and obj as attributes
+        @param batch if True writermethod is called once per flush with the list of records to write,
+                     otherwise it is called per record (as before)
+        @param background if True a greenlet flushes the records older than maxtime every interval seconds
+                          and writes done while the cache is full wait for the flusher instead of failing
+        @param interval seconds between 2 background flushes, default maxtime
+
+        repeated writes to the same key are coalesced, only the last obj is written
         """
         # Check arguments
         if size <= 0:
             raise j.exceptions.Value(size)
         elif not isinstance(size, type(0)):
             raise j.exceptions.Value(size)
+        if background and writermethod is None:
+            raise j.exceptions.Value("background flushing needs a writermethod")
         object.__init__(self)
         JSBASE.__init__(self)
-        self.__dict = {}
+        # ordered on the time the records became dirty, oldest first
+        self.__dict = OrderedDict()
         self.size = size
         self.flushsize = round(float(size) * 1.2)
         self.maxtime = maxtime
         self.writermethod = writermethod
+        self.batch = batch
+        self.interval = interval or maxtime
+        self.nrwrites = 0
+        self.nrflushed = 0
+        self.nrcoalesced = 0
+        self._wakeup = Event()
+        self._room = Event()
+        self._room.set()
+        self._flusher = None
+        self._running = False
+        if background:
+            self.start()
 
-    def flush(self):
-        if len(list(self.__dict.keys())) >= self.size and self.writermethod is None:
-            raise j.exceptions.RuntimeError("Write cache full.")
+    def start(self):
+        """
+        start the background flusher
+        """
+        if self._flusher is not None:
+            return
+        if self.writermethod is None:
+            raise j.exceptions.Value("background flushing needs a writermethod")
+        self._running = True
+        self._flusher = gevent.spawn(self._flush_loop)
 
-        now = time.time()
+    def stop(self):
+        """
+        stop the background flusher and write all records
+        """
+        flusher = self._flusher
+        self._running = False
+        self._flusher = None
+        if flusher is not None:
+            self._wakeup.set()
+            flusher.join()
+        if self.writermethod is not None:
+            self.flush(all=True)
+
+    def _flush_loop(self):
+        while self._running:
+            self._wakeup.wait(timeout=self.interval)
+            self._wakeup.clear()
+            try:
+                self.flush()
+            except Exception as e:
+                self._log_error("could not flush write cache: %s" % e)
+
+    def _write(self, nodes):
+        if self.batch:
+            self.writermethod(nodes)
+        else:
+            for node in nodes:
+                self.writermethod(node)
+        self.nrflushed += len(nodes)
 
-        todelete = []
-        for key in self:
-            item = self.__dict[key]
-            if now > item.wtime + self.maxtime:
-                self.writermethod(self.__dict[key])
-                todelete.append(key)
+    def flush(self, all=False):
+        """
+        write the records older than maxtime, if the cache is still full the oldest ones are written
+        until there is room again
+        @param all if True all records are written
+        """
+        if self.writermethod is None:
+            if len(self.__dict) >= self.size:
+                raise j.exceptions.RuntimeError("Write cache full.")
+            return
+
+        now = time.time()
 
-        for key2 in todelete:
-            del self.__dict[key2]
+        limit = self.size
+        if self._running and len(self.__dict) >= self.size:
+            # writers are waiting, make room for a batch instead of a single record
+            limit = max(1, self.size // 2)
 
-        if len(list(self.__dict.keys())) < self.size:
+        # records are ordered on wtime so we can stop at the first one which is young enough
+        towrite = []
+        for key, node in self.__dict.items():
+            if not all and now <= node.wtime + self.maxtime and len(self.__dict) - len(towrite) < limit:
+                break
+            towrite.append(node)
+        if not towrite:
             return
-        # not enough objects flushed, sort follow latest mdate
-        tosort = []
-        for key in list(self.__dict.keys()):
-            tosort.append([key, self.__dict[key].wtime])
-        sortedItems = sorted(tosort, key=itemgetter(1))
-        counter = 0
-        while len(list(self.__dict.keys())) >= self.size:
-            key = sortedItems[counter][0]
-            counter += 1
-            self.writermethod(self.__dict[key])
-            del self.__dict[key]
+
+        # take them out before writing, writes done while the writermethod runs make the record dirty again
+        for node in towrite:
+            del self.__dict[node.key]
+        try:
+            self._write(towrite)
+        except Exception:
+            # put back what was not overwritten in the meantime, so nothing gets lost
+            for node in reversed(towrite):
+                if node.key not in self.__dict:
+                    self.__dict[node.key] = node
+                    self.__dict.move_to_end(node.key, last=False)
+            raise
+        finally:
+            if len(self.__dict) < self.size:
+                self._room.set()
 
     def __setitem__(self, key, obj):
-        if key in self.__dict:
-            node = self.__dict[key]
+        self.nrwrites += 1
+        node = self.__dict.get(key)
+        if node is not None:
+            # coalesce, the record keeps its place in the queue
             node.obj = obj
-            node.mtime = node.atime
-        else:
-            # size may have been reset, so we loop
-            node = self.__Node(key, obj, time.time())
-            self.__dict[key] = node
-            if len(list(self.__dict.keys())) >= self.flushsize:
-                self.flush()
+            node.mtime = time.time()
+            self.nrcoalesced += 1
+            return
+
+        if self._running:
+            # backpressure: wait till the flusher made room
+            while len(self.__dict) >= self.size:
+                self._room.clear()
+                self._wakeup.set()
+                self._room.wait(timeout=self.interval)
+                if not self._running:
+                    break
+        node = self.__Node(key, obj, time.time())
+        self.__dict[key] = node
+        if not self._running and len(self.__dict) >= self.flushsize:
+            self.flush()
 
     def __len__(self):
-        return len(self.__heap)
+        return len(self.__dict)
 
     def __contains__(self, key):
         return key in self.__dict
@@ -116,31 +229,27 @@ class WCache:
         if key not in self.__dict:
             raise CacheKeyError(key)
         else:
-            node = self.__dict[key]
-            del self.__dict[key]
+            node = self.__dict.pop(key)
             return node.obj
 
     def __iter__(self):
         for key in list(self.__dict.keys()):
             yield key
 
-    # def __iter__(self):
-    #     tosort=[]
-    #     for key in self.__dict.keys():
-    #         tosort.append([key,self[key].atime])
-    #     for item in sorted(data,key=itemgetter(1)):
-    #         yield key
-
-    # def __setattr__(self, name, value):
-    #     object.__setattr__(self, name, value)
-    #     # automagically shrink heap on resize
-    #     if name == 'size':
-    #         while len(self.__heap) > value:
-    #             lru = heappop(self.__heap)
-    #             del self.__dict[lru.key]
-
     def __repr__(self):
-        return "<%s (%d elements)>" % (str(self.__class__), len(list(self.__dict.keys())))
+        return "<%s (%d elements)>" % (str(self.__class__), len(self.__dict))
+
+    @property
+    def stats(self):
+        """
+        :return: dict with nr of writes, coalesced writes, flushed records and dirty records
+        """
+        return {
+            "writes": self.nrwrites,
+            "coalesced": self.nrcoalesced,
+            "flushed": self.nrflushed,
+            "dirty": len(self.__dict),
+        }
 
     def mtime(self, key):
         """Return the last modification time for the cache record with key.
@@ -150,4 +259,4 @@ class WCache:
             raise CacheKeyError(key)
         else:
             node = self.__dict[key]
-            return node.wtime
+            return node.mtime
@@ -1,11 +1,31 @@
+import mmap
+import struct
+from bisect import bisect_left
+
 from Jumpscale import j
 from pprint import pprint as print
 
 JSBASE = j.baseclasses.object
 
 
+# nr of entries read at once when walking over the file
+BATCH_SIZE = 64 * 1024
+# min bytes a memory mapped file grows with, it grows by its own size once bigger
+GROW_SIZE = 1024 * 1024
+# suffix of the file next to a memory mapped index which holds the size of the entries written
+SIZE_SUFFIX = ".size"
+
+
 class IndexFile(j.baseclasses.object):
-    def __init__(self, path, nrbytes=4):
+    def __init__(self, path, nrbytes=4, mmap=False):
+        """
+        :param nrbytes: size of 1 entry
+        :param mmap: if True the file is memory mapped, reads are slices of the map (no syscalls)
+                     and view() returns a zero-copy memoryview over the entries
+                     the file is grown in big steps then, close() cuts it back to the entries written
+                     while open the size of the entries written is kept in a file next to it (path + SIZE_SUFFIX),
+                     so an index which was not closed is cut back when opened again
+        """
         j.sal.fs.createDir(j.sal.fs.getDirName(path))
         self._path = path
         self._nrbytes = nrbytes
@@ -13,14 +33,84 @@ class IndexFile(j.baseclasses.object):
             self._f = open(path, mode="rb+")
         else:
             self._f = open(path, mode="wb+")
+        self._mmap = mmap
+        self._mm = None
+        # size of the entries written, and in mmap mode the size of the file and the map (can be bigger)
+        self._size = self._f.seek(0, 2)
+        sizepath = path + SIZE_SUFFIX
+        if j.sal.fs.exists(sizepath):
+            # was memory mapped and not closed, cut off what was grown but not written
+            with open(sizepath, "rb") as f:
+                (written,) = struct.unpack("<Q", f.read(8).ljust(8, b"\0"))
+            if written < self._size:
+                self._f.truncate(written)
+                self._size = written
+            if not mmap:
+                j.sal.fs.remove(sizepath)
+        self._capacity = self._size
+        self._sizemm = None
+        if mmap:
+            self._map()
+            self._size_map()
         JSBASE.__init__(self)
 
     def __delete__(self):
         self.close()
 
     def close(self):
-        if self._f:
+        self._unmap()
+        if self._f and not self._f.closed:
+            if self._capacity > self._size:
+                self._f.truncate(self._size)
+                self._capacity = self._size
             self._f.close()
+        if self._sizemm is not None:
+            self._sizemm.close()
+            self._sizemm = None
+            j.sal.fs.remove(self._path + SIZE_SUFFIX)
+
+    def _map(self):
+        self._unmap()
+        if self._capacity:
+            self._mm = mmap.mmap(self._f.fileno(), self._capacity)
+
+    def _size_map(self):
+        sizepath = self._path + SIZE_SUFFIX
+        with open(sizepath, "rb+" if j.sal.fs.exists(sizepath) else "wb+") as f:
+            f.truncate(8)
+            self._sizemm = mmap.mmap(f.fileno(), 8)
+        self._size_store()
+
+    def _size_store(self):
+        """
+        remember the size of the entries written, a write in memory in mmap mode
+        """
+        if self._sizemm is not None:
+            struct.pack_into("<Q", self._sizemm, 0, self._size)
+
+    def _unmap(self):
+        if self._mm is not None:
+            self._mm.flush()
+            try:
+                self._mm.close()
+            except BufferError:
+                # there are still views on the old map, it gets closed when they are released
+                pass
+            self._mm = None
+
+    def _grow(self, size):
+        """
+        make sure the file is at least size bytes
+        in mmap mode the file is grown (and remapped) only once the map is too small, by at least its own size
+        """
+        if not self._mmap or size <= self._size:
+            # without mmap writing past the end grows the file
+            return
+        if size > self._capacity:
+            self._capacity = max(size, self._capacity + max(self._capacity, GROW_SIZE))
+            self._f.truncate(self._capacity)
+            self._map()
+        self._size = size
 
     @property
     def nrbytes(self):
@@ -35,7 +125,7 @@ class IndexFile(j.baseclasses.object):
         """
         return the number of entry in the index
         """
-        size = self._f.seek(0, 2)
+        size = self._size if self._mmap else self._f.seek(0, 2)
         if size % self.nrbytes != 0:
             raise j.exceptions.RuntimeError("size of the file is not a multiple of nbrbytes, file corrupted")
         return int(size / self.nrbytes)
@@ -51,13 +141,35 @@ class IndexFile(j.baseclasses.object):
             item = item.encode("utf-8")
         return item
 
+    def _read(self, offset, size):
+        if self._mm is not None:
+            return self._mm[offset : min(offset + size, self._size)]
+        self._f.seek(offset)
+        return self._f.read(size)
+
     def get(self, id):
         """
         return the data stored at id=id
         """
-        self._f.seek(self._offset(id))
-        data = self._f.read(self.nrbytes)
-        return data
+        return self._read(self._offset(id), self.nrbytes)
+
+    def get_many(self, ids):
+        """
+        return the data stored at each of the ids as a list, in the order of ids
+        when not memory mapped the span between the lowest and highest id is read at once
+        if it is not too sparse
+        """
+        ids = list(ids)
+        if not ids:
+            return []
+        n = self.nrbytes
+        if self._mm is None:
+            low = min(ids)
+            high = max(ids)
+            if (high - low + 1) <= max(BATCH_SIZE, 4 * len(ids)):
+                data = self._read(self._offset(low), (high - low + 1) * n)
+                return [data[(id - low) * n : (id - low + 1) * n] for id in ids]
+        return [self._read(id * n, n) for id in ids]
 
     def set(self, id, data):
         """
@@ -68,8 +180,116 @@ class IndexFile(j.baseclasses.object):
         if len(data) != self.nrbytes:
             raise j.exceptions.Input("the size of pos needs to be %d not %d" % (self.nrbytes, len(data)))
 
-        self._f.seek(self._offset(id))
-        self._f.write(data)
+        offset = self._offset(id)
+        self._grow(offset + self.nrbytes)
+        if self._mm is not None:
+            self._mm[offset : offset + self.nrbytes] = data
+            self._size_store()
+        else:
+            self._f.seek(offset)
+            self._f.write(data)
+
+    def set_many(self, ids, values):
+        """
+        store values[i] at index ids[i]
+        consecutive ids are written at once, the file is grown only once
+        """
+        ids = list(ids)
+        values = [self._encode(value) for value in values]
+        if len(ids) != len(values):
+            raise j.exceptions.Input("nr of ids (%d) and values (%d) differ" % (len(ids), len(values)))
+        if not ids:
+            return
+        n = self.nrbytes
+        for value in values:
+            if len(value) != n:
+                raise j.exceptions.Input("the size of pos needs to be %d not %d" % (n, len(value)))
+
+        self._grow((max(ids) + 1) * n)
+
+        # write runs of consecutive ids with 1 call
+        start = 0
+        for i in range(1, len(ids) + 1):
+            if i < len(ids) and ids[i] == ids[i - 1] + 1:
+                continue
+            offset = self._offset(ids[start])
+            data = b"".join(values[start:i])
+            if self._mm is not None:
+                self._mm[offset : offset + len(data)] = data
+            else:
+                self._f.seek(offset)
+                self._f.write(data)
+            start = i
+        self._size_store()
+
+    def view(self, start=None, end=None):
+        """
+        return a memoryview over the entries start..end (end included)
+        in mmap mode this is zero-copy, otherwise the entries are read in memory first
+        the view has nrbytes per entry, entry id is at view[(id-start)*nrbytes:(id-start+1)*nrbytes]
+        """
+        start = start or 0
+        count = self.count
+        end = count - 1 if end is None else min(end, count - 1)
+        if end < start:
+            return memoryview(b"")
+        if self._mm is not None:
+            return memoryview(self._mm)[self._offset(start) : self._offset(end + 1)]
+        return memoryview(self._read(self._offset(start), (end - start + 1) * self.nrbytes))
+
+    def array(self, start=None, end=None, dtype=None):
+        """
+        return the entries start..end (end included) as numpy array, zero-copy in mmap mode
+
+        :param dtype: numpy dtype of 1 entry, needs to be nrbytes big e.g. ">u4" for big endian uint32
+                      default raw bytes ("V{nrbytes}")
+        """
+        try:
+            import numpy
+        except ImportError:
+            j.builders.runtimes.python3.pip_package_install("numpy")
+            import numpy
+        dtype = numpy.dtype(dtype or "V%d" % self.nrbytes)
+        if dtype.itemsize != self.nrbytes:
+            raise j.exceptions.Input("dtype needs to be %d bytes not %d" % (self.nrbytes, dtype.itemsize))
+        return numpy.frombuffer(self.view(start, end), dtype=dtype)
+
+    def slices(self, start=None, end=None, batch=BATCH_SIZE):
+        """
+        walk over the file in slices of max batch entries
+
+        yields (id of first entry, memoryview over the entries of the slice)
+        """
+        id = start or 0
+        count = self.count
+        last = count - 1 if end is None else min(end, count - 1)
+        while id <= last:
+            stop = min(id + batch, last + 1)
+            yield id, self.view(id, stop - 1)
+            id = stop
+
+    def find(self, key, start=None, end=None):
+        """
+        binary search for key, the entries start..end need to be sorted (compared as bytes)
+
+        :return: id of the entry equal to key or None
+        """
+        key = self._encode(key)
+        id = self.bisect(key, start=start, end=end)
+        if id < self.count and (end is None or id <= end) and self.get(id) == key:
+            return id
+        return None
+
+    def bisect(self, key, start=None, end=None):
+        """
+        binary search for key, the entries start..end need to be sorted (compared as bytes)
+
+        :return: the id of the first entry >= key, which is where key would be inserted
+        """
+        key = self._encode(key)
+        lo = start or 0
+        hi = self.count if end is None else min(end + 1, self.count)
+        return bisect_left(_Entries(self), key, lo, hi)
 
     def iterate(self, method, start=None, end=None, result=None):
         """walk over the indexfile and apply method as follows
@@ -88,21 +308,11 @@ class IndexFile(j.baseclasses.object):
             start {int} -- start id (default: {0})
             end {int} -- end id (default: {0}, which means end of file)
         """
-        if start is not None:
-            id = start
-        else:
-            id = 0
-
-        self._f.seek(self._offset(id))
-
-        while True:
-            data = self._f.read(self.nrbytes)
-            if len(data) < self.nrbytes:
-                break  # EOF
-            result = method(id, data, result=result)
-            id += 1
-            if end is not None and id > end:
-                break
+        n = self.nrbytes
+        for first, view in self.slices(start=start, end=end):
+            data = view.tobytes()
+            for i in range(len(data) // n):
+                result = method(first + i, data[i * n : (i + 1) * n], result=result)
 
         return result
 
@@ -116,3 +326,18 @@ class IndexFile(j.baseclasses.object):
 
         result = self.iterate(do, start=start, end=end, result={})
         return result
+
+
+class _Entries:
+    """
+    sequence over the entries of an IndexFile, used for bisect
+    """
+
+    def __init__(self, index):
+        self._index = index
+
+    def __len__(self):
+        return self._index.count
+
+    def __getitem__(self, id):
+        return self._index.get(id)
@@ -13,11 +13,11 @@ class IndexDB(j.baseclasses.object):
     def _init(self, **kwargs):
         self.basepath = "%s/indexfile/" % (j.dirs.VARDIR)
 
-    def get(self, name, path=None, nrbytes=4):
+    def get(self, name, path=None, nrbytes=4, mmap=False):
         if path is None:
             path = j.sal.fs.joinPaths(self.basepath, name.lower().strip())
 
-        return IndexFile(path, nrbytes=nrbytes)
+        return IndexFile(path, nrbytes=nrbytes, mmap=mmap)
 
     def test(self):
         """
@@ -90,4 +90,44 @@ class IndexDB(j.baseclasses.object):
         print("actual:  ", actual)
         assert expected == actual
 
+        # test bulk calls
+        assert index.get_many([9, 0, 4]) == [b"9999", b"0000", b"4444"]
+        index.set_many([10, 11, 13], [b"aaaa", b"bbbb", b"dddd"])
+        assert index.count == 14
+        assert index.get(12) == b"\x00" * index.nrbytes
+        assert index.get_many(range(10, 14)) == [b"aaaa", b"bbbb", b"\x00\x00\x00\x00", b"dddd"]
+        index.close()
+
+        # test mmap mode on the same file
+        index = self.get("test", mmap=True)
+        assert index.count == 14
+        assert index.list(0, 1) == {0: b"0000", 1: b"1111"}
+        assert index.view(1, 2).tobytes() == b"11112222"
+        slices = [(first, view.tobytes()) for first, view in index.slices(0, 9, batch=4)]
+        assert slices == [(0, b"0000111122223333"), (4, b"4444555566667777"), (8, b"88889999")]
+        index.set(15, b"ffff")
+        assert index.count == 16
+        assert index.get_many([15, 1]) == [b"ffff", b"1111"]
+
+        # test binary search, entries 0..9 are sorted
+        assert index.find(b"3333", 0, 9) == 3
+        assert index.find(b"3334", 0, 9) is None
+        assert index.bisect(b"3334", 0, 9) == 4
+
+        array = index.array(0, 9, dtype="S4")
+        assert len(array) == 10 and array[7] == b"7777"
+        index.close()
+
+        # the mapped file grows in big steps, close cuts it back to the entries written
+        index = self.get("test")
+        assert index.count == 16
+        index.close()
+
+        # an index which was not closed is cut back to the entries written when opened again
+        index = self.get("test", mmap=True)
+        index.set(16, b"gggg")
+        index = self.get("test")
+        assert index.count == 17
+        index.close()
+
         j.sal.fs.remove(index.path)
@@ -1,5 +1,114 @@
 from Jumpscale import j
+from collections.abc import MutableSequence
 import copy
+import numpy
+
+# types of which the cells are stored in a float array, None is stored as nan
+NUMERIC_TYPES = ["float", "int"]
+
+
+class Cells(MutableSequence):
+    """
+    list view on the cells of a row
+
+    for numeric rows the values live in a numpy float array (row.array), the view converts from/to
+    python values so row.cells keeps behaving like a list of which None means empty
+    """
+
+    def __init__(self, row):
+        self._row = row
+
+    def _get(self, v):
+        if v != v:
+            return None
+        if self._row._int and v.is_integer():
+            return int(v)
+        return v
+
+    def __getitem__(self, key):
+        row = self._row
+        if row._dirty is not None:
+            row._refresh()
+        array = row._array
+        if array.dtype == object:
+            return array[key].tolist() if isinstance(key, slice) else array[key]
+        if isinstance(key, slice):
+            return [self._get(v) for v in array[key].tolist()]
+        return self._get(float(array[key]))
+
+    def __setitem__(self, key, value):
+        row = self._row
+        if row.formula is not None:
+            # written directly, so the row is not calculated out of its inputs anymore
+            row.formula_remove()
+        array = row._array
+        if array.dtype == object:
+            array[key] = value
+        elif isinstance(key, slice):
+            array[key] = [numpy.nan if v is None else v for v in value]
+        else:
+            try:
+                array[key] = numpy.nan if value is None else value
+            except (TypeError, ValueError):
+                array[key] = row._clean_val(value)
+        if row._dependents:
+            row.changed(key)
+
+    def __delitem__(self, key):
+        raise j.exceptions.RuntimeError("cannot delete cells of a row")
+
+    def insert(self, index, value):
+        raise j.exceptions.RuntimeError("cannot insert cells in a row")
+
+    def __len__(self):
+        return len(self._row._array)
+
+    def __iter__(self):
+        return iter(self[:])
+
+    def __eq__(self, other):
+        return self[:] == list(other)
+
+    def __repr__(self):
+        return repr(self[:])
+
+
+class Formula:
+    """
+    remembers how a row is calculated out of other rows, so it can be recalculated when one of them changes
+
+    every column is calculated out of the same column of the inputs, empty cells of the inputs are 0
+    @param operation SUM or PROD, calculated vectorized
+    @param method python function with params (values,params) values are the inputvalues from the rows for 1 column
+    """
+
+    def __init__(self, inputs, method=None, params=None, operation=None):
+        if operation not in [None, "SUM", "PROD"]:
+            raise j.exceptions.Input("Cannot find operation:%s for formula" % operation)
+        if operation is None and method is None:
+            raise j.exceptions.Input("formula needs an operation or a method")
+        self.inputs = [row for row in inputs if row is not None]
+        self.method = method
+        self.params = params or {}
+        self.operation = operation
+
+    def calc(self, row, cols=None):
+        """
+        calculate the columns cols (index array, None means all) of row
+        """
+        if cols is None:
+            cols = numpy.arange(row.nrcols)
+        if self.inputs:
+            values = numpy.stack([input._floats(0, row.nrcols, cols) for input in self.inputs], axis=1)
+        else:
+            values = numpy.zeros((len(cols), 0))
+        if self.operation == "SUM":
+            result = values.sum(axis=1)
+        elif self.operation == "PROD":
+            result = values.prod(axis=1)
+        else:
+            result = [self.method(input, self.params) for input in values.tolist()]
+        row._array[cols] = result
 
 
 class Row(j.baseclasses.object):
@@ -35,6 +144,13 @@ class Row(j.baseclasses.object):
         self.sheet = sheet
         assert sheet
 
+        self._array = None
+        self._int = False
+        # rows calculated out of this row
+        self._dependents = []
+        # mask of the columns which need to be recalculated, None if nothing to do
+        self._dirty = None
+        self.formula = None
         self.empty()
 
         self.description = description
@@ -47,6 +163,140 @@ class Row(j.baseclasses.object):
         self.window_month_start = 0
         self.window_month_period = 60
 
+    @property
+    def cells(self):
+        """
+        the cells as list (a view, changes are stored in the row)
+        """
+        return Cells(self)
+
+    @cells.setter
+    def cells(self, values):
+        self.formula_remove()
+        self._alloc(len(values))
+        Cells(self)[:] = list(values)
+
+    @property
+    def numeric(self):
+        return self._array.dtype != object
+
+    @property
+    def array(self):
+        """
+        the cells as numpy array, for numeric rows this is the storage of the row itself (no copy)
+        and empty cells are nan
+        call formula_remove() before and changed() after modifying it in place, so the row is not recalculated
+        anymore and the rows calculated out of this one are
+        """
+        if self._dirty is not None:
+            self._refresh()
+        return self._array
+
+    @array.setter
+    def array(self, values):
+        self.formula_remove()
+        values = numpy.asarray(values, dtype=self._array.dtype)
+        if len(values) != len(self._array):
+            self._alloc(len(values))
+        self._array[:] = values
+        self.changed()
+
+    def formula_set(self, formula):
+        """
+        calculate this row out of other rows with formula, from then on the row is recalculated
+        (lazily, when read) for the columns which changed in one of the inputs
+        if the row is one of the inputs (direct or indirect) it is calculated once, in place, and nothing is remembered
+        """
+        self.formula_remove()
+        if not any(input is self or self in input._upstream() for input in formula.inputs):
+            self.formula = formula
+            for input in formula.inputs:
+                input._dependents.append(self)
+        formula.calc(self)
+        self.changed()
+
+    def formula_remove(self):
+        """
+        keep the current values but stop recalculating the row
+        """
+        if self.formula is None:
+            return
+        if self._dirty is not None:
+            self._refresh()
+        for input in self.formula.inputs:
+            if self in input._dependents:
+                input._dependents.remove(self)
+        self.formula = None
+
+    def _upstream(self):
+        """
+        all rows this row is calculated out of, direct or indirect
+        """
+        result = set()
+        todo = [self]
+        while todo:
+            row = todo.pop()
+            if row.formula is None:
+                continue
+            for input in row.formula.inputs:
+                if input not in result:
+                    result.add(input)
+                    todo.append(input)
+        return result
+
+    def changed(self, cols=None):
+        """
+        mark the rows calculated out of this row dirty for the columns cols (index, slice or None for all)
+        """
+        if not self._dependents:
+            return
+        mask = numpy.zeros(self.nrcols, dtype=bool)
+        if cols is None:
+            mask[:] = True
+        else:
+            mask[cols] = True
+        todo = list(self._dependents)
+        while todo:
+            row = todo.pop()
+            if len(mask) != row.nrcols:
+                rowmask = numpy.ones(row.nrcols, dtype=bool)
+            else:
+                rowmask = mask
+            if row._dirty is None:
+                row._dirty = rowmask.copy()
+            elif (rowmask & ~row._dirty).any():
+                row._dirty |= rowmask
+            else:
+                # already dirty so are the rows calculated out of it
+                continue
+            todo.extend(row._dependents)
+
+    def _refresh(self):
+        dirty = self._dirty
+        self._dirty = None
+        if dirty is not None and self.formula is not None:
+            self.formula.calc(self, numpy.flatnonzero(dirty))
+
+    def _alloc(self, nrcols):
+        name = getattr(self.ttype, "NAME", self.ttype)
+        if name in NUMERIC_TYPES:
+            self._array = numpy.full(nrcols, numpy.nan)
+        else:
+            self._array = numpy.full(nrcols, None, dtype=object)
+        self._int = name == "int"
+
+    def _floats(self, start=None, stop=None, cols=None):
+        """
+        return the cells as float array, empty cells are 0
+        @param cols index array to only return those columns (of the start:stop range)
+        """
+        array = self.array[start:stop]
+        if cols is not None:
+            array = array[cols]
+        if array.dtype == object:
+            array = numpy.array([float(i) if i else 0.0 for i in array])
+        return numpy.nan_to_num(array)
+
     def default_values_set(self, defval=None, stop=None):
         if defval is None:
             defval = self.defval
@@ -56,9 +306,13 @@ class Row(j.baseclasses.object):
             stop = self.nrcols
         else:
             stop += 1
-        for colid in range(0, int(stop)):
-            if self.cells[colid] is None:
-                self.cells[colid] = self.clean_val(defval)
+        self.formula_remove()
+        array = self.array[0 : int(stop)]
+        if self.numeric:
+            array[numpy.isnan(array)] = self._clean_val(defval)
+        else:
+            array[numpy.equal(array, None)] = self._clean_val(defval)
+        self.changed()
 
     def modify_indexation(self, yearlyIndexationInPerc, roundval=100):
 
@@ -74,6 +328,11 @@ class Row(j.baseclasses.object):
         """
         make sure each cell of row is higher than previous cell
         """
+        self.formula_remove()
+        if self.numeric:
+            numpy.fmax.accumulate(numpy.fmax(self.array, 0), out=self._array)
+            self.changed()
+            return
         prev = 0
         for colid in range(0, self.nrcols):
             if self.cells[colid] < prev:
@@ -87,6 +346,20 @@ class Row(j.baseclasses.object):
         return self.ttype.clean(val)
 
     def clean(self):
+        if self.numeric:
+            # cleaning a number gives the same number for a numeric type, only the empty cells
+            # and for int the fractions need to be done
+            empty = numpy.isnan(self.array)
+            if empty.any():
+                val = self._clean_val(None)
+                if val is not None:
+                    self._array[empty] = val
+                    self.changed(empty)
+            if self._int:
+                fractions = numpy.flatnonzero(self._array != numpy.trunc(self._array))
+                for colid in fractions:
+                    self.cells[colid] = self._clean_val(self.cells[colid])
+            return self
         for colid in range(0, self.nrcols):
             self.cells[colid] = self._clean_val(self.cells[colid])
         return self
@@ -98,10 +371,10 @@ class Row(j.baseclasses.object):
         return row
 
     def empty(self):
+        self._alloc(self.nrcols)
         if self.defval != None:
-            self.cells = [self.defval for item in range(self.nrcols)]
-        else:
-            self.cells = [None for item in range(self.nrcols)]
+            self._array[:] = self.defval
+        self.changed()
 
     def aggregate(self, period="Y", aggregate_type=None, roundnr=2, text=False):
         """
@@ -112,50 +385,30 @@ class Row(j.baseclasses.object):
         if aggregate_type:
             self.aggregate_type = aggregate_type
 
-        def calc(months):
-
+        def calc(nrperiods, nrmonths):
+            # one line per period, missing months at the end are 0
+            values = numpy.zeros(nrperiods * nrmonths)
+            cells = self._floats(0, nrperiods * nrmonths)
+            values[: len(cells)] = cells
+            values = values.reshape(nrperiods, nrmonths)
             if self.aggregate_type == "LAST":
-                return self.cells[months[-1]]
+                return values[:, -1]
             if self.aggregate_type == "FIRST":
-                return self.cells[months[0]]
-            result = 0.0
-            if self.aggregate_type == "MIN":
-                result = 9999999999999999999
-            for m in months:
-                if self.cells[m]:
-                    val = float(self.cells[m])
-                else:
-                    val = 0
-                if val is None:
-                    raise j.exceptions.RuntimeError(
-                        "Cannot aggregrate row %s from group %s,\n%s" % (self.name, self.groupname, self.cells)
-                    )
-                if self.aggregate_type == "T" or self.aggregate_type == "SUM" or self.aggregate_type == "AVG":
-                    result += val
-                if self.aggregate_type == "MIN":
-                    if (val < 0 and val < result) or (val > 0 and val > result):
-                        result = val
-                if self.aggregate_type == "MAX":
-                    if (val > 0 and val > result) or (val < 0 and val < result):
-                        result = val
+                return values[:, 0]
+            if self.aggregate_type in ["T", "SUM"]:
+                return values.sum(axis=1)
             if self.aggregate_type == "AVG":
-                result = result / len(months)
-            return result
+                return values.mean(axis=1)
+            if self.aggregate_type == "MIN":
+                return values.min(axis=1)
+            if self.aggregate_type == "MAX":
+                return values.max(axis=1)
+            return numpy.zeros(nrperiods)
 
-        # monthAttributes=[item.name for item in self.months[1].JSModel_MODEL_INFO.attributes]
         if period == "Y":
-            result = [0.0 for item in range(7)]
-            # j.debug()
-            for year in range(1, 8):
-                months = [12 * (year - 1) + i for i in range(12)]
-                # name=self._getYearStringFromYearNr(year)
-                result[year - 1] = calc(months)
+            result = calc(7, 12).tolist()
         elif period == "Q":
-            result = [0.0 for item in range(6 * 4)]
-            for quarter in range(1, 4 * 6 + 1):
-                months = [3 * (quarter - 1) + i for i in range(3)]
-                # name=self._getYearStringFromYearNr(year)
-                result[quarter - 1] = calc(months)
+            result = calc(6 * 4, 3).tolist()
         elif period == "B":
             result = self.cells[0:12]
         else:
@@ -346,6 +599,8 @@ class Row(j.baseclasses.object):
             start = 0
         if stop is None:
             stop = len(self.cells) - 1
+        if self.numeric:
+            return float(numpy.fmax.reduce(self.array[start : stop + 1], initial=0))
         r = 0
         for x in range(start, stop + 1):
             if self.cells[x] > r:
@@ -500,6 +755,15 @@ class Row(j.baseclasses.object):
         if roundval > 0:
             nrfloat = 0
 
+        if self.numeric:
+            self.formula_remove()
+            array = self.array
+            if roundval > 0:
+                array[:] = numpy.round(array / roundval, nrfloat) * roundval
+            array[:] = numpy.round(array, nrfloat or 0)
+            self.changed()
+            return
+
         for colid in range(0, int(self.nrcols)):
             if self.cells[colid] is not None:
                 if roundval > 0:
@@ -513,6 +777,11 @@ class Row(j.baseclasses.object):
         """
         negate the values in the row, make sure are < 0
         """
+        if self.numeric:
+            self.formula_remove()
+            numpy.negative(numpy.abs(self.array), out=self._array)
+            self.changed()
+            return
         for colid in range(0, int(self.nrcols)):
             if self.cells[colid] > 0:
                 self.cells[colid] = -self.cells[colid]
@@ -552,6 +821,11 @@ class Row(j.baseclasses.object):
         """
         invert + becomes - and reverse
         """
+        if self.numeric:
+            self.formula_remove()
+            numpy.negative(self.array, out=self._array)
+            self.changed()
+            return
         for colid in range(0, int(self.nrcols)):
             self.cells[colid] = -self.cells[colid]
 
@@ -615,51 +889,54 @@ class Row(j.baseclasses.object):
         return dict
 
     def _check_operator(self, other):
-        if not isinstance(other, Row):
-            raise j.exceptions.Input("needs to be of type row, now:\n%s" % other)
-        if self.nrcols != other.nrcols:
-            raise j.exceptions.Input("nr cols of 2 rows need to be the same\n%s\n%s"(self, other))
-        other.clean()
-        self.clean()
+        if isinstance(other, (int, float)):
+            self.clean()
+        else:
+            if not isinstance(other, Row):
+                raise j.exceptions.Input("needs to be of type row or a number, now:\n%s" % other)
+            if self.nrcols != other.nrcols:
+                raise j.exceptions.Input("nr cols of 2 rows need to be the same\n%s\n%s" % (self, other))
+            other.clean()
+            self.clean()
         r = self.copy(name="changeme", empty=True)
         self.sheet.rows.pop("changeme")  # should not be remembered on sheet level
+        self.sheet.rowNames.remove("changeme")
         return r
 
-    def accumulate(self, name):
+    def _operate(self, other, operator):
+        result = self._check_operator(other)
+        if not isinstance(other, Row):
+            result.array = operator(self._floats(), float(other))
+        else:
+            result.array = operator(self._floats(), other._floats())
+        return result.clean()
+
+    def accumulate(self, name, operation="SUM"):
         """
         return row with name where values are accumulated
+        @param operation SUM,PROD,MIN,MAX e.g. MAX gives the highest value so far
         """
+        operators = {"SUM": numpy.cumsum, "PROD": numpy.cumprod}
+        operators["MIN"] = numpy.minimum.accumulate
+        operators["MAX"] = numpy.maximum.accumulate
+        if operation not in operators:
+            raise j.exceptions.Input("Cannot find operation:%s for accumulate" % operation)
         row = self.copy(name=name, empty=True)
         row.aggregate_type = "LAST"
-        total = self._clean_val(0)
-        for colid in range(0, int(self.nrcols)):
-            total += self.cells[colid]
-            row.cells[colid] = total
+        row.array = operators[operation](self._floats())
         return row
 
     def __add__(self, other):
-        result = self._check_operator(other)
-        for colid in range(0, int(self.nrcols)):
-            result.cells[colid] = self.cells[colid] + other.cells[colid]
-        return result.clean()
+        return self._operate(other, numpy.add)
 
     def __sub__(self, other):
-        result = self._check_operator(other)
-        for colid in range(0, int(self.nrcols)):
-            result.cells[colid] = self.cells[colid] - other.cells[colid]
-        return result.clean()
+        return self._operate(other, numpy.subtract)
 
     def __mul__(self, other):
-        result = self._check_operator(other)
-        for colid in range(0, int(self.nrcols)):
-            result.cells[colid] = self.cells[colid] * other.cells[colid]
-        return result.clean()
+        return self._operate(other, numpy.multiply)
 
     def __truediv__(self, other):
-        result = self._check_operator(other)
-        for colid in range(0, int(self.nrcols)):
-            result.cells[colid] = self.cells[colid] / other.cells[colid]
-        return result.clean()
+        return self._operate(other, numpy.true_divide)
 
     def __str__(self):
         if self.nrcols > 18:
@@ -391,15 +391,7 @@ class Sheet(j.baseclasses.object):
         @param rowDest if empty will be same as first row
         @param method is python function with params (values,params) values are inputvalues from the rows
         """
-        for colnr in range(rowDest.nrcols):
-            input = []
-            for rowname in rownames:
-                val = self.getCell(rowname, colnr)
-                if val is None:
-                    val = 0.0
-                input.append(val)
-
-            rowDest.cells[colnr] = method(input, params)
+        rowDest.formula_set(Formula([self.getRow(rowname) for rowname in rownames], method=method, params=params))
         return rowDest
 
     def sumRows(self, rownames, newRow):
@@ -411,13 +403,7 @@ class Sheet(j.baseclasses.object):
         if j.data.types.string.check(newRow):
             newRow = self.getRow(newRow)
 
-        def summ(values, params):
-            total = 0.0
-            for value in values:
-                total += value
-            return total
-
-        newRow = self.applyFunctionOnValuesFromRows(rownames, summ, newRow)
+        newRow.formula_set(Formula([self.getRow(rowname) for rowname in rownames], operation="SUM"))
         return newRow
 
     def multiplyRows(self, rownames, newRow):
@@ -429,13 +415,7 @@ class Sheet(j.baseclasses.object):
         if j.data.types.string.check(newRow):
             newRow = self.getRow(newRow)
 
-        def mult(values, params):
-            total = 1.0
-            for value in values:
-                total = total * value
-            return total
-
-        newRow = self.applyFunctionOnValuesFromRows(rownames, mult, newRow)
+        newRow.formula_set(Formula([self.getRow(rowname) for rowname in rownames], operation="PROD"))
         return newRow
 
     def text_dict(self, period="B", aggregate_type="S"):
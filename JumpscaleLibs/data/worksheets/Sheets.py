@@ -62,51 +62,31 @@ class Sheets(j.baseclasses.object):
         @param rows is array if of rows we would like to use as inputvalues
         @param rowDest if empty will be same as first row
         @param method is python function with params (values,params) values are inputvalues from the rows
+
+        rowDest remembers how it was calculated, when a cell of one of the rows changes
+        only that column of rowDest gets recalculated when it is read again
         """
-        if rowDest == "":
+        if not rowDest:
             rowDest = rows[0]
-        for colnr in range(rowDest.nrcols):
-            input = []
-            for row in rows:
-                val = row.cells[colnr]
-                if val is None:
-                    val = 0.0
-                input.append(val)
-            rowDest.cells[colnr] = method(input, params)
+        rowDest.formula_set(Formula(rows, method=method, params=params))
         return rowDest
 
     def sumRows(self, rows, newRow):
         """
         make sum of rows
         @param rows is list of rows to add
-        @param newRow is the row where the result will be stored
+        @param newRow is the row where the result will be stored, it gets recalculated when the rows change
         """
-
-        def sum(values, params):
-            total = 0.0
-            for value in values:
-                total += value
-            return total
-
-        rows2 = []
-        for row in rows:
-            if row is not None:
-                rows2.append(row)
-        newRow = self.applyFunction(rows2, sum, newRow)
+        newRow.formula_set(Formula(rows, operation="SUM"))
         return newRow
 
     def multiplyRows(self, rows, newRow):
-        def mult(values, params):
-            total = 1.0
-            for value in values:
-                total = total * value
-            return total
-
-        rows2 = []
-        for row in rows:
-            if row is not None:
-                rows2.append(row)
-        newRow = self.applyFunction(rows2, mult, newRow)
+        """
+        make product of rows
+        @param rows is list of rows to multiply
+        @param newRow is the row where the result will be stored, it gets recalculated when the rows change
+        """
+        newRow.formula_set(Formula(rows, operation="PROD"))
         return newRow
 
     def test(self):
@@ -157,6 +137,16 @@ class Sheets(j.baseclasses.object):
 
         r = s.addRow("unitsTotal", groupname="units")
         r0 = s.sumRows(["nrCU", "nrSU"], "unitsTotal")
+        assert r0.cells == [a + b for a, b in zip(s.rows["nrCU"].cells, s.rows["nrSU"].cells)]
+        assert r0.aggregate("Y")[0] == round(sum(r0.cells[0:12]), 2)
+
+        # changing an input only recalculates that column of the rows calculated out of it
+        r3 = s.addRow("unitsDouble", groupname="units")
+        self.sumRows([r0, r0], r3)
+        s.rows["nrCU"].cells[5] = 1000
+        assert r0._dirty.nonzero()[0].tolist() == [5]
+        assert r3.cells[5] == 2 * (1000 + s.rows["nrSU"].cells[5])
+        assert r0._dirty is None and r3._dirty is None
 
         r1 = s.addRow("nrNU", groupname="units")
         r1.text2row("2:100,5:200", standstill=5, defval=None, round=False, interpolate=True)
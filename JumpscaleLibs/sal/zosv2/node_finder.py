@@ -1,14 +1,28 @@
 from Jumpscale import j
-import requests
+import time
 import netaddr
+import gevent
+import gevent.lock
+from typing import NamedTuple
 
 from .network import is_private
 
+# seconds after which the node index is fetched again from the explorer
+NODE_INDEX_MAX_AGE = 300
+
 
 class NodeFinder:
-    def __init__(self, explorer):
+    def __init__(self, explorer, index_max_age=NODE_INDEX_MAX_AGE):
         self._nodes = explorer.nodes
         self._farms = explorer.farms
+        self._index = NodeIndex(explorer, max_age=index_max_age)
+
+    @property
+    def index(self):
+        """
+        in memory index of the nodes and farms, used by nodes_by_capacity
+        """
+        return self._index
 
     def filter_is_up(self, node):
         """
@@ -50,23 +64,22 @@ class NodeFinder:
         hru=None,
         currency=None,
     ):
-        not_supported_farms = []
-        nodes = self.nodes_search(farm_id=farm_id, farm_name=farm_name, country=country, city=city)
-        for node in nodes:
-            total = node.total_resources
-            reserved = node.reserved_resources
-            if cru and total.cru - max(0, reserved.cru) < cru:
-                continue
-
-            if mru and total.mru - max(0, reserved.mru) < mru:
-                continue
-
-            if sru and total.sru - max(0, reserved.sru) < sru:
-                continue
+        """
+        yield the nodes with at least the given free capacity
 
-            if hru and total.hru - max(0, reserved.hru) < hru:
-                continue
+        the nodes are looked up in the node index, which is fetched again
+        from the explorer once it is older than its max age, see `index`
+        """
+        if farm_name:
+            farm = self._index.farm_get(farm_name=farm_name)
+            if farm is None:
+                raise j.exceptions.NotFound(f"Could not find farm with name {farm_name}")
+            farm_id = farm.id
 
+        not_supported_farms = []
+        entries = self._index.query(farm_id=farm_id, country=country, city=city, cru=cru, sru=sru, mru=mru, hru=hru)
+        for entry in entries:
+            node = entry.node
             if currency:
                 if currency == "FreeTFT":
                     if node.free_to_use:
@@ -76,13 +89,8 @@ class NodeFinder:
                     continue
                 if node.farm_id in not_supported_farms:
                     continue
-                try:
-                    farm = self._farms.get(node.farm_id)
-                except requests.exceptions.HTTPError:
-                    not_supported_farms.append(node.farm_id)
-                    continue
-
-                if not self.filter_farm_currency(farm, currency):
+                farm = self._index.farm_get(farm_id=node.farm_id)
+                if farm is None or not self.filter_farm_currency(farm, currency):
                     not_supported_farms.append(node.farm_id)
                     continue
             yield node
@@ -105,6 +113,137 @@ class NodeFinder:
         return self._nodes.list(farm_id=farm_id, country=country, city=city, cru=cru, sru=sru, mru=mru, hru=hru)
 
 
+class IndexedNode(NamedTuple):
+    node: object
+    farm_id: int
+    country: str
+    city: str
+    # free capacity
+    cru: int
+    mru: int
+    sru: int
+    hru: int
+    free_to_use: bool
+    public_ip4: bool
+    public_ip6: bool
+
+
+class NodeIndex:
+    """
+    In memory index of all nodes and farms of an explorer,
+    with the fields nodes are selected on computed up front.
+
+    The index is fetched again from the explorer when it is queried
+    while older than max_age seconds.
+    """
+
+    def __init__(self, explorer, max_age=NODE_INDEX_MAX_AGE):
+        self._nodes = explorer.nodes
+        self._farms = explorer.farms
+        self.max_age = max_age
+        self._entries = []
+        self._farms_by_id = {}
+        self._farms_by_name = {}
+        self._updated = 0
+        self._lock = gevent.lock.Semaphore()
+
+    @property
+    def updated(self):
+        """
+        epoch of the last refresh, 0 if the index was never fetched
+        """
+        return self._updated
+
+    def refresh(self):
+        """
+        fetch all nodes and farms from the explorer
+        """
+        nodes = gevent.spawn(lambda: list(self._nodes.iter()))
+        farms = list(self._farms.iter())
+        nodes = nodes.get()
+
+        entries = []
+        for node in nodes:
+            total = node.total_resources
+            reserved = node.reserved_resources
+            entries.append(
+                IndexedNode(
+                    node=node,
+                    farm_id=node.farm_id,
+                    country=node.location.country,
+                    city=node.location.city,
+                    cru=total.cru - max(0, reserved.cru),
+                    mru=total.mru - max(0, reserved.mru),
+                    sru=total.sru - max(0, reserved.sru),
+                    hru=total.hru - max(0, reserved.hru),
+                    free_to_use=node.free_to_use,
+                    public_ip4=filter_public_ip(node, 4),
+                    public_ip6=filter_public_ip(node, 6),
+                )
+            )
+        self._entries = entries
+        self._farms_by_id = {farm.id: farm for farm in farms}
+        self._farms_by_name = {farm.name: farm for farm in farms}
+        self._updated = time.time()
+
+    def _check(self):
+        if time.time() - self._updated <= self.max_age:
+            return
+        with self._lock:
+            # another greenlet might have refreshed the index while we waited
+            if time.time() - self._updated > self.max_age:
+                self.refresh()
+
+    def farm_get(self, farm_id=None, farm_name=None):
+        """
+        :return: the farm with the given id or name, None if there is no such farm
+        """
+        self._check()
+        if farm_name:
+            return self._farms_by_name.get(farm_name)
+        return self._farms_by_id.get(farm_id)
+
+    def query(
+        self,
+        farm_id=None,
+        country=None,
+        city=None,
+        cru=None,
+        sru=None,
+        mru=None,
+        hru=None,
+        free_to_use=None,
+        public_ip4=None,
+        public_ip6=None,
+    ):
+        """
+        :return: the entries of the nodes matching all given arguments,
+                 the capacity arguments are minimal free capacities, None matches anything
+        :rtype: list of IndexedNode
+        """
+        self._check()
+        result = []
+        for entry in self._entries:
+            if farm_id is not None and entry.farm_id != farm_id:
+                continue
+            if country and entry.country != country:
+                continue
+            if city and entry.city != city:
+                continue
+            if (cru and entry.cru < cru) or (mru and entry.mru < mru):
+                continue
+            if (sru and entry.sru < sru) or (hru and entry.hru < hru):
+                continue
+            if free_to_use is not None and entry.free_to_use != free_to_use:
+                continue
+            if public_ip4 is not None and entry.public_ip4 != public_ip4:
+                continue
+            if public_ip6 is not None and entry.public_ip6 != public_ip6:
+                continue
+            result.append(entry)
+        return result
+
+
 def is_public_ip(ip, version):
     try:
         network = netaddr.IPNetwork(ip)
@@ -0,0 +1,168 @@
+import os
+import shutil
+import sqlite3
+import hashlib
+import tempfile
+
+from Jumpscale import j
+
+JSBASE = j.baseclasses.object
+
+# bytes read at once when hashing or copying a stream
+CHUNK_SIZE = 64 * 1024
+
+
+class BlobStore(j.baseclasses.object):
+    """
+    Content addressed store for mail attachments on the local filesystem
+
+    A blob is stored once under the blake2b hash of its content, whatever the nr of mails it is attached to.
+    Every put of a blob adds a reference and every delete removes one, the file goes when the last reference does.
+    The reference counts are kept in a sqlite db next to the blobs.
+    """
+
+    def __init__(self, path=None):
+        """
+        :param path: dir of the store, default {VARDIR}/mail/blobs
+        """
+        JSBASE.__init__(self)
+        self.path = path or j.sal.fs.joinPaths(j.dirs.VARDIR, "mail", "blobs")
+        j.sal.fs.createDir(self.path)
+        self._db = sqlite3.connect(j.sal.fs.joinPaths(self.path, "refs.db"), isolation_level=None)
+        self._db.execute("CREATE TABLE IF NOT EXISTS refs (hash TEXT PRIMARY KEY, count INTEGER, size INTEGER);")
+
+    def path_get(self, key):
+        """
+        path of the file of a blob
+        """
+        return j.sal.fs.joinPaths(self.path, key[:2], key[2:4], key)
+
+    def put(self, data, dest=None):
+        """
+        store a blob, or add a reference to it when it is already there
+        :param data: bytes or binary file like object
+        :param dest: if given, a file to create with the content of the blob, a hard link if the filesystem allows it
+        :return: hash of the blob
+        """
+        if isinstance(data, (bytes, bytearray, memoryview)):
+            key = hashlib.blake2b(data).hexdigest()
+            size = len(data)
+            tmp = None
+        else:
+            # hash while spooling to a temporary file in the store, so it can be renamed in place
+            h = hashlib.blake2b()
+            size = 0
+            fd, tmp = tempfile.mkstemp(dir=self.path)
+            with os.fdopen(fd, "wb") as f:
+                for chunk in iter(lambda: data.read(CHUNK_SIZE), b""):
+                    h.update(chunk)
+                    f.write(chunk)
+                    size += len(chunk)
+            key = h.hexdigest()
+
+        path = self.path_get(key)
+        # the write lock on the db keeps a concurrent delete of the last reference from removing the file
+        self._db.execute("BEGIN IMMEDIATE;")
+        try:
+            if not os.path.exists(path):
+                j.sal.fs.createDir(os.path.dirname(path))
+                if tmp is None:
+                    fd, tmp = tempfile.mkstemp(dir=self.path)
+                    with os.fdopen(fd, "wb") as f:
+                        f.write(data)
+                os.rename(tmp, path)
+                tmp = None
+            if dest is not None:
+                try:
+                    os.link(path, dest)
+                except OSError:
+                    shutil.copyfile(path, dest)
+            self._db.execute(
+                "INSERT INTO refs (hash, count, size) VALUES (?, 1, ?) "
+                "ON CONFLICT(hash) DO UPDATE SET count = count + 1;",
+                (key, size),
+            )
+            self._db.execute("COMMIT;")
+        except BaseException:
+            self._db.execute("ROLLBACK;")
+            raise
+        finally:
+            if tmp is not None:
+                os.remove(tmp)
+        return key
+
+    def get(self, key):
+        """
+        :return: the content of a blob as bytes
+        """
+        with self.open(key) as f:
+            return f.read()
+
+    def open(self, key):
+        """
+        :return: binary file object to stream the content of a blob
+        """
+        path = self.path_get(key)
+        if not os.path.exists(path):
+            raise j.exceptions.NotFound("blob %s not found" % key)
+        return open(path, "rb")
+
+    def exists(self, key):
+        return os.path.exists(self.path_get(key))
+
+    def refs(self, key):
+        """
+        :return: nr of references to a blob
+        """
+        row = self._db.execute("SELECT count FROM refs WHERE hash = ?;", (key,)).fetchone()
+        return row[0] if row else 0
+
+    def delete(self, key):
+        """
+        remove a reference to a blob, the blob is deleted with its last reference
+        """
+        self._db.execute("BEGIN IMMEDIATE;")
+        try:
+            self._db.execute("UPDATE refs SET count = count - 1 WHERE hash = ?;", (key,))
+            if self.refs(key) <= 0:
+                self._db.execute("DELETE FROM refs WHERE hash = ?;", (key,))
+                path = self.path_get(key)
+                if os.path.exists(path):
+                    os.remove(path)
+            self._db.execute("COMMIT;")
+        except BaseException:
+            self._db.execute("ROLLBACK;")
+            raise
+
+    def collect(self):
+        """
+        for a store of which the blobs are only used through the files put makes for them (see dest):
+        delete the blobs none of those files links to anymore, whatever their nr of references
+        :return: nr of blobs deleted
+        """
+        deleted = 0
+        for (key,) in self._db.execute("SELECT hash FROM refs;").fetchall():
+            self._db.execute("BEGIN IMMEDIATE;")
+            try:
+                path = self.path_get(key)
+                # the store itself holds one link
+                if not os.path.exists(path) or os.stat(path).st_nlink <= 1:
+                    self._db.execute("DELETE FROM refs WHERE hash = ?;", (key,))
+                    if os.path.exists(path):
+                        os.remove(path)
+                    deleted += 1
+                self._db.execute("COMMIT;")
+            except BaseException:
+                self._db.execute("ROLLBACK;")
+                raise
+        return deleted
+
+    @property
+    def stats(self):
+        """
+        :return: dict with the nr of blobs, nr of references, bytes stored and bytes referenced
+        """
+        blobs, refs, size, refsize = self._db.execute(
+            "SELECT count(*), sum(count), sum(size), sum(size * count) FROM refs;"
+        ).fetchone()
+        return {"blobs": blobs, "refs": refs or 0, "size": size or 0, "referenced": refsize or 0}
@@ -1,4 +1,6 @@
+import io
 import time
+import base64
 import email
 import email.utils
 from email import encoders
@@ -9,6 +11,8 @@ from collections import namedtuple
 from dateutil.parser import parse
 from Jumpscale import j
 
+from .blobstore import BlobStore
+
 
 Attachment = namedtuple(
     "Attachment", ["hashedfilename", "hashedfilepath", "hashedfileurl", "originalfilename", "binarycontent", "type"]
@@ -54,7 +58,14 @@ def parse_email(message):
             html_body += part_body
 
         elif part_content_type is not None and part_filename is not None:
-            attachments.append({"name": part_filename, "content": part_body, "contentType": part_content_type})
+            attachments.append(
+                {
+                    "name": part_filename,
+                    "content": part_body,
+                    "contentType": part_content_type,
+                    "data": part.get_payload(decode=True),
+                }
+            )
 
     return {
         "body": body,
@@ -69,8 +80,26 @@ def parse_email(message):
 
 
 def store_message(model, message, folder="inbox", unseen=True, recent=True):
+    mail = message_save(model, message, folder=folder, unseen=unseen, recent=recent)
+    fulltext_add(model, mail)
+    return mail
+
+
+def message_save(model, message, folder="inbox", unseen=True, recent=True):
+    """
+    parse a message and save it in the model, without indexing it for full text search (see fulltext_add)
+    :return: the saved message object
+    """
+    # imported here, the imap server itself imports this module
+    from .imap.asimap.fetch import message_metadata
+
     if isinstance(message, str):
         data = parse_email_body(message)
+    elif isinstance(message, (bytes, bytearray)):
+        data = parse_email(email.message_from_bytes(message))
+    elif hasattr(message, "read"):
+        # a binary file like object, as the smtp server passes it
+        data = parse_email(email.message_from_binary_file(message))
     elif isinstance(message, dict):
         message = dict_to_message(message)
         data = parse_email(message)
@@ -87,17 +116,174 @@ def store_message(model, message, folder="inbox", unseen=True, recent=True):
     if data.get("date"):
         old_date_format = parse(data.get("date"))
         mail.date = old_date_format.strftime(new_format)
-    mail.attachments = data["attachments"]
+    mail.attachments = [attachment_store(attachment) for attachment in data["attachments"]]
     mail.folder = folder
     mail.unseen = unseen
     mail.recent = recent
     mail.uid = 0
     mail.uid_vv = 0
     mail.mtime = int(time.time())
-    mail.save()
+    # what IMAP FETCH asks for when listing a folder, computed once from the message as the imap server serves it
+    metadata = message_metadata(object_to_message(mail))
+    mail.size = metadata["size"]
+    mail.header = metadata["header"]
+    mail.envelope = metadata["envelope"]
+    mail.bodystructure = metadata["bodystructure"]
+    mail.bodystructure_noext = metadata["bodystructure_noext"]
+    try:
+        mail.save()
+    except Exception:
+        attachments_release(mail)
+        raise
     return mail
 
 
+_blobstore = None
+
+# bytes of an attachment encoded at once, a multiple of the 57 bytes of a base64 line
+BASE64_CHUNK_SIZE = 57 * 1024
+
+
+def blobstore():
+    """
+    the blob store the attachments of the mails are kept in
+    """
+    global _blobstore
+    if _blobstore is None:
+        _blobstore = BlobStore()
+    return _blobstore
+
+
+def attachment_store(attachment):
+    """
+    put the decoded content of a parsed attachment in the blob store, only the reference stays in the attachment
+    :param attachment: attachment dict as parse_email returns it
+    :return: the attachment dict to set on the message object
+    """
+    data = attachment.pop("data", None)
+    if data is None:
+        return attachment
+    attachment.pop("content", None)
+    attachment["contenttype"] = attachment.pop("contentType", "")
+    attachment["blob"] = blobstore().put(data)
+    attachment["size"] = len(data)
+    return attachment
+
+
+def attachment_open(attachment):
+    """
+    :return: binary file object with the decoded content of an attachment of a stored mail
+    """
+    if attachment.blob:
+        return blobstore().open(attachment.blob)
+    # stored inline before there was a blob store
+    content = attachment.content
+    if isinstance(content, str):
+        content = content.encode()
+    return io.BytesIO(content or b"")
+
+
+def attachment_base64(attachment):
+    """
+    base64 encode the content of an attachment chunk by chunk while reading it from the store
+    the email package needs the payload as one string, so the encoded attachment is kept in memory
+    """
+    lines = []
+    with attachment_open(attachment) as f:
+        for chunk in iter(lambda: f.read(BASE64_CHUNK_SIZE), b""):
+            lines.append(base64.encodebytes(chunk).decode("ascii"))
+    return "".join(lines)
+
+
+def attachments_release(mail):
+    """
+    drop the references of a mail to its attachments, to call when the mail is deleted
+    """
+    for attachment in mail.attachments:
+        if attachment.blob:
+            blobstore().delete(attachment.blob)
+
+
+# models we checked (or created) the full text table for, None if sqlite has no fts5 trigram support
+_fulltext_tables = {}
+
+
+def fulltext_table(model):
+    """
+    Name of the full text table of the messages next to the index of the model, created if needed
+    It is a fts5 table with a trigram tokenizer so it answers substring searches (3 chars or more)
+    :return: the table name or None if the sqlite library does not support it
+    """
+    key = model.index.sql_table_name
+    if key not in _fulltext_tables:
+        table = "{}_fulltext".format(key)
+        try:
+            model.query(
+                "CREATE VIRTUAL TABLE IF NOT EXISTS {} USING fts5(headers, body, tokenize='trigram');".format(table)
+            )
+        except Exception as e:
+            j.tools.logger._log_warning("no full text index for the mails: %s" % e)
+            table = None
+        _fulltext_tables[key] = table
+    return _fulltext_tables[key]
+
+
+def _fulltext_content(mail):
+    headers = [mail.from_email, mail.to_email, mail.subject]
+    headers.extend(header.value for header in mail.headers)
+    body = [mail.body, mail.htmlbody]
+    for attachment in mail.attachments:
+        if attachment.blob:
+            # binary attachments have no text to search in
+            if not attachment.contenttype.startswith("text/"):
+                continue
+            with attachment_open(attachment) as f:
+                content = f.read()
+        else:
+            content = attachment.content
+        if isinstance(content, bytes):
+            content = content.decode(errors="replace")
+        body.append(content)
+    return "\n".join(filter(None, headers)), "\n".join(filter(None, body))
+
+
+def fulltext_add(model, mail):
+    """
+    (re)index the headers and body of a stored mail
+    """
+    table = fulltext_table(model)
+    if table is None:
+        return
+    headers, body = _fulltext_content(mail)
+    model.query("DELETE FROM {} WHERE rowid = ?;".format(table), [mail.id])
+    model.query("INSERT INTO {} (rowid, headers, body) VALUES (?, ?, ?);".format(table), [mail.id, headers, body])
+
+
+def fulltext_remove(model, ids):
+    """
+    remove mails from the full text index
+    :param ids: list of mail ids
+    """
+    table = fulltext_table(model)
+    if table is None or not ids:
+        return
+    model.query("DELETE FROM {} WHERE rowid IN ({});".format(table, ",".join("?" * len(ids))), list(ids))
+
+
+def fulltext_sync(model):
+    """
+    index the mails stored before there was a full text index, and forget the deleted ones
+    """
+    table = fulltext_table(model)
+    if table is None:
+        return
+    query = "SELECT id FROM {0} WHERE id NOT IN (SELECT rowid FROM {1});"
+    for (id,) in model.query(query.format(model.index.sql_table_name, table)).fetchall():
+        fulltext_add(model, model.get(id))
+    query = "SELECT rowid FROM {1} WHERE rowid NOT IN (SELECT id FROM {0});"
+    fulltext_remove(model, [id for (id,) in model.query(query.format(model.index.sql_table_name, table)).fetchall()])
+
+
 def object_to_message(mail):
     textmessage = None
     plaintextmessage = None
@@ -121,8 +307,8 @@ def object_to_message(mail):
             part = MIMEBase(*attachment.contenttype.split("/"))
         else:
             part = MIMEBase("application", "octet-stream")
-        part.set_payload(attachment.content)
-        encoders.encode_base64(part)
+        part.set_payload(attachment_base64(attachment))
+        part["Content-Transfer-Encoding"] = "base64"
         part.add_header("Content-Disposition", f'attachment; filename="{attachment.name}"')
         attachments.append(part)
 
@@ -36,6 +36,10 @@ SERVER_ID = {
 #
 STATES = ("not_authenticated", "authenticated", "selected", "logged_out")
 
+# FETCH answers are sent in chunks of about this many characters.
+#
+FETCH_CHUNK_SIZE = 64 * 1024
+
 
 ##################################################################
 ##################################################################
@@ -1116,8 +1120,20 @@ class Authenticated(BaseClientHandler):
                 if attempt >= RETRY_LIMIT:
                     raise
 
+        # Send the answers in chunks instead of one write per message.
+        #
+        chunk = []
+        chunk_size = 0
         for idx, iter_results in results:
-            self.client.push("* %d FETCH (%s)\r\n" % (idx, " ".join(iter_results)))
+            response = "* %d FETCH (%s)\r\n" % (idx, " ".join(iter_results))
+            chunk.append(response)
+            chunk_size += len(response)
+            if chunk_size >= FETCH_CHUNK_SIZE:
+                self.client.push("".join(chunk))
+                chunk = []
+                chunk_size = 0
+        if chunk:
+            self.client.push("".join(chunk))
 
         return seq_changed
 
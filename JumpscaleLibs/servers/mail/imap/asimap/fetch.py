@@ -20,6 +20,7 @@ from io import StringIO
 import re
 from email.generator import Generator
 from email.header import Header
+from email.parser import HeaderParser
 
 try:
     from kitchen.text.converters import to_bytes
@@ -46,6 +47,37 @@ def fix_eols(s):
     return s
 
 
+############################################################################
+#
+def message_metadata(msg):
+    """
+    The FETCH data of a message that never changes. It is computed once when
+    the message is stored so that FETCH does not have to rebuild and parse
+    the message for it.
+
+    Returns a dict with the RFC822.SIZE (`size`), the header block (`header`),
+    the ENVELOPE (`envelope`) and the BODYSTRUCTURE with (`bodystructure`)
+    and without (`bodystructure_noext`) extension data.
+
+    Arguments:
+    - `msg`: the email.message.Message to compute the metadata of
+    """
+    fp = StringIO()
+    g = Generator(fp, mangle_from_=False)
+    g.flatten(msg)
+    size = len(to_bytes(fix_eols(fp.getvalue())))
+    fp = StringIO()
+    g = HeaderGenerator(fp)
+    g.flatten(msg)
+    return {
+        "size": size,
+        "header": fp.getvalue(),
+        "envelope": FetchAtt(FetchAtt.OP_ENVELOPE).envelope(msg),
+        "bodystructure": FetchAtt(FetchAtt.OP_BODYSTRUCTURE).bodystructure(msg),
+        "bodystructure_noext": FetchAtt(FetchAtt.OP_BODYSTRUCTURE, ext_data=False).bodystructure(msg),
+    }
+
+
 ############################################################################
 #
 class BadSection(exceptions.Bad):
@@ -297,26 +329,34 @@ class FetchAtt(object):
         """
         self.ctx = ctx
 
+        # The metadata stored with the message answers most of what clients
+        # ask for when they list a folder, without touching the message
+        # itself. Messages stored before there was metadata have empty
+        # fields and get them computed from the message.
+        #
+        metadata = self.ctx.metadata or {}
+
         # Based on the operation figure out what subroutine does the rest
         # of the work.
         #
         if self.attribute == "body":
-            result = self.body(self.ctx.msg, self.section).decode()
+            if metadata.get("header") and self.header_section():
+                msg = HeaderParser().parsestr(metadata["header"])
+            else:
+                msg = self.ctx.msg
+            result = self.body(msg, self.section).decode()
         elif self.attribute == "bodystructure":
-            result = self.bodystructure(self.ctx.msg)
+            result = metadata.get("bodystructure" if self.ext_data else "bodystructure_noext")
+            if not result:
+                result = self.bodystructure(self.ctx.msg)
         elif self.attribute == "envelope":
-            result = self.envelope(self.ctx.msg)
+            result = metadata.get("envelope") or self.envelope(self.ctx.msg)
         elif self.attribute == "flags":
             result = "(%s)" % " ".join([constants.seq_to_flag(x) for x in self.ctx.sequences])
         elif self.attribute == "internaldate":
             result = '"%s"' % self.ctx.internal_date.strftime("%d-%b-%Y %H:%m:%S %z")
         elif self.attribute == "rfc822.size":
-            # result = str(len(self.ctx.mailbox.mailbox.get_string(
-            #     self.ctx.msg_key)))
-            fp = StringIO()
-            g = Generator(fp, mangle_from_=False)
-            g.flatten(self.ctx.msg)
-            result = str(len(fix_eols(fp.getvalue())))
+            result = str(self.ctx.size)
         elif self.attribute == "uid":
             result = str(self.ctx.uid)
         else:
@@ -324,6 +364,21 @@ class FetchAtt(object):
 
         return "%s %s" % (str(self), result)
 
+    #######################################################################
+    #
+    def header_section(self):
+        """
+        True if this is a BODY[HEADER], BODY[HEADER.FIELDS (..)] or
+        BODY[HEADER.FIELDS.NOT (..)] fetch, which only need the headers of the
+        message.
+        """
+        if not self.section or len(self.section) != 1:
+            return False
+        section = self.section[0]
+        if isinstance(section, (list, tuple)):
+            section = section[0]
+        return isinstance(section, str) and section.upper() in ("HEADER", "HEADER.FIELDS", "HEADER.FIELDS.NOT")
+
     #######################################################################
     #
     def body(self, msg, section):
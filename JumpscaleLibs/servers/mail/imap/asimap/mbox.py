@@ -38,6 +38,11 @@ digits_re = re.compile(r"^[0-9]+$")
 #
 MBOX_EXPIRY_TIME = 900
 
+# How many messages FETCH loads the metadata of with one query on the
+# message index.
+#
+FETCH_BATCH = 500
+
 
 ####################################################################
 #
@@ -143,6 +148,12 @@ class Mailbox(object):
         self.uids = []
         self.subscribed = False
 
+        # The (modseq, number of messages, highest message key) of the folder
+        # at the end of the last resync. As long as it does not change there
+        # is nothing to resync.
+        #
+        self.state = None
+
         # Some commands can take a significant amount of time to run.  Like
         # when some client asks for detailed information from message headers
         # for _every_ message in a folder of 15,000 messages..
@@ -221,6 +232,8 @@ class Mailbox(object):
 
         # The dict of clients that currently have this mailbox selected.
         # This includes clients that used 'EXAMINE' instead of 'SELECT'
+        # The key is the id of the client handler, the connections of a user
+        # share the mailbox and may come from the same port on other hosts.
         #
         self.clients = {}
 
@@ -330,8 +343,10 @@ class Mailbox(object):
           not ask for the UID's they should be okay with getting that info.
 
         - `optional`: If this is True then this entire resync will be skipped
-          as a no-op if the mtime on the folder is NOT different than the mtime
-          in self.mtime. Watching the server do its thing almost all of the
+          as a no-op if the state of the folder (its modseq, which goes up with
+          every change made through IMAP, its number of messages and its highest
+          message key, which change when mail is delivered) is the same as at the end of the last resync. Watching
+          the server do its thing almost all of the
           resyncs could be skipped because the state on the folder had not
           changed. This is made to be a flag because there are times when we
           want a resync to happen even if the mtime has not changed. The result
@@ -352,14 +367,12 @@ class Mailbox(object):
             self.mtime = Mailbox.get_actual_mtime(self.server.mailbox, self.name)
             return
 
-        # Get the mtime of the folder at the start so when we need to check to
-        #
-        start_mtime = Mailbox.get_actual_mtime(self.server.mailbox, self.name)
-
-        # If `optional` is set and the mtime is the same as what is on disk
-        # then we can totally skip this resync run.
+        # If `optional` is set and the folder did not change since the last
+        # resync we can totally skip this resync run. This costs two queries
+        # on the index, whatever the size of the folder.
         #
-        if optional and start_mtime <= self.mtime:
+        state = self.mailbox.get_state()
+        if optional and state == self.state:
             return
 
         # If only_notify is not None then notify is forced to False.
@@ -373,23 +386,35 @@ class Mailbox(object):
             except mailbox.ExternalClashError:
                 self.log.warn("resync: unable to get mailbox lock")
                 raise MailboxLock(mbox=self)
+            # Message keys only grow, so unless messages were removed the
+            # messages of the folder are the ones we knew plus the ones with a
+            # higher key. If the count does not add up we list them all.
+            #
+            msgs = None
+            if self.uids and not force:
+                msgs = self.uids + self.mailbox.keys_after(self.uids[-1])
+                if len(msgs) != state[1]:
+                    msgs = None
+            if msgs is None:
+                msgs = list(self.mailbox.keys())
+            seq = self.mailbox.get_sequences()
+
             # Whenever we resync the mailbox we update the sequence for 'seen'
             # based on 'seen' are all the messages that are NOT in the
             # 'unseen' sequence.
             #
-            msgs = list(self.mailbox.keys())
-            seq = self.mailbox.get_sequences()
-
             if "unseen" in seq:
                 # Create the 'Seen' sequence by the difference between all the
                 # messages in the mailbox and the unseen ones.
                 #
-                seq["Seen"] = list(set(msgs) - set(seq["unseen"]))
+                seen = list(set(msgs) - set(seq["unseen"]))
             else:
                 # There are no unseen messages in the mailbox thus the Seen
                 # sequence mirrors the set of all messages.
                 #
-                seq["Seen"] = msgs
+                seen = msgs
+            seen_changed = set(seen) != set(seq.get("Seen", []))
+            seq["Seen"] = seen
 
             # A mailbox gets '\Marked' if it has any unseen messages or
             # '\Recent' messages.
@@ -399,12 +424,15 @@ class Mailbox(object):
             else:
                 self.marked(False)
 
-            self.mailbox.set_sequences(seq)
+            # Only write the sequences if they changed, every write is a
+            # change of the folder for all the other sessions.
+            #
+            if seen_changed:
+                self.mailbox.set_sequences(seq)
 
             self.next_uid = msgs[-1] + 1 if msgs else 1
-            found_uids = list(set(self.uids) - set(msgs))
-            if found_uids:
-                self.send_expunges(found_uids)
+            if set(self.uids) - set(msgs):
+                self.send_expunges(msgs)
             self.uids = msgs
 
             # Before we finish if the number of messages in the folder or the
@@ -428,11 +456,7 @@ class Mailbox(object):
                 #
                 to_notify = []
                 for client in self.clients.values():
-                    if (
-                        notify
-                        or client.idling
-                        or (only_notify is not None and only_notify.client.port == client.client.port)
-                    ):
+                    if notify or client.idling or (only_notify is not None and only_notify is client):
 
                         to_notify.append(client.client)
 
@@ -480,9 +504,10 @@ class Mailbox(object):
         finally:
             self.mailbox.unlock()
 
-        # And update the mtime before we leave..
+        # And update the mtime and state before we leave..
         #
         self.mtime = Mailbox.get_actual_mtime(self.server.mailbox, self.name)
+        self.state = self.mailbox.get_state()
         # Update the attributes seeing if this folder has children or not.
         #
         self.check_set_haschildren_attr()
@@ -556,6 +581,7 @@ class Mailbox(object):
         # And go through each message and publish a FETCH to every client with
         # all the flags that this message has.
         #
+        msg_idxs = {msg: idx for idx, msg in enumerate(msgs, 1)} if changed_msgs else {}
         for msg in sorted(list(changed_msgs)):
             flags = []
             for seq in list(seqs.keys()):
@@ -566,10 +592,10 @@ class Mailbox(object):
             # to ignore.
             #
             flags = " ".join(flags)
-            msg_idx = msgs.index(msg) + 1
+            msg_idx = msg_idxs[msg]
             clients = []
             for client in self.clients.values():
-                if dont_notify and client.client.port == dont_notify.client.port:
+                if dont_notify and client is dont_notify:
                     continue
                 clients.append(client)
 
@@ -968,7 +994,7 @@ class Mailbox(object):
         Arguments:
         - `client`: The client that has selected this mailbox.
         """
-        if client.client.port in self.clients:
+        if id(client) in self.clients:
             raise No("Mailbox '%s' is already selected" % self.name)
 
         if "\\Noselect" in self.attributes:
@@ -989,7 +1015,7 @@ class Mailbox(object):
             # we will not potentially send EXISTS and RECENT messages to the
             # client twice.
             #
-            self.clients[client.client.port] = client
+            self.clients[id(client)] = client
 
             # Now send back messages to this client that it expects upon
             # selecting a mailbox.
@@ -1045,7 +1071,7 @@ class Mailbox(object):
                     commands.
         """
         if client:
-            return any(x[0].client.port == client.client.port for x in self.command_queue)
+            return any(x[0] is client for x in self.command_queue)
         else:
             return len(self.command_queue) > 0
 
@@ -1067,17 +1093,17 @@ class Mailbox(object):
         # We only bother with doing anything in the client is actually
         # in this mailbox's list of clients.
         #
-        if client.client.port not in self.clients:
+        if id(client) not in self.clients:
             return
 
-        del self.clients[client.client.port]
+        del self.clients[id(client)]
 
         # Also if this client currently has any pending commands for this
         # folder they are tossed since the client is no longer associatd with
         # this folder.
         #
         if self.command_queue:
-            self.command_queue = [x for x in self.command_queue if x[0].client.port == client.client.port]
+            self.command_queue = [x for x in self.command_queue if x[0] is not client]
 
         if len(self.clients) == 0:
             self.log.debug("unselected(): No clients, starting expiry timer")
@@ -1185,7 +1211,7 @@ class Mailbox(object):
             clients_to_notify = {}
             clients_to_pend = []
             if client is not None:
-                clients_to_notify[client.client.port] = client
+                clients_to_notify[id(client)] = client
 
             for port, c in self.clients.items():
                 if c.idling:
@@ -1297,23 +1323,33 @@ class Mailbox(object):
                 #
                 msgs = msgs[cmd.msg_idxs :]
 
-            # Go through the messages one by one and pass them to the search
-            # object to see if they are or are not in the result set..
+            # Let the index of the messages narrow down which messages we have
+            # to look at, only what it can not answer is matched against the
+            # messages one by one.
             #
-            self.log.debug("Applying search to messages: %s" % str(search))
+            plan = asearch.SearchPlan(search, uid_max, fulltext=self.mailbox.fulltext_table)
+            self.log.debug("Applying search to messages: %s" % str(plan))
+            candidates = None
+            if plan.where is not None:
+                candidates = set(self.mailbox.search_ids(plan.where, plan.params))
 
             for idx, msg in enumerate(msgs):
                 # IMAP messages are numbered starting from 1.
                 #
                 i = idx + 1
-                ctx = asearch.SearchContext(self, msg, i, seq_max, uid_max, self.sequences)
-                if search.match(ctx):
-                    # The UID SEARCH command returns uid's of messages
-                    #
-                    if cmd.uid_command:
-                        results.append(ctx.uid)
-                    else:
-                        results.append(i)
+                if candidates is not None and msg not in candidates:
+                    continue
+                if plan.residual is not None:
+                    ctx = asearch.SearchContext(self, msg, i, seq_max, uid_max, self.sequences)
+                    if not plan.residual.match(ctx):
+                        continue
+
+                # The UID SEARCH command returns uid's of messages
+                #
+                if cmd.uid_command:
+                    results.append(self.get_uid_from_msg(msg)[1])
+                else:
+                    results.append(i)
 
                 # If after processing that message we have exceeded how much
                 # time we may spend in a fetch we store how far we have gotten
@@ -1463,7 +1499,8 @@ class Mailbox(object):
             #
             seq_changed = False
             fetch_started = time.time()
-            for idx in msg_idxs:
+            metadata = {}
+            for pos, idx in enumerate(msg_idxs):
                 try:
                     msg_key = msgs[idx - 1]
                 except IndexError:
@@ -1474,7 +1511,19 @@ class Mailbox(object):
                     self.log.warn(log_msg)
                     raise MailboxInconsistency(log_msg)
 
+                # Load the metadata of the messages in batches from the
+                # message index instead of loading every message.
+                #
+                if msg_key not in metadata:
+                    keys = [msgs[i - 1] for i in msg_idxs[pos : pos + FETCH_BATCH] if 0 < i <= len(msgs)]
+                    metadata = {key: self.server.msg_cache.get_metadata(self.name, key) for key in keys}
+                    missing = [key for key, value in metadata.items() if value is None]
+                    for key, value in self.mailbox.get_metadata(missing).items():
+                        metadata[key] = value
+                        self.server.msg_cache.add_metadata(self.name, key, value)
+
                 ctx = asearch.SearchContext(self, msg_key, idx, seq_max, uid_max, self.sequences)
+                ctx.metadata = metadata.get(msg_key)
                 fetched_flags = False
                 fetched_body = False
                 iter_results = []
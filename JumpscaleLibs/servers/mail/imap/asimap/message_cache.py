@@ -23,14 +23,119 @@ can tell us to clear all the entries for that mailbox.
 #
 
 import logging
-import time
+from collections import OrderedDict
 
 # asimap imports
 #
 from .exceptions import MailboxInconsistency
-from functools import reduce
 
 CACHE_SIZE = 20971520  # Max cache size (in bytes) -- 20MiB
+METADATA_CACHE_SIZE = 4194304  # Max metadata cache size (in bytes) -- 4MiB
+
+
+##################################################################
+##################################################################
+#
+class _LRU(object):
+    """
+    A LRU of (mailbox, msg key) -> value limited in the number of octets of
+    its values. The entries are kept in an OrderedDict, least recently used
+    first, so lookups and evictions are O(1). A per mailbox set of keys lets
+    us clear a mailbox without going over the whole cache.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, max_size):
+        """
+        Arguments:
+        - `max_size`: Limit in octets of the values we will store
+        """
+        self.max_size = max_size
+        self.cur_size = 0
+        self.entries = OrderedDict()
+        self.keys_by_mailbox = {}
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    ##################################################################
+    #
+    def __len__(self):
+        return len(self.entries)
+
+    ##################################################################
+    #
+    def add(self, mbox, msg_key, value, size):
+        key = (mbox, msg_key)
+        self.remove(mbox, msg_key)
+        if size > self.max_size:
+            return
+        self.entries[key] = (size, value)
+        self.keys_by_mailbox.setdefault(mbox, set()).add(msg_key)
+        self.cur_size += size
+        while self.cur_size > self.max_size:
+            (old_mbox, old_key), (old_size, _) = self.entries.popitem(last=False)
+            self._forget(old_mbox, old_key, old_size)
+            self.evictions += 1
+
+    ##################################################################
+    #
+    def get(self, mbox, msg_key):
+        key = (mbox, msg_key)
+        entry = self.entries.get(key)
+        if entry is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        self.entries.move_to_end(key)
+        return entry[1]
+
+    ##################################################################
+    #
+    def remove(self, mbox, msg_key):
+        entry = self.entries.pop((mbox, msg_key), None)
+        if entry is not None:
+            self._forget(mbox, msg_key, entry[0])
+        return entry
+
+    ##################################################################
+    #
+    def _forget(self, mbox, msg_key, size):
+        self.cur_size -= size
+        keys = self.keys_by_mailbox[mbox]
+        keys.discard(msg_key)
+        if not keys:
+            del self.keys_by_mailbox[mbox]
+
+    ##################################################################
+    #
+    def clear_mbox(self, mbox):
+        for msg_key in list(self.keys_by_mailbox.get(mbox, ())):
+            self.remove(mbox, msg_key)
+
+    ##################################################################
+    #
+    def clear(self):
+        self.entries.clear()
+        self.keys_by_mailbox = {}
+        self.cur_size = 0
+
+    ##################################################################
+    #
+    @property
+    def stats(self):
+        lookups = self.hits + self.misses
+        return {
+            "size": self.cur_size,
+            "max_size": self.max_size,
+            "messages": len(self.entries),
+            "mailboxes": len(self.keys_by_mailbox),
+            "hits": self.hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+            "hitrate": float(self.hits) / lookups if lookups else 0.0,
+        }
 
 
 ##################################################################
@@ -42,8 +147,12 @@ class MessageCache(object):
 
     Cache in memory MHMessage objects for quick future retrieval.
 
-    Expire older messages from the cache when the total size of all of
-    the messages exceeds a set limit.
+    Expire the least recently used messages from the cache when the total
+    size of all of the messages exceeds a set limit.
+
+    The FETCH metadata of messages (see fetch.message_metadata) is cached
+    separately with its own limit, so that listing big folders does not push
+    the full messages out of the cache and vice versa.
 
     Allow a way to clear all messages in the cache that belong to a
     specific mailbox.
@@ -53,37 +162,70 @@ class MessageCache(object):
 
     ##################################################################
     #
-    def __init__(self, max_size=CACHE_SIZE):
+    def __init__(self, max_size=CACHE_SIZE, metadata_size=METADATA_CACHE_SIZE):
         """
-        Default size: 20mb
+        Default size: 20mb for messages, 4mb for metadata
 
         Arguments:
 
         - `max_size`: Limit in octets of how many messages we will
           store in the cache.
+        - `metadata_size`: Limit in octets of the metadata we will store in
+          the cache, 0 to not cache metadata.
         """
         self.log = logging.getLogger("%s.%s" % (__name__, self.__class__.__name__))
-        self.max_size = max_size
-        self.cur_size = 0
-        self.num_msgs = 0
-        self.msgs_by_mailbox = {}
+        self.msgs = _LRU(max_size)
+        self.metadata = _LRU(metadata_size)
         return
 
+    ##################################################################
+    #
+    @property
+    def max_size(self):
+        return self.msgs.max_size
+
+    ##################################################################
+    #
+    @property
+    def cur_size(self):
+        return self.msgs.cur_size
+
     ##################################################################
     #
     def __str__(self):
         """
         For string return the object and some stats about it.
         """
-        num_msgs = reduce(lambda x, y: x + y, [len(z) for z in self.msgs_by_mailbox.values()])
-        return "<%s.%s: size: %d, number of mboxes: %d, number of " "messages: %d" % (
+        stats = self.msgs.stats
+        return "<%s.%s: size: %d, number of mboxes: %d, number of messages: %d, hit rate: %.1f%%>" % (
             __name__,
             self.__class__.__name__,
-            self.cur_size,
-            len(self.msgs_by_mailbox),
-            num_msgs,
+            stats["size"],
+            stats["mailboxes"],
+            stats["messages"],
+            stats["hitrate"] * 100,
         )
 
+    ##################################################################
+    #
+    @property
+    def stats(self):
+        """
+        Counters of the cache, a dict with for the messages (`messages`) and
+        the metadata (`metadata`) the size, max size, number of cached
+        entries and mailboxes, hits, misses, evictions and hit rate.
+        """
+        return {"messages": self.msgs.stats, "metadata": self.metadata.stats}
+
+    ##################################################################
+    #
+    def stats_reset(self):
+        """
+        Reset the hit, miss and eviction counters.
+        """
+        for lru in (self.msgs, self.metadata):
+            lru.hits = lru.misses = lru.evictions = 0
+
     ##################################################################
     #
     def add(self, mbox, msg_key, msg):
@@ -108,33 +250,7 @@ class MessageCache(object):
             self.log.error("add: mailbox '%s' inconsistency msg key %d has no" " UID header" % (mbox, msg_key))
             raise MailboxInconsistency(mbox_name=mbox, msg_key=msg_key)
 
-        if mbox not in self.msgs_by_mailbox:
-            self.msgs_by_mailbox[mbox] = []
-
-        msg_size = len(msg.as_string())
-        self.cur_size += msg_size
-        self.msgs_by_mailbox[mbox].append((msg_key, msg_size, msg, time.time()))
-
-        # If we have exceeded our max size remove the oldest messages
-        # until we go under our max size.
-        #
-        while self.cur_size > self.max_size:
-            oldest = None
-            for mbox_name in self.msgs_by_mailbox.keys():
-                if len(self.msgs_by_mailbox[mbox_name]) == 0:
-                    continue
-                if oldest is None:
-                    oldest = (mbox_name, self.msgs_by_mailbox[mbox_name][0])
-                elif oldest[1][3] > self.msgs_by_mailbox[mbox_name][0][3]:
-                    oldest = (mbox_name, self.msgs_by_mailbox[mbox_name][0])
-            if oldest is None:
-                self.log.warn("Unable to get cur_size %d under max size %d" % (self.cur_size, self.max_size))
-                return
-            self.msgs_by_mailbox[oldest[0]].pop(0)
-            if len(self.msgs_by_mailbox[oldest[0]]) == 0:
-                del self.msgs_by_mailbox[oldest[0]]
-            # self.log.debug("removing from cache: %s" % str(oldest))
-            self.cur_size -= oldest[1][1]
+        self.msgs.add(mbox, msg_key, msg, len(msg.as_string()))
         return
 
     ##################################################################
@@ -150,31 +266,39 @@ class MessageCache(object):
         Arguments:
         - `mbox`: name of the mbox we are looking in
         - `msg_key`: The MH folder key we are looking up
-        - `remove`: instead of re-adding this message to the end of a
-          mailbox's list we just remove it from the mailbox.
+        - `remove`: instead of marking the message as most recently used we
+          remove it from the cache.
         """
-        if mbox not in self.msgs_by_mailbox:
-            return None
+        if remove:
+            entry = self.msgs.remove(mbox, msg_key)
+            return entry[1] if entry else None
+        return self.msgs.get(mbox, msg_key)
 
-        result = None
-        for msg_item in self.msgs_by_mailbox[mbox]:
-            if msg_item[0] == msg_key:
-                result = msg_item
-                break
+    ##################################################################
+    #
+    def add_metadata(self, mbox, msg_key, metadata):
+        """
+        Add the FETCH metadata of a message to the cache.
 
-        if result is None:
-            return None
+        Arguments:
+        - `mbox`: name of the mailbox of the message
+        - `msg_key`: The key for this message
+        - `metadata`: dict as returned by the mailbox's get_metadata
+        """
+        size = sum(len(v) if isinstance(v, str) else 8 for v in metadata.values())
+        self.metadata.add(mbox, msg_key, metadata, size)
 
-        # If we did find our message then we remove it from the list and
-        # append it to the end of the list, resetting its time.
-        #
-        self.msgs_by_mailbox[mbox].remove(result)
-        if not remove:
-            result = (result[0], result[1], result[2], time.time())
-            self.msgs_by_mailbox[mbox].append(result)
-        else:
-            self.cur_size -= result[1]
-        return result[2]
+    ##################################################################
+    #
+    def get_metadata(self, mbox, msg_key):
+        """
+        The cached FETCH metadata of a message, None if it is not cached.
+
+        Arguments:
+        - `mbox`: name of the mailbox of the message
+        - `msg_key`: The key for this message
+        """
+        return self.metadata.get(mbox, msg_key)
 
     ##################################################################
     #
@@ -190,27 +314,25 @@ class MessageCache(object):
         - `mbox`: Name of the mailbox this message is in
         - `msg_key`: the MH folder key for the message.
         """
-        self.get(mbox, msg_key, remove=True)
+        self.msgs.remove(mbox, msg_key)
 
     ##################################################################
     #
     def clear_mbox(self, mbox):
         """
-        Clear all cached messages for the given mailbox.
+        Clear all cached messages and metadata for the given mailbox.
 
         Arguments:
         - `mbox`: name of the nailbox cache to clear
         """
-        if mbox not in self.msgs_by_mailbox:
-            return
-        for msg_item in self.msgs_by_mailbox[mbox]:
-            self.cur_size -= msg_item[1]
-        del self.msgs_by_mailbox[mbox]
-        self.log.debug(
-            "Clear mbox %s from the message cache, "
-            "new size: %d (%.1f%% full, %.1fMib)"
-            % (mbox, self.cur_size, (self.cur_size / self.max_size) * 100, (self.cur_size / 1048576))
-        )
+        self.msgs.clear_mbox(mbox)
+        self.metadata.clear_mbox(mbox)
+        if self.max_size:
+            self.log.debug(
+                "Clear mbox %s from the message cache, "
+                "new size: %d (%.1f%% full, %.1fMib)"
+                % (mbox, self.cur_size, (self.cur_size / self.max_size) * 100, (self.cur_size / 1048576))
+            )
         return
 
     ##################################################################
@@ -219,6 +341,6 @@ class MessageCache(object):
         """
         Clear the entire cache.
         """
-        self.msgs_by_mailbox = {}
-        self.cur_size = 0
+        self.msgs.clear()
+        self.metadata.clear()
         return
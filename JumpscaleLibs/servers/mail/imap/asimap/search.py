@@ -9,10 +9,9 @@ structure.
 
 # system imports
 #
+import calendar
 import logging
-import os.path
 import pytz
-import time
 from datetime import datetime
 
 # asimap imports
@@ -21,6 +20,7 @@ from . import utils
 from . import constants
 from .exceptions import MailboxInconsistency
 from ...handleMail import object_to_message
+from .fetch import message_metadata
 
 
 ############################################################################
@@ -71,7 +71,6 @@ class SearchContext(object):
         # self.msg = mailbox.mailbox.get_message(msg_key)
         # self.uid_vv, self.uid = [int(x) for x in
         #                          self.msg['x-asimapd-uid'].strip().split('.')]
-        self.internal_date = datetime.fromtimestamp(time.time(), pytz.UTC)
 
         # msg & uid are looked up and set ONLY if the search actually reaches
         # in to the message. We use read only attributes to fill in these
@@ -81,8 +80,45 @@ class SearchContext(object):
         self._uid_vv = None
         self._uid = None
         self._sequences = None
+        self._internal_date = None
+
+        # The metadata of the message from the message index, if it was
+        # loaded in bulk for a FETCH.
+        #
+        self.metadata = None
         return
 
+    ##################################################################
+    #
+    @property
+    def internal_date(self):
+        """
+        The internal date of the message, which is the time it was stored in
+        the mailbox.
+        """
+        if self._internal_date is None:
+            if self.metadata:
+                mtime = self.metadata["mtime"]
+            else:
+                mtime = self.mailbox.mailbox.get_message_mtime(self.msg_key)
+            self._internal_date = datetime.fromtimestamp(mtime, pytz.UTC)
+        return self._internal_date
+
+    ##################################################################
+    #
+    @property
+    def size(self):
+        """
+        The RFC822 size of the message. Messages stored before we recorded the
+        size get it computed from the message.
+        """
+        if self.metadata and self.metadata["size"]:
+            return self.metadata["size"]
+        obj = self._get_object()
+        if obj.size:
+            return obj.size
+        return message_metadata(object_to_message(obj))["size"]
+
     ##################################################################
     #
     @property
@@ -90,8 +126,16 @@ class SearchContext(object):
         """
         The message parsed in to a MHMessage object
         """
+        return object_to_message(self._get_object())
+
+    ##################################################################
+    #
+    def _get_object(self):
+        """
+        The stored message object, loaded the first time it is needed
+        """
         if self._object:
-            return object_to_message(self._object)
+            return self._object
 
         # We have not actually loaded the message yet..
         #
@@ -112,7 +156,7 @@ class SearchContext(object):
             if self._uid != uid or uid is None:
                 raise MailboxInconsistency(mbox_name=self.mailbox.name, msg_key=self.msg_key)
 
-        return object_to_message(self._object)
+        return self._object
 
     ##################################################################
     #
@@ -393,7 +437,8 @@ class IMAPSearch(object):
         for msg_part in self.ctx.msg.walk():
             if msg_part.is_multipart():
                 continue
-            if msg_part.get_payload(decode=True).lower().find(text) != -1:
+            payload = msg_part.get_payload(decode=True) or b""
+            if payload.decode(errors="replace").lower().find(text) != -1:
                 return True
         return False
 
@@ -404,7 +449,7 @@ class IMAPSearch(object):
         Messages with an [RFC-822] size larger than the specified
         number of octets.
         """
-        return os.path.getsize(self.ctx.path) > self.args["n"]
+        return self.ctx.size > self.args["n"]
 
     #########################################################################
     #
@@ -420,7 +465,7 @@ class IMAPSearch(object):
         sequence number in our mailbox.
         """
         for elt in self.args["msg_set"]:
-            if isinstance(elt, str) and elt == "*" and self.ctx.msg_number == self.id_max:
+            if isinstance(elt, str) and elt == "*" and self.ctx.msg_number == self.ctx.seq_max:
                 return True
             elif isinstance(elt, int) and elt == self.ctx.msg_number:
                 return True
@@ -492,7 +537,7 @@ class IMAPSearch(object):
         Messages with an [RFC-822] size larger than the specified
         number of octets.
         """
-        return os.path.getsize(self.ctx.path) < self.args["n"]
+        return self.ctx.size < self.args["n"]
 
     #########################################################################
     #
@@ -530,3 +575,261 @@ class IMAPSearch(object):
                     elif self.ctx.uid <= elt[1]:
                         return True
         return False
+
+
+############################################################################
+#
+# The headers we have a column for in the message index, and the name of that
+# column.
+#
+INDEXED_HEADERS = {"from": "from_email", "to": "to_email", "subject": "subject"}
+
+# Nr of seconds in a day, used to turn the IMAP dates (which are days) in to
+# ranges on the epoch columns of the message index.
+#
+DAY = 24 * 60 * 60
+
+
+############################################################################
+#
+def _epoch(date):
+    """
+    The unix epoch of the start of the day of the given (UTC) datetime.
+    """
+    return calendar.timegm(date.date().timetuple())
+
+
+############################################################################
+#
+def _like(string):
+    """
+    A LIKE pattern matching any value containing string.
+    """
+    string = string.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return "%" + string + "%"
+
+
+############################################################################
+#
+class SearchPlan(object):
+    """
+    Splits an IMAPSearch in a part that can be answered by the SQL index of
+    the messages (the message table of the BCDB model) and the part that has
+    to be matched message per message.
+
+    After planning:
+
+    - `where`: the SQL condition (with `params`) selecting the candidate
+      messages, None if every message is a candidate.
+    - `residual`: the IMAPSearch the candidates still need to match, None if
+      the SQL condition is exact.
+
+    The SQL condition always selects a superset of the messages the search
+    matches, so when we can only narrow down a search key (like SENTSINCE,
+    of which the index only knows the date without timezone) we put both a
+    condition in the SQL and the search key in the residual.
+
+    BODY and TEXT are answered by the full text table of the messages when
+    there is one. Its trigram tokenizer can only look up strings of at
+    least 3 characters, shorter ones are matched per message.
+    """
+
+    ##################################################################
+    #
+    def __init__(self, search, uid_max, fulltext=None):
+        """
+        Arguments:
+        - `search`: the IMAPSearch to plan
+        - `uid_max`: the highest uid in the mailbox, what '*' means in a UID set
+        - `fulltext`: name of the full text table of the messages, if any
+        """
+        self.uid_max = uid_max
+        self.fulltext = fulltext
+        self.params = []
+        self.where, self.residual = self._plan(search)
+
+    ##################################################################
+    #
+    def __str__(self):
+        return "SearchPlan(where = %s, params = %s, residual = %s)" % (self.where, self.params, self.residual)
+
+    ##################################################################
+    #
+    def _plan(self, search):
+        """
+        Returns the tuple (sql, residual) for the search, the parameters of
+        the sql are appended to self.params in order.
+        """
+        method = getattr(self, "_plan_%s" % search.op, None)
+        if method is None:
+            return None, search
+        return method(search)
+
+    ##################################################################
+    #
+    def _plan_all(self, search):
+        return None, None
+
+    ##################################################################
+    #
+    def _plan_and(self, search):
+        clauses = []
+        residuals = []
+        for search_key in search.args["search_key"]:
+            sql, residual = self._plan(search_key)
+            if sql is not None:
+                clauses.append(sql)
+            if residual is not None:
+                residuals.append(residual)
+        sql = " AND ".join("(%s)" % clause for clause in clauses) if clauses else None
+        if not residuals:
+            residual = None
+        elif len(residuals) == 1:
+            residual = residuals[0]
+        else:
+            residual = IMAPSearch(IMAPSearch.OP_AND, search_key=residuals)
+        return sql, residual
+
+    ##################################################################
+    #
+    def _plan_or(self, search):
+        # Each branch selects a superset of what it matches so the OR of them
+        # is a superset of the OR, but as soon as one branch can not be
+        # expressed in sql every message is a candidate.
+        #
+        nr_params = len(self.params)
+        clauses = []
+        exact = True
+        for search_key in search.args["search_key"]:
+            sql, residual = self._plan(search_key)
+            if residual is not None:
+                exact = False
+            if sql is None:
+                del self.params[nr_params:]
+                return None, search
+            clauses.append(sql)
+        return " OR ".join("(%s)" % clause for clause in clauses), None if exact else search
+
+    ##################################################################
+    #
+    def _plan_not(self, search):
+        # Only an exact condition can be negated.
+        #
+        nr_params = len(self.params)
+        sql, residual = self._plan(search.args["search_key"])
+        if residual is not None:
+            del self.params[nr_params:]
+            return None, search
+        if sql is None:
+            # NOT ALL
+            return "0", None
+        return "NOT (%s)" % sql, None
+
+    ##################################################################
+    #
+    def _plan_uid(self, search):
+        clauses = []
+        for elt in search.args["msg_set"]:
+            if isinstance(elt, str) and elt == "*":
+                clauses.append("id = ?")
+                self.params.append(self.uid_max)
+            elif isinstance(elt, int):
+                clauses.append("id = ?")
+                self.params.append(elt)
+            elif isinstance(elt, tuple):
+                if elt[1] == "*":
+                    clauses.append("id >= ?")
+                    self.params.append(elt[0])
+                else:
+                    clauses.append("id BETWEEN ? AND ?")
+                    self.params.extend([elt[0], elt[1]])
+        if not clauses:
+            return "0", None
+        return " OR ".join(clauses), None
+
+    ##################################################################
+    #
+    def _plan_header(self, search):
+        # LIKE only folds the case of ascii characters.
+        #
+        column = INDEXED_HEADERS.get(search.args["header"].lower())
+        if column is None or not all(ord(c) < 128 for c in search.args["string"]):
+            return None, search
+        self.params.append(_like(search.args["string"]))
+        return "%s LIKE ? ESCAPE '\\'" % column, None
+
+    ##################################################################
+    #
+    def _plan_before(self, search):
+        self.params.append(_epoch(search.args["date"]))
+        return "mtime < ?", None
+
+    ##################################################################
+    #
+    def _plan_on(self, search):
+        start = _epoch(search.args["date"])
+        self.params.extend([start, start + DAY])
+        return "mtime >= ? AND mtime < ?", None
+
+    ##################################################################
+    #
+    def _plan_since(self, search):
+        self.params.append(_epoch(search.args["date"]))
+        return "mtime >= ?", None
+
+    ##################################################################
+    #
+    def _plan_sentbefore(self, search):
+        self.params.append(_epoch(search.args["date"]) + DAY)
+        return "date < ?", search
+
+    ##################################################################
+    #
+    def _plan_senton(self, search):
+        start = _epoch(search.args["date"])
+        self.params.extend([start - DAY, start + 2 * DAY])
+        return "date >= ? AND date < ?", search
+
+    ##################################################################
+    #
+    def _plan_sentsince(self, search):
+        self.params.append(_epoch(search.args["date"]) - DAY)
+        return "date >= ?", search
+
+    ##################################################################
+    #
+    def _plan_larger(self, search):
+        # Messages stored before we recorded the size have size 0, those
+        # always have to be checked.
+        #
+        self.params.append(search.args["n"])
+        return "size > ? OR size IS NULL OR size = 0", search
+
+    ##################################################################
+    #
+    def _plan_smaller(self, search):
+        self.params.append(search.args["n"])
+        return "size < ?", search
+
+    ##################################################################
+    #
+    def _plan_fulltext(self, search, column):
+        string = search.args["string"]
+        if self.fulltext is None or len(string) < 3:
+            return None, search
+        # A phrase of the trigram tokenizer matches any substring.
+        #
+        self.params.append('"%s"' % string.replace('"', '""'))
+        return "id IN (SELECT rowid FROM %s WHERE %s MATCH ?)" % (self.fulltext, column), None
+
+    ##################################################################
+    #
+    def _plan_body(self, search):
+        return self._plan_fulltext(search, "body")
+
+    ##################################################################
+    #
+    def _plan_text(self, search):
+        # The table name as column matches on all columns
+        #
+        return self._plan_fulltext(search, self.fulltext)
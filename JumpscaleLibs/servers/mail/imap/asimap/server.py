@@ -2,22 +2,34 @@ from .auth import AUTH_SYSTEMS
 from .client import PreAuthenticated, Authenticated
 from .parse import IMAPClientCommand
 from .user_server import IMAPUserServer
-from . import parse
+from . import parse, message_cache, trace
 
 
+import gevent
 from gevent.server import StreamServer
 
 import re
 import logging
 import traceback
 
+log = logging.getLogger(__name__)
+
 sessions = {}
 
 
-RE_LITERAL_STRING_START = re.compile(r"\{(\d+)\+?\}$")
+RE_LITERAL_STRING_START = re.compile(rb"\{(\d+)(\+?)\}$")
 
 USED_REGEXPS = {}
 
+# seconds between two checks of the folders clients are idling on
+IDLE_CHECK_INTERVAL = 10
+
+# bytes read from a connection at once
+READ_SIZE = 64 * 1024
+
+# responses are sent once this many bytes are buffered, or when the command is done
+WRITE_BUFFER_SIZE = 64 * 1024
+
 
 def regexp(expr, item):
     """
@@ -41,9 +53,165 @@ def regexp(expr, item):
     return None
 
 
+class Connection:
+    """
+    Buffered IMAP connection
+
+    Responses pushed while a command is processed are collected and sent in
+    large writes, when the buffer is full or when the server waits for the
+    next command. Pushes at other times, like notifications for a client in
+    IDLE, are sent immediately.
+    """
+
+    def __init__(self, socket, address, write_buffer_size=WRITE_BUFFER_SIZE):
+        self.socket = socket
+        self.address = address
+        self.name = "%s:%s" % (address[0], address[1])
+        self.write_buffer_size = write_buffer_size
+        self.connected = True
+        self.buffering = False
+        self._input = bytearray()
+        self._output = []
+        self._output_size = 0
+
+    @property
+    def rem_addr(self):
+        return self.address[0]
+
+    @property
+    def port(self):
+        return self.address[1]
+
+    @property
+    def pending(self):
+        """
+        True if the client already sent more than we read, it is pipelining commands
+        """
+        return len(self._input) > 0
+
+    def push(self, data):
+        """
+        send data to the client
+        :param data: str or bytes
+        """
+        if not self.connected:
+            return
+        if isinstance(data, str):
+            data = data.encode()
+        if trace.trace_enabled:
+            line = data.split(b"\r\n", 1)[0]
+            line = line.decode(errors="replace")
+            trace.trace({"connection": self.name, "direction": "S", "line": line, "length": len(data)})
+        self._output.append(data)
+        self._output_size += len(data)
+        if not self.buffering or self._output_size >= self.write_buffer_size:
+            self.flush()
+
+    def flush(self):
+        """
+        send the buffered responses, a connection which fails is closed
+        """
+        if not self._output:
+            return
+        data = b"".join(self._output)
+        self._output = []
+        self._output_size = 0
+        try:
+            self.socket.sendall(data)
+        except OSError as e:
+            log.debug("could not send to %s: %s" % (self.name, e))
+            self.connected = False
+            self.socket.close()
+
+    def close(self):
+        if self.connected:
+            self.flush()
+        self.connected = False
+        self.socket.close()
+
+    def _fill(self):
+        data = self.socket.recv(READ_SIZE)
+        if not data:
+            raise EOFError("connection closed by %s" % self.name)
+        self._input += data
+
+    def readline(self):
+        """
+        :return: the next line, with its line ending, as bytes
+        """
+        start = 0
+        while True:
+            end = self._input.find(b"\n", start)
+            if end >= 0:
+                break
+            start = len(self._input)
+            self._fill()
+        line = bytes(self._input[: end + 1])
+        del self._input[: end + 1]
+        return line
+
+    def read(self, size):
+        """
+        :return: the next size bytes
+        """
+        while len(self._input) < size:
+            self._fill()
+        data = bytes(self._input[:size])
+        del self._input[:size]
+        return data
+
+    def read_command(self):
+        """
+        read a full command, including its literals
+
+        The client waits for a continuation before sending a synchronizing
+        literal {n}, a non synchronizing one {n+} (LITERAL+) follows right away.
+        The literals are given to the parser decoded, with their length in
+        characters.
+        :return: the command as str
+        """
+        parts = []
+        line = self.readline()
+        while True:
+            m = RE_LITERAL_STRING_START.search(line.rstrip(b"\r\n"))
+            if not m:
+                parts.append(line.decode(errors="replace"))
+                break
+            if not m.group(2):
+                self.push("+ Ready for more input\r\n")
+                self.flush()
+            literal = self.read(int(m.group(1))).decode(errors="replace")
+            parts.append(line[: m.start()].decode(errors="replace"))
+            parts.append("{%d}\r\n" % len(literal))
+            parts.append(literal)
+            line = self.readline()
+        command = "".join(parts)
+        if trace.trace_enabled:
+            trace.trace({"connection": self.name, "direction": "C", "line": parts[0].strip(), "length": len(command)})
+        return command
+
+
 class Server:
-    def __init__(self, address, port, models):
+    def __init__(
+        self,
+        address,
+        port,
+        models,
+        cache_size=message_cache.CACHE_SIZE,
+        metadata_cache_size=message_cache.METADATA_CACHE_SIZE,
+        trace_dir=None,
+    ):
+        """
+        :param trace_dir: dir to write a trace of the protocol to, "stderr" to write it to stderr, None for no trace
+        """
         self.models = models
+        if trace_dir:
+            trace.enable_tracing(trace_dir)
+        # one message cache for all the users, so its size is the memory budget of the whole server
+        self.msg_cache = message_cache.MessageCache(cache_size, metadata_cache_size)
+        # one user server per user, shared by all the connections of that user
+        self.user_servers = {}
+        self._housekeeper = None
         self.address = address
         self.port = port
         self.server = StreamServer((self.address, self.port), self.handle)
@@ -52,7 +220,39 @@ class Server:
     def add_regex_function(self):
         self.models.folder.index.db.register_function(regexp, "REGEXP", 2)
 
-    def handle_msg(self, socket, msg, client_handler):
+    def get_user_server(self, username):
+        """
+        the user server of a user, made when the first connection of that user authenticates
+        """
+        user_server = self.user_servers.get(username)
+        if user_server is None:
+            user_server = IMAPUserServer(username, self.models, self.msg_cache)
+            self.user_servers[username] = user_server
+        if self._housekeeper is None:
+            self._housekeeper = gevent.spawn(self._housekeeping_loop)
+        return user_server
+
+    def housekeeping(self):
+        """
+        resync the folders clients idle on, once per user for all their connections,
+        expire the folders and user servers nobody uses anymore
+        """
+        for username, user_server in list(self.user_servers.items()):
+            try:
+                user_server.check_all_active_folders()
+                user_server.expire_inactive_folders()
+            except Exception:
+                logging.getLogger(__name__).error("housekeeping of %s failed:\n%s" % (username, traceback.format_exc()))
+            if user_server.expired():
+                user_server.shutdown()
+                del self.user_servers[username]
+
+    def _housekeeping_loop(self):
+        while True:
+            gevent.sleep(IDLE_CHECK_INTERVAL)
+            self.housekeeping()
+
+    def handle_msg(self, client, msg, client_handler):
         try:
             imap_cmd = IMAPClientCommand(msg)
             imap_cmd.parse()
@@ -62,97 +262,59 @@ class Server:
                 if imap_cmd.tag == "DONE":
                     client_handler.do_done(None)
                     return
-                msg = b"%s BAD %s\r\n" % (imap_cmd.tag.encode(), str(e).encode("utf8"))
+                msg = "%s BAD %s\r\n" % (imap_cmd.tag, e)
             else:
-                msg = b"* BAD %s\r\n" % (msg).encode()
-            socket.send(b"%d\n" % len(msg))
-            socket.send(msg)
-            print(f"Something went wrong: {msg}")
+                msg = "* BAD %s\r\n" % msg.strip()
+            client.push(msg)
+            log.warning("bad command from %s: %s" % (client.name, msg.strip()))
             return
         try:
             client_handler.command(imap_cmd)
         except Exception as e:
             tb = traceback.format_exc()
-            msg = f"Exception handling IMAP command {imap_cmd.command}({imap_cmd.tag}) for {e}:\n{tb}"
-            print(msg)
-
-        if client_handler.state == "logged_out":
-            if socket is not None:
-                socket.close()
+            log.error(f"Exception handling IMAP command {imap_cmd.command}({imap_cmd.tag}) for {e}:\n{tb}")
 
     def handle(self, socket, address):
-        # socket.setblocking(True)
-        terminator = "\r\n"
-        file = socket.makefile("rw", newline=terminator)
+        client = Connection(socket, address)
+        client_handler = PreAuthenticated(client, AUTH_SYSTEMS["simple_auth"], self.models)
+        client.push("* OK [IMAP4REV1 IDLE ID SELECT UNSELECT UIDPLUS LITERAL+ CHILDREN]\r\n")
+        client.flush()
 
-        class Client:
-            def __init__(self, socket):
-                self.socket = socket
-
-            def push(self, data):
-                print(f"S: {data.splitlines()[0].strip()} # {len(data)}")
+        try:
+            while client.connected:
                 try:
-                    return self.socket.sendall(data.encode())
-                except:
-                    if client_handler.state == "logged_out":
-                        return
-                    raise
-
-            @property
-            def rem_addr(self):
-                return address[0]
-
-            @property
-            def port(self):
-                return address[1]
-
-            def __getattr__(self, item):
-                return getattr(self.socket, item)
+                    data = client.read_command()
+                except EOFError:
+                    break
 
-        c = Client(socket)
+                if not data.strip():
+                    client.push("* BAD We do not accept empty messages.\r\n")
+                    client.flush()
+                    continue
 
-        reading_string_literal = True
-        client_handler = PreAuthenticated(c, AUTH_SYSTEMS["simple_auth"], self.models)
-        socket.send(b"* OK [IMAP4REV1 IDLE ID SELECT UNSELECT UIDPLUS LITERAL+ CHILDREN]\r\n")
-
-        while socket is not None:
-            if reading_string_literal:
-                reading_string_literal = False
-                continue
-
-            # data = socket.recv(1024).decode()
-            data = file.readline()
-
-            if not data:
-                try:
-                    socket.send(b"* BAD We do not accept empty messages.\r\n")
-                except BrokenPipeError:
-                    socket = None
-                continue
-
-            print(f"C: {data.strip()}")
-            m = RE_LITERAL_STRING_START.search(data.strip())
-            if m:
-                neededdata = int(m.group(1)) + 2
-                reading_string_literal = True
-                # file.writelines(["+ Ready for more input"])
-                data += file.read(neededdata)
-            if not data.endswith("\r\n"):
-                data = data + "\r\n"
-            self.handle_msg(socket, data, client_handler)
-            if isinstance(client_handler, PreAuthenticated) and client_handler.state == "authenticated":
-                client_handler = Authenticated(
-                    c, IMAPUserServer(client_handler.user.imap_username, self.models), self.models
-                )
-            elif client_handler.state == "logged_out":
-                socket.close()
-                socket = None
-        # Handle client disconnection
-        print("Client disconnected")
-        client_handler.state = "non_authenticated"
-        client_handler.user = None
-        if socket:
-            socket.close()
+                # the responses of pipelined commands are sent together, once
+                # the client has to wait for them
+                client.buffering = True
+                self.handle_msg(client, data, client_handler)
+                if isinstance(client_handler, PreAuthenticated) and client_handler.state == "authenticated":
+                    user_server = self.get_user_server(client_handler.user.imap_username)
+                    client_handler = Authenticated(client, user_server, self.models)
+                    user_server.client_connected(client_handler)
+                elif client_handler.state == "logged_out":
+                    break
+                if not client.pending:
+                    client.buffering = False
+                    client.flush()
+        except OSError as e:
+            log.debug("connection %s failed: %s" % (client.name, e))
+        finally:
+            # Handle client disconnection
+            log.debug("client %s disconnected" % client.name)
+            if isinstance(client_handler, Authenticated):
+                client_handler.server.client_disconnected(client_handler)
+            client_handler.state = "non_authenticated"
+            client_handler.user = None
+            client.close()
 
     def start(self):
         self.server.serve_forever()
@@ -65,6 +65,7 @@ def enable_tracing(logdir, trace_file=None):
     Keyword Arguments:
     logdir -- The directory in to which write the trace files
     """
+    global trace_enabled
     trace_logger.setLevel(logging.INFO)
 
     if logdir == "stderr" and not trace_file:
@@ -91,6 +92,7 @@ def enable_tracing(logdir, trace_file=None):
     formatter = TraceFormatter("%(asctime)s %(message)s")
     h.setFormatter(formatter)
     trace_logger.addHandler(h)
+    trace_enabled = True
 
 
 ####################################################################
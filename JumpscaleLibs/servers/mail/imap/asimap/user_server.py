@@ -17,7 +17,6 @@ import logging
 import os
 import os.path
 import time
-import errno
 import random
 
 # jumpscale
@@ -36,6 +35,9 @@ log = logging.getLogger("asimap.%s" % __name__)
 
 BACKLOG = 5
 
+# seconds a user server is kept around after its last client disconnected
+USER_SERVER_EXPIRY = 1800
+
 
 ####################################################################
 #
@@ -66,7 +68,7 @@ class IMAPUserServer:
 
     ##################################################################
     #
-    def __init__(self, username, models):
+    def __init__(self, username, models, msg_cache=None):
         """
         Setup our dispatcher.. listen on a port we are supposed to accept
         connections on. When something connects to it create an
@@ -75,6 +77,8 @@ class IMAPUserServer:
         Arguments:
         - `options` : The options set on the command line
         - `maildir` : The directory our mailspool and database are in
+        - `msg_cache` : The MessageCache shared by the user servers, a
+          private one is made if not given
         """
         # self.options = options
 
@@ -103,27 +107,83 @@ class IMAPUserServer:
         #
         self.active_mailboxes = {}
 
-        # A dict of the active IMAP clients that are talking to us.
+        # A dict of the active IMAP clients that are talking to us. All the
+        # connections of a user share one user server.
         #
-        # The key is the port number of the attached client.
+        # The key is the id of the client handler.
         #
         self.clients = {}
 
-        # There is a single message cache per user server instance.
+        # The message cache is normally shared by all user servers so there
+        # is a single memory budget for the whole server.
         #
-        self.msg_cache = message_cache.MessageCache()
+        self.msg_cache = msg_cache if msg_cache is not None else message_cache.MessageCache()
 
         # When we have any connected clients self.expiry gets set to
         # None. Otherwise use it to determine when we have hung around long
         # enough with no connected clients and decide to exit.
         #
-        self.expiry = time.time() + 1800
+        self.expiry = time.time() + USER_SERVER_EXPIRY
 
         # and finally restore any pesistent state stored in the db for the user
         # server.
         #
         return
 
+    ##################################################################
+    #
+    def client_connected(self, client):
+        """
+        An authenticated IMAP client of our user starts using this user
+        server.
+
+        Arguments:
+        - `client`: the Authenticated client handler of the connection
+        """
+        self.clients[id(client)] = client
+        self.expiry = None
+        return
+
+    ##################################################################
+    #
+    def client_disconnected(self, client):
+        """
+        The connection of an IMAP client went away. The mailbox it had
+        selected forgets about it and, if it was the last client, our expiry
+        timer starts.
+
+        Arguments:
+        - `client`: the Authenticated client handler of the connection
+        """
+        if client.mbox is not None:
+            client.mbox.unselected(client)
+            client.mbox = None
+        self.clients.pop(id(client), None)
+        if not self.clients:
+            self.expiry = time.time() + USER_SERVER_EXPIRY
+        return
+
+    ##################################################################
+    #
+    def expired(self):
+        """
+        Returns True if no client used this user server for longer than its
+        expiry time.
+        """
+        return not self.clients and self.expiry is not None and self.expiry < time.time()
+
+    ##################################################################
+    #
+    def shutdown(self):
+        """
+        Drop all the active mailboxes, called before the user server is thrown
+        away. Their state is in the db already.
+        """
+        for mbox_name in self.active_mailboxes:
+            self.msg_cache.clear_mbox(mbox_name)
+        self.active_mailboxes = {}
+        return
+
     ##################################################################
     #
     def has_queued_commands(self):
@@ -277,8 +337,11 @@ class IMAPUserServer:
         """
         Like 'check_all_folders' except this only checks folders that are
         active and have clients in IDLE listening to them.
+
+        The connections of a user share the mailboxes, so one resync of a
+        folder notifies all the clients idling on it.
         """
-        for name, mbox in self.active_mailboxes.items():
+        for name, mbox in list(self.active_mailboxes.items()):
             if any(x.idling for x in mbox.clients.values()):
                 try:
                     self.log.debug("check_all_active: checking '%s'" % name)
@@ -307,7 +370,6 @@ class IMAPUserServer:
                 expired.append(mbox_name)
 
         for mbox_name in expired:
-            self.active_mailboxes[mbox_name].commit_to_db()
             del self.active_mailboxes[mbox_name]
             self.msg_cache.clear_mbox(mbox_name)
         if len(expired) > 0:
@@ -357,8 +419,9 @@ class IMAPUserServer:
     #
     def check_all_folders(self, force=False):
         """
-        This goes through all of the folders and sees if any of the mtimes we
-        have on disk disagree with the mtimes we have in the database.
+        This goes through all of the folders and sees if the state (modseq,
+        number of messages, highest message key) of any of the active ones
+        differs from the state of their last resync.
 
         If they do we then do a resync of that folder.
 
@@ -369,31 +432,16 @@ class IMAPUserServer:
         of this run.
 
         - `force` : If True this will force a full resync on all
-                    mailbox regardless of their mtimes.
+                    mailbox regardless of their modseq.
         """
         start_time = time.time()
         self.log.debug("check_all_folders begun")
 
-        # Get all of the folders and mtimes we know about from the sqlite db at
-        # the beginning. This takes more memory (not _that_ much really in the
-        # grand scheme of things) but it gives the answers in one go-round to
-        # the db and we get to deal with the data in an easier format.
+        # Get the names (and modseq, for the log) of all folders in one query
+        # on the index.
         #
-        mboxes = []
-        c = self.db.cursor()
-        c.execute("select name, mtime from mailboxes where attributes " "not like '%%ignored%%' order by name")
-        for row in c:
-            mboxes.append(row)
-        c.close()
-
-        # Now go through all of the extant mailboxes and see
-        # if their mtimes have changed warranting us to force them to resync.
-        #
-        # XXX We should probably skip folders that are active and have been
-        #     resync'd in the last 30 seconds because those are already checked
-        #     by another process.
-        #
-        for mbox_name, mtime in mboxes:
+        mboxes = self.mailbox.query_folder(["name", "modseq"], "where attributes not like '%ignored%' order by name")
+        for mbox_name, modseq in mboxes.fetchall():
             # If this mailbox is active and has a client idling on it OR if it
             # has queued commands then we can skip doing a resync here. It has
             # been handled already. It is especially important not to do
@@ -401,45 +449,32 @@ class IMAPUserServer:
             # queued command. It might cause messages to be generated and reset
             # various bits of state that are important to the queued command.
             #
-            if mbox_name in self.active_mailboxes and (
-                any(x.idling for x in self.active_mailboxes[mbox_name].clients.values())
-                or len(self.active_mailboxes[mbox_name].command_queue) > 0
-            ):
+            mbox = self.active_mailboxes.get(mbox_name)
+            if mbox is not None and (any(x.idling for x in mbox.clients.values()) or len(mbox.command_queue) > 0):
                 continue
 
-            path = os.path.join(self.mailbox._path, mbox_name)
-            seq_path = os.path.join(path, ".mh_sequences")
+            # Inactive folders are only looked at when forced, they are
+            # resynced when a client selects them anyway.
+            #
+            if mbox is None and not force:
+                continue
+            # The modseq only goes up for changes made through IMAP, mails
+            # delivered over SMTP show in the number of messages and the
+            # highest message key.
+            #
+            if not force and mbox.state is not None and mbox.state == mbox.mailbox.get_state():
+                continue
             try:
-                fmtime = asmbox.Mailbox.get_actual_mtime(self.mailbox, mbox_name)
-                if (fmtime > mtime) or force:
-                    # The mtime differs.. force the mailbox to resync.
-                    #
-                    self.log.debug(
-                        "check_all_folders: doing resync on '%s' "
-                        "stored mtime: %d, actual mtime: %d" % (mbox_name, mtime, fmtime)
-                    )
-                    m = self.get_mailbox(mbox_name, 30)
-                    if (m.mtime >= fmtime) and not force:
-                        # Looking at the actual mailbox its mtime is NOT
-                        # earlier than the mtime of the actual folder so we can
-                        # skip this resync. But commit the mailbox data to the
-                        # db so that the actual mtime value is stored.
-                        #
-                        m.commit_to_db()
-                    else:
-                        # Yup, we need to resync this folder.
-                        m.resync(force=force)
+                self.log.debug("check_all_folders: doing resync on '%s', modseq: %s" % (mbox_name, modseq))
+                if mbox is None:
+                    mbox = self.get_mailbox(mbox_name, 30)
+                mbox.resync(force=force)
             except (MailboxLock, MailboxInconsistency) as e:
                 # If hit one of these exceptions they are usually
                 # transient.  we will skip it. The command processor in
                 # client.py knows how to handle these better.
                 #
                 self.log.warn("check_all_folders: skipping '%s' due to: " "%s" % (mbox_name, str(e)))
-            except (OSError, IOError) as e:
-                if e.errno == errno.ENOENT:
-                    self.log.error(
-                        "check_all_folders: One of %s or %s does " "not exist for mtime check" % (path, seq_path)
-                    )
 
         self.log.debug("check_all_folders finished, Took %f seconds" % (time.time() - start_time))
         return
@@ -3,10 +3,13 @@ import io
 import time
 from gevent.lock import Semaphore
 from collections import defaultdict
-from ..handleMail import store_message, object_to_message
+from ..handleMail import store_message, object_to_message, fulltext_table, fulltext_remove, attachments_release
 
 locks = defaultdict(Semaphore)
 
+# the columns of the message index FETCH answers from, see get_metadata
+METADATA_FIELDS = ["mtime", "size", "header", "envelope", "bodystructure", "bodystructure_noext"]
+
 
 class BCDBMailbox(mailbox.Mailbox):
     def __init__(self, models, obj, create=False):
@@ -25,19 +28,57 @@ class BCDBMailbox(mailbox.Mailbox):
         for key in sorted(self._models.message.find_ids(folder=self._obj.name)):
             yield key
 
+    def keys_after(self, key):
+        """
+        keys of the messages in this folder above key, keys only grow so these are the messages added
+        since the message with that key was
+        """
+        query = "select id from {} where folder = ? and id > ? order by id;".format(
+            self._models.message.index.sql_table_name
+        )
+        return [row[0] for row in self._models.message.query(query, [self._obj.name, key]).fetchall()]
+
+    @property
+    def modseq(self):
+        """
+        the modification sequence of the folder, it goes up on every change of its messages or sequences made
+        through a folder object (mails delivered by the smtp server are not), see get_state
+        read from the index so changes made through other folder objects count as well
+        """
+        query = "select modseq from {} where name = ?;".format(self._models.folder.index.sql_table_name)
+        row = self._models.folder.query(query, [self._obj.name]).fetchone()
+        return (row[0] or 0) if row else 0
+
+    def get_state(self):
+        """
+        :return: (modseq, nr of messages, highest message key) of the folder, if none of them changed
+                 the folder did not change
+        """
+        query = "select count(id), max(id) from {} where folder = ?;".format(self._models.message.index.sql_table_name)
+        count, last = self._models.message.query(query, [self._obj.name]).fetchone()
+        return self.modseq, count, last or 0
+
+    def _changed(self):
+        self._obj.mtime = int(time.time())
+        self._obj.modseq = self.modseq + 1
+        self._obj.save()
+
     def get_sequences(self):
         return self._obj.sequences
 
     def remove(self, key):
+        attachments_release(self._models.message.get(key))
         self._models.message.delete(key)
+        fulltext_remove(self._models.message, [key])
+        self._changed()
 
     def set_sequences(self, seq):
-        self._obj.mtime = int(time.time())
         self._obj.sequences = seq
-        self._obj.save()
+        self._changed()
 
     def add(self, message):
         msg = store_message(self._models.message, message, self._obj.name, False, False)
+        self._changed()
         return msg.id
 
     def get_file(self, key):
@@ -75,6 +116,37 @@ class BCDBMailbox(mailbox.Mailbox):
         mtime = cursor.fetchone()[0]
         return mtime
 
+    def search_ids(self, where, values=None):
+        """
+        ids of the messages in this folder matching the sql condition where
+        :param where: sql condition on the columns of the message index
+        :param values: values for the placeholders in where
+        """
+        query = "select id from {} where folder = ? and ({});".format(self._models.message.index.sql_table_name, where)
+        cursor = self._models.message.query(query, [self._obj.name] + list(values or []))
+        return [row[0] for row in cursor.fetchall()]
+
+    @property
+    def fulltext_table(self):
+        """
+        name of the full text table of the messages, None if there is none
+        """
+        return fulltext_table(self._models.message)
+
+    def get_metadata(self, keys):
+        """
+        the FETCH metadata of many messages at once, from the message index
+        :param keys: list of message keys, sqlite limits a query to 999 of them
+        :return: dict key -> dict with METADATA_FIELDS
+        """
+        if not keys:
+            return {}
+        query = "select id, {} from {} where id in ({});".format(
+            ", ".join(METADATA_FIELDS), self._models.message.index.sql_table_name, ",".join("?" * len(keys))
+        )
+        cursor = self._models.message.query(query, list(keys))
+        return {row[0]: dict(zip(METADATA_FIELDS, row[1:])) for row in cursor.fetchall()}
+
     def get_object(self, key):
         return self._models.message.get(key)
 
@@ -140,7 +212,9 @@ class BCDBMailbox(mailbox.Mailbox):
         folder = self._models.folder.find(name=folder_name)
         folder[0].delete()
         for message in messages:
+            attachments_release(message)
             message.delete()
+        fulltext_remove(self._models.message, [message.id for message in messages])
 
     def create_folder(self, name):
         if not self._models.folder.find(name=name):
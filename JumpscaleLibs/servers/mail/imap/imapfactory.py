@@ -1,6 +1,8 @@
 from Jumpscale import j
 from collections import namedtuple
 from .asimap.server import Server
+from .asimap.message_cache import CACHE_SIZE, METADATA_CACHE_SIZE
+from ..handleMail import fulltext_sync
 import os
 
 TESTTOOLS = j.baseclasses.testtools
@@ -9,12 +11,39 @@ TESTTOOLS = j.baseclasses.testtools
 class ImapServer(j.baseclasses.factory, TESTTOOLS):
     __jslocation__ = "j.servers.imap"
 
-    def start(self, address="0.0.0.0", port=7143):
-        self.get_instance(address, port).serve_forever()
+    def _init(self, **kwargs):
+        self._server = None
 
-    def get_instance(self, address, port):
+    def start(
+        self,
+        address="0.0.0.0",
+        port=7143,
+        cache_size=CACHE_SIZE,
+        metadata_cache_size=METADATA_CACHE_SIZE,
+        trace_dir=None,
+    ):
+        self.get_instance(address, port, cache_size, metadata_cache_size, trace_dir).serve_forever()
+
+    def get_instance(
+        self, address, port, cache_size=CACHE_SIZE, metadata_cache_size=METADATA_CACHE_SIZE, trace_dir=None
+    ):
+        """
+        :param cache_size: bytes of messages the server keeps in memory, shared by all users
+        :param metadata_cache_size: bytes of FETCH metadata the server keeps in memory, 0 to not cache it
+        :param trace_dir: dir to write a trace of the imap protocol to, "stderr" for stderr, None for no trace
+        """
         models = self.get_models()
-        return Server(address, port, models).server
+        self._server = Server(address, port, models, cache_size, metadata_cache_size, trace_dir)
+        return self._server.server
+
+    def cache_stats(self):
+        """
+        hit rate, evictions and size of the message cache of the running server
+        :return: dict with the stats of the cached messages and metadata, None if no server runs
+        """
+        if self._server is None:
+            return None
+        return self._server.msg_cache.stats
 
     def get_models(self):
         try:
@@ -33,6 +62,7 @@ class ImapServer(j.baseclasses.factory, TESTTOOLS):
             folder.save()
 
         message_model = bcdb.model_get(url="jumpscale.email.message")
+        fulltext_sync(message_model)
         Models = namedtuple("Models", "message folder")
         models = Models(message_model, folder_model)
         return models
@@ -9,6 +9,7 @@ class SmtpdFactory(j.baseclasses.object, j.baseclasses.testtools):
     def __init__(self, *args, **kwargs):
         super().__init__(*args, **kwargs)
         self._running_greenlet = None
+        self._server = None
 
     def start(self, address="0.0.0.0", port=7002):
         """
@@ -18,6 +19,7 @@ class SmtpdFactory(j.baseclasses.object, j.baseclasses.testtools):
         if self._running_greenlet:
             raise j.exceptions.Runtime("Server is already running")
         server = self.get_instance(address, port)
+        self._server = server
         self._running_greenlet = gevent.spawn(server.serve_forever)
         if j.sal.nettools.waitConnectionTest(ipaddr="localhost", port=7002, timeout=60):
             j.exceptions.Timeout("Server didn't start")
@@ -26,6 +28,16 @@ class SmtpdFactory(j.baseclasses.object, j.baseclasses.testtools):
         if self._running_greenlet:
             self._running_greenlet.kill()
             self._running_greenlet = None
+            self._server = None
+
+    def delivery_stats(self):
+        """
+        depth, latency and failures of the delivery queue of the running server
+        :return: dict, see DeliveryQueue.stats, None if no server runs
+        """
+        if self._server is None or self._server.queue is None:
+            return None
+        return self._server.queue.stats
 
     def get_instance(self, address="0.0.0.0", port=7002):
         from .app import MailServer
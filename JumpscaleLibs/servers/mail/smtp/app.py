@@ -1,10 +1,17 @@
 from Jumpscale import j
 from .gsmtpd import SMTPServer
 from ..handleMail import store_message
+from .delivery import DeliveryQueue
 
 
 class MailServer(SMTPServer):
-    def __init__(self, *args, **kwargs):
+    def __init__(self, *args, queue=True, queue_path=None, nr_workers=4, **kwargs):
+        """
+        :param queue: if True received mails are spooled in a DeliveryQueue and stored by its workers,
+                      the client gets its 250 as soon as the mail is on disk
+        :param queue_path: dir of the spool of the queue
+        :param nr_workers: nr of workers of the queue
+        """
         super().__init__(*args, **kwargs)
         try:
             self.smtpInstance = j.data.bcdb.get("mails")
@@ -16,12 +23,30 @@ class MailServer(SMTPServer):
             )
         )
         self.mail_model = self.smtpInstance.model_get(url="jumpscale.email.message")
+        self.queue = DeliveryQueue(self.mail_model, queue_path, nr_workers) if queue else None
+
+    def start(self):
+        if self.queue:
+            self.queue.start()
+        super().start()
+
+    def stop(self, *args, **kwargs):
+        super().stop(*args, **kwargs)
+        if self.queue:
+            self.queue.stop()
 
     # Do something with the gathered message
     def process_message(self, peer, mailfrom, rcpttos, data):
         self.store_mail(data)
         print("------------ Data saved In bcdb ------------")
 
+    def process_message_file(self, peer, mailfrom, rcpttos, fp):
+        if self.queue:
+            self.queue.put(fp)
+            return
+        # parse the message straight from the spool
+        self.store_mail(fp)
+
     def store_mail(self, data, is_send=False):
         if is_send:
             return store_message(self.mail_model, data, folder="Sent")
@@ -7,11 +7,16 @@ logger = logging.getLogger(__name__)
 from gevent import socket, ssl
 
 import errno
-from asynchat import find_prefix_at_end
+from tempfile import SpooledTemporaryFile
 
 NEWLINE = "\n"
 EMPTYSTRING = ""
 COMMASPACE = ", "
+CRLF = b"\r\n"
+# max length of a command line, rfc 5321 allows 512
+COMMAND_LIMIT = 4096
+# messages bigger than this are spooled to a temporary file instead of kept in memory
+SPOOL_SIZE = 1024000
 
 
 class SMTPChannel(object):
@@ -22,7 +27,11 @@ class SMTPChannel(object):
     COMMAND = 0
     DATA = 1
 
-    def __init__(self, server, conn, addr, data_size_limit=1024000):
+    def __init__(self, server, conn, addr, data_size_limit=1024000, spool_size=SPOOL_SIZE):
+        """
+        :param data_size_limit: max bytes of a message
+        :param spool_size: messages bigger than this many bytes are spooled to a temporary file
+        """
         self.server = server
         self.conn = conn
         self.addr = addr
@@ -31,11 +40,14 @@ class SMTPChannel(object):
         self.seen_greeting = 0
         self.mailfrom = None
         self.rcpttos = []
-        self.data = ""
+        # the message being received, written line by line while it comes in
+        self.spool = None
+        self.spool_size = spool_size
+        self.nr_lines = 0
         self.fqdn = socket.getfqdn()
-        self.ac_in_buffer_size = 4096
+        self.ac_in_buffer_size = 65536
 
-        self.ac_in_buffer = ""
+        self.ac_in_buffer = bytearray()
         self.closed = False
         self.data_size_limit = data_size_limit  # in byte
         self.current_size = 0
@@ -51,7 +63,6 @@ class SMTPChannel(object):
                 raise
             return
         self.push("220 %s GSMTPD at your service" % self.fqdn)
-        self.terminator = "\r\n"
         logger.debug("SMTP channel initialized")
 
     # Overrides base class for convenience
@@ -62,7 +73,19 @@ class SMTPChannel(object):
 
     # Implementation of base class abstract method
     def collect_incoming_data(self, data):
-        self.line.append(data)
+        """
+        in COMMAND state data is (part of) a command line, in DATA state it is a line of the message
+        which is already de-transparencied, it gets written to the spool
+        """
+        if self.state == self.DATA:
+            # lines are joined with \n, the line ends of the message become \n
+            if self.nr_lines:
+                self.spool.write(b"\n")
+                self.current_size += 1
+            self.spool.write(data)
+            self.nr_lines += 1
+        else:
+            self.line.append(bytes(data))
         self.current_size += len(data)
         if self.current_size > self.data_size_limit:
             self.push("452 Command has been aborted because mail too big")
@@ -70,9 +93,10 @@ class SMTPChannel(object):
 
     # Implementation of base class abstract method
     def found_terminator(self):
-        line = EMPTYSTRING.join(self.line)
-        self.line = []
         if self.state == self.COMMAND:
+            line = b"".join(self.line).decode(errors="replace")
+            self.line = []
+            self.current_size = 0
             if not line:
                 self.push("500 Error: bad syntax")
                 return
@@ -95,20 +119,19 @@ class SMTPChannel(object):
             if self.state != self.DATA:
                 self.push("451 Internal confusion")
                 return
-            # Remove extraneous carriage returns and de-transparency according
-            # to RFC 821, Section 4.5.2.
-            data = []
-            for text in line.split("\r\n"):
-                if text and text[0] == ".":
-                    data.append(text[1:])
-                else:
-                    data.append(text)
-            self.data = NEWLINE.join(data)
-            status = self.server.process_message(self.peer, self.mailfrom, self.rcpttos, self.data)
+            # the message is complete, handle_read already removed the carriage
+            # returns and the transparency dots (RFC 821, Section 4.5.2.)
+            spool = self.spool
+            spool.seek(0)
+            try:
+                status = self.server.process_message_file(self.peer, self.mailfrom, self.rcpttos, spool)
+            finally:
+                spool.close()
+            self.spool = None
+            self.current_size = 0
             self.rcpttos = []
             self.mailfrom = None
             self.state = self.COMMAND
-            self.terminator = "\r\n"
             if not status:
                 self.push("250 Ok")
             else:
@@ -212,7 +235,6 @@ class SMTPChannel(object):
         # Resets the sender, recipients, and data, but not the greeting
         self.mailfrom = None
         self.rcpttos = []
-        self.data = ""
         self.state = self.COMMAND
         self.push("250 Ok")
 
@@ -224,7 +246,9 @@ class SMTPChannel(object):
             self.push("501 Syntax: DATA")
             return
         self.state = self.DATA
-        self.terminator = "\r\n.\r\n"
+        self.spool = SpooledTemporaryFile(max_size=self.spool_size)
+        self.current_size = 0
+        self.nr_lines = 0
         self.push("354 End data with <CR><LF>.<CR><LF>")
 
     def smtp_STARTTLS(self, arg):
@@ -232,11 +256,10 @@ class SMTPChannel(object):
         if arg:
             self.push("501 Syntax: STARTTLS")
             return
-        self.push("220 Ready to start TLS")
-
-        if self.data:
+        if self.mailfrom:
             self.push("500 Too late to changed")
             return
+        self.push("220 Ready to start TLS")
 
         try:
             self.conn = ssl.wrap_socket(self.conn, **self.server.ssl)
@@ -266,73 +289,60 @@ class SMTPChannel(object):
             if len(data) == 0:
                 # issues 2 TCP connect closed will send a 0 size pack
                 self.close_when_done()
+                return
         except socket.error:
             self.handle_error()
             return
 
-        data = data.decode()
-        self.ac_in_buffer = self.ac_in_buffer + data
-
-        # Continue to search for self.terminator in self.ac_in_buffer,
-        # while calling self.collect_incoming_data.  The while loop
-        # is necessary because we might read several data+terminator
-        # combos with a single recv(4096).
-
-        while self.ac_in_buffer:
-            lb = len(self.ac_in_buffer)
-            logger.debug(self.ac_in_buffer)
-            if not self.terminator:
-                # no terminator, collect it all
-                self.collect_incoming_data(self.ac_in_buffer)
-                self.ac_in_buffer = ""
-            elif isinstance(self.terminator, int):
-                # numeric terminator
-                n = self.terminator
-                if lb < n:
-                    self.collect_incoming_data(self.ac_in_buffer)
-                    self.ac_in_buffer = ""
-                    self.terminator = self.terminator - lb
+        self.ac_in_buffer += data
+
+        # Hand over every complete line in the buffer, the while loop is
+        # necessary because we might read several lines with a single recv.
+        # The buffer only holds what came in since the last complete line,
+        # message lines are written to the spool without being copied.
+
+        buf = self.ac_in_buffer
+        start = 0
+        line = None
+        view = memoryview(buf)
+        try:
+            while not self.closed:
+                index = buf.find(CRLF, start)
+                if index == -1:
+                    break
+                line = view[start:index]
+                start = index + 2
+                if self.state == self.DATA:
+                    if line == b".":
+                        self.found_terminator()
+                        continue
+                    if line[:1] == b".":
+                        line = line[1:]
+                    self.collect_incoming_data(line)
                 else:
-                    self.collect_incoming_data(self.ac_in_buffer[:n])
-                    self.ac_in_buffer = self.ac_in_buffer[n:]
-                    self.terminator = 0
-                    self.found_terminator()
-            else:
-                # 3 cases:
-                # 1) end of buffer matches terminator exactly:
-                #    collect data, transition
-                # 2) end of buffer matches some prefix:
-                #    collect data to the prefix
-                # 3) end of buffer does not match any prefix:
-                #    collect data
-                terminator_len = len(self.terminator)
-                index = self.ac_in_buffer.find(self.terminator)
-                if index != -1:
-                    # we found the terminator
-                    if index > 0:
+                    if len(line):
                         # don't bother reporting the empty string (source of subtle bugs)
-                        self.collect_incoming_data(self.ac_in_buffer[:index])
-                    self.ac_in_buffer = self.ac_in_buffer[index + terminator_len :]
-                    # This does the Right Thing if the terminator is changed here.
+                        self.collect_incoming_data(line)
                     self.found_terminator()
-                else:
-                    # check for a prefix of the terminator
-                    index = find_prefix_at_end(self.ac_in_buffer, self.terminator)
-                    if index:
-                        if index != lb:
-                            # we found a prefix, collect up to the prefix
-                            self.collect_incoming_data(self.ac_in_buffer[:-index])
-                            self.ac_in_buffer = self.ac_in_buffer[-index:]
-                        break
-                    else:
-                        # no prefix, collect it all
-                        self.collect_incoming_data(self.ac_in_buffer)
-                        self.ac_in_buffer = ""
+        finally:
+            # the buffer can only be resized when no view on it is left
+            line = None
+            view.release()
+        del buf[:start]
+
+        # a line without end can not be bigger than what we accept
+        limit = self.data_size_limit if self.state == self.DATA else COMMAND_LIMIT
+        if len(buf) > limit and not self.closed:
+            self.push("500 Error: line too long")
+            self.close_when_done()
 
     def handle_error(self):
         self.close_when_done()
 
     def close_when_done(self):
+        if self.spool is not None:
+            self.spool.close()
+            self.spool = None
 
         if not self.conn.closed:
             logger.debug("CLOSED %s" % self.conn)
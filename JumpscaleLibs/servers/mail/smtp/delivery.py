@@ -0,0 +1,222 @@
+import os
+import time
+import shutil
+import itertools
+
+import gevent
+from gevent.queue import Queue, Empty
+from Jumpscale import j
+
+from ..handleMail import message_save, fulltext_add
+
+JSBASE = j.baseclasses.object
+
+# how many times a message is tried before it is moved to the failed dir
+MAX_ATTEMPTS = 5
+
+
+def _fsync_dir(path):
+    """
+    sync a dir to disk, so the files renamed in to it survive a crash
+    """
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+class DeliveryQueue(j.baseclasses.object):
+    """
+    Durable queue between receiving a mail and storing it in bcdb
+
+    A received mail is written to a spool file in `tmp`, synced to disk and renamed in to `new`,
+    from then on it survives a crash and the smtp client can get its 250.
+    The disk writes and syncs are done in the threadpool of the gevent hub, so they do not block the other greenlets.
+    Workers take batches of spooled mails, save them one by one, index them for full text search
+    and remove their spool files.
+    Once a mail is saved its id is written in `saved`, so a retry of a mail of which the indexing failed
+    does not save it a second time.
+    Mails which keep failing end up in `failed`, mails left in `new` by a previous run are delivered at start.
+    """
+
+    def __init__(self, model, path=None, nr_workers=4, batch=10, max_attempts=MAX_ATTEMPTS):
+        """
+        :param model: the bcdb model of the messages (jumpscale.email.message)
+        :param path: dir of the spool, default {VARDIR}/mail/queue
+        :param nr_workers: nr of greenlets storing mails
+        :param batch: max nr of spooled mails a worker takes at once
+        :param max_attempts: nr of times a mail is tried before it goes to failed
+        """
+        JSBASE.__init__(self)
+        self.model = model
+        self.path = path or j.sal.fs.joinPaths(j.dirs.VARDIR, "mail", "queue")
+        self.nr_workers = nr_workers
+        self.batch = batch
+        self.max_attempts = max_attempts
+        for name in ("tmp", "new", "saved", "failed"):
+            j.sal.fs.createDir(j.sal.fs.joinPaths(self.path, name))
+        self._queue = Queue()
+        self._attempts = {}
+        self._counter = itertools.count()
+        self._workers = []
+        self.nrqueued = 0
+        self.nrdelivered = 0
+        self.nrfailed = 0
+        self.nrretries = 0
+        self.nrtimed = 0
+        self.latency_total = 0.0
+        self.latency_max = 0.0
+
+    def put(self, message, folder="inbox"):
+        """
+        spool a mail, when this returns the mail is on disk
+        :param message: binary file like object or bytes with the mail
+        :param folder: the folder to store the mail in
+        :return: name of the spool file
+        """
+        name = "%d.%d.%d" % (time.time() * 1000000, os.getpid(), next(self._counter))
+        gevent.get_hub().threadpool.apply(self._spool, (name, message, folder))
+        self.nrqueued += 1
+        self._queue.put((name, time.time()))
+        return name
+
+    def _spool(self, name, message, folder):
+        # runs in the threadpool
+        tmppath = j.sal.fs.joinPaths(self.path, "tmp", name)
+        with open(tmppath, "wb") as f:
+            # first line is the folder, the mail follows
+            f.write(folder.encode() + b"\n")
+            if isinstance(message, (bytes, bytearray)):
+                f.write(message)
+            else:
+                shutil.copyfileobj(message, f)
+            f.flush()
+            os.fsync(f.fileno())
+        newpath = j.sal.fs.joinPaths(self.path, "new")
+        os.rename(tmppath, j.sal.fs.joinPaths(newpath, name))
+        _fsync_dir(newpath)
+
+    def start(self):
+        """
+        start the workers, mails spooled by a previous run are queued first
+        """
+        if self._workers:
+            return
+        for name in sorted(os.listdir(j.sal.fs.joinPaths(self.path, "new"))):
+            self._queue.put((name, None))
+        self._workers = [gevent.spawn(self._work) for _ in range(self.nr_workers)]
+
+    def stop(self):
+        """
+        stop the workers, the mails not stored yet stay spooled for the next start
+        """
+        workers = self._workers
+        self._workers = []
+        gevent.killall(workers)
+
+    def _work(self):
+        while True:
+            items = [self._queue.get()]
+            while len(items) < self.batch:
+                try:
+                    items.append(self._queue.get_nowait())
+                except Empty:
+                    break
+            for name, queued in items:
+                try:
+                    self._deliver(name, queued)
+                except Exception as e:
+                    # the spool file stays where it is, it is picked up again at the next start
+                    self._log_error("could not handle spooled mail %s: %s" % (name, e))
+
+    def _saved_get(self, name):
+        """
+        :return: id of the saved mail of a spool file, None if not saved yet
+        """
+        path = j.sal.fs.joinPaths(self.path, "saved", name)
+        if not os.path.exists(path):
+            return None
+        with open(path) as f:
+            return int(f.read())
+
+    def _saved_set(self, name, id):
+        gevent.get_hub().threadpool.apply(self._saved_write, (name, id))
+
+    def _saved_write(self, name, id):
+        # runs in the threadpool
+        savedpath = j.sal.fs.joinPaths(self.path, "saved")
+        with open(j.sal.fs.joinPaths(savedpath, name), "w") as f:
+            f.write(str(id))
+            f.flush()
+            os.fsync(f.fileno())
+        _fsync_dir(savedpath)
+
+    def _saved_remove(self, name):
+        path = j.sal.fs.joinPaths(self.path, "saved", name)
+        if os.path.exists(path):
+            os.remove(path)
+
+    def _deliver(self, name, queued):
+        path = j.sal.fs.joinPaths(self.path, "new", name)
+        try:
+            id = self._saved_get(name)
+            if id is None:
+                with open(path, "rb") as f:
+                    folder = f.readline().rstrip(b"\n").decode()
+                    mail = message_save(self.model, f, folder)
+                self._saved_set(name, mail.id)
+            else:
+                mail = self.model.get(id)
+            fulltext_add(self.model, mail)
+        except Exception as e:
+            attempts = self._attempts.get(name, 0) + 1
+            if attempts >= self.max_attempts:
+                self._attempts.pop(name, None)
+                self.nrfailed += 1
+                if self._saved_get(name) is None:
+                    self._log_error("could not deliver mail %s, moved to failed: %s" % (name, e))
+                    os.rename(path, j.sal.fs.joinPaths(self.path, "failed", name))
+                else:
+                    # the mail is stored, fulltext_sync indexes it later
+                    self._log_error("could not index mail %s for full text search: %s" % (name, e))
+                    os.remove(path)
+                    self._saved_remove(name)
+                return
+            self._attempts[name] = attempts
+            self.nrretries += 1
+            self._log_warning("could not deliver mail %s (attempt %s), will retry: %s" % (name, attempts, e))
+            gevent.spawn_later(attempts, self._queue.put, (name, queued))
+            return
+        self._attempts.pop(name, None)
+        os.remove(path)
+        self._saved_remove(name)
+        self.nrdelivered += 1
+        if queued is not None:
+            latency = time.time() - queued
+            self.nrtimed += 1
+            self.latency_total += latency
+            self.latency_max = max(self.latency_max, latency)
+
+    @property
+    def depth(self):
+        """
+        nr of mails spooled and not stored yet
+        """
+        return len(os.listdir(j.sal.fs.joinPaths(self.path, "new")))
+
+    @property
+    def stats(self):
+        """
+        :return: dict with the queue depth, nr of queued, delivered, failed mails, nr of retries,
+                 average and max seconds between spooling and storing a mail
+        """
+        return {
+            "depth": self.depth,
+            "queued": self.nrqueued,
+            "delivered": self.nrdelivered,
+            "failed": self.nrfailed,
+            "retries": self.nrretries,
+            "latency_avg": self.latency_total / self.nrtimed if self.nrtimed else 0.0,
+            "latency_max": self.latency_max,
+        }
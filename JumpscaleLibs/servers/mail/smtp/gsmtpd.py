@@ -45,7 +45,7 @@ from gevent.server import StreamServer
 import ssl
 from ssl import CERT_NONE
 
-from .channel import SMTPChannel
+from .channel import SMTPChannel, SPOOL_SIZE
 
 __all__ = ["SMTPServer", "DebuggingServer", "PureProxy", "SSLSettings"]
 
@@ -99,13 +99,16 @@ class SMTPServer(StreamServer):
     """Abstrcted SMTP server
     """
 
-    def __init__(self, localaddr=None, remoteaddr=None, timeout=1200, data_size_limit=10240000, **kwargs):
+    def __init__(
+        self, localaddr=None, remoteaddr=None, timeout=1200, data_size_limit=10240000, spool_size=SPOOL_SIZE, **kwargs
+    ):
         """Initialize SMTP Server
 
         :param localaddr: tuple pair that start server, like `('127.0.0.1', 25)`
         :param remoteaddr: ip address (string or list) that can relay on this server
         :param timeout: int that connection Timeout
         :param data_size_limit: max byte per mail data
+        :param spool_size: mails bigger than this many bytes are received in a temporary file instead of in memory
         :param kwargs: other key-arguments will pass to :class:`.SSLSettings`
         """
         self.relay = bool(remoteaddr)
@@ -122,6 +125,8 @@ class SMTPServer(StreamServer):
 
         self.data_size_limit = int(data_size_limit)
 
+        self.spool_size = int(spool_size)
+
         if "keyfile" in kwargs:
             self.ssl = SSLSettings(**kwargs)
 
@@ -135,7 +140,7 @@ class SMTPServer(StreamServer):
             return
         try:
             with Timeout(self.timeout, ConnectionTimeout):
-                sc = SMTPChannel(self, sock, addr, self.data_size_limit)
+                sc = SMTPChannel(self, sock, addr, self.data_size_limit, self.spool_size)
                 while not sc.closed:
                     sc.handle_read()
 
@@ -149,6 +154,20 @@ class SMTPServer(StreamServer):
             logger.error(err)
 
     # API for "doing something useful with the message"
+    def process_message_file(self, peer, mailfrom, rcpttos, fp):
+        """Called with every received message, override this to handle the message without reading it in a string.
+
+        :param peer: is a tuple containing (ipaddr, port) of the client that made\n
+                     the socket connection to our smtp port.
+        :param mailfrom: is the raw address the client claims the message is coming from.
+        :param rcpttos: is a list of raw addresses the client wishes to deliver the message to.
+        :param fp: is a binary file object positioned at the start of the message, with \\n line ends\n
+                   and `de-transparencied' like for :meth:`process_message`. It is closed after this returns.
+
+        By default the message is decoded and passed to :meth:`process_message`, whose return value is returned.
+        """
+        return self.process_message(peer, mailfrom, rcpttos, fp.read().decode(errors="replace"))
+
     def process_message(self, peer, mailfrom, rcpttos, data):
         """Override this abstract method to handle messages from the client.
 
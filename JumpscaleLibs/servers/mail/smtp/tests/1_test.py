@@ -1,4 +1,5 @@
 from smtplib import SMTP
+import gevent
 from Jumpscale import j
 
 
@@ -17,6 +18,12 @@ def test():
         # Send the mail
         smtp.sendmail(from_mail, "target@example.com", msg)
 
+    # Mails are stored by the delivery queue, wait for it
+    for _ in range(100):
+        if j.servers.smtp.delivery_stats()["depth"] == 0:
+            break
+        gevent.sleep(0.1)
+
     # Get the data from the database
     db = j.data.bcdb.get("mails")
     retrieved_model = db.model_get(url="jumpscale.email.message")
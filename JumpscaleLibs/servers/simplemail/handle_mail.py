@@ -1,3 +1,4 @@
+import time
 from collections import namedtuple
 from Jumpscale import j
 
@@ -5,6 +6,7 @@ import email
 import email.utils
 import base64
 
+from JumpscaleLibs.servers.mail.blobstore import BlobStore
 from .inbox import Inbox
 
 inbox = Inbox()
@@ -17,6 +19,26 @@ Attachment = namedtuple(
 
 ATTACHMENTS_PATH = "/sandbox/mail_attachments/"
 
+# seconds between two looks for attachment contents of which all files were removed
+BLOBS_COLLECT_INTERVAL = 3600
+
+_blobstore = None
+_blobs_collected = 0
+
+
+def _blobs():
+    """
+    the content of the attachments is kept once, the attachment files of the mails are hard links to it
+    the links are the references, a content is dropped once none of its files is left (see BlobStore.collect)
+    """
+    global _blobstore, _blobs_collected
+    if _blobstore is None:
+        _blobstore = BlobStore(j.sal.fs.joinPaths(ATTACHMENTS_PATH, ".blobs"))
+    if time.time() > _blobs_collected + BLOBS_COLLECT_INTERVAL:
+        _blobs_collected = time.time()
+        _blobstore.collect()
+    return _blobstore
+
 
 def _parse_email_body(body):
     """
@@ -95,7 +117,7 @@ def _handle_attachments(subject, attachments):
         file_path = f"{path}/{current_datatime}_{attachment_name}"
         attachments_fs_paths.append(file_path)
         file_content = base64.decodebytes(attachment_content.encode())
-        j.sal.fs.writeFile(file_path, file_content)
+        _blobs().put(file_content, dest=file_path)
 
     return attachments_fs_paths
 